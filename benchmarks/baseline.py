@@ -0,0 +1,153 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Golden outputs computed with the original implementations of
+# src/battery.py, src/cas.py, src/utils.py and src/download_and_process.py,
+# as they are in the git revision BASELINE_REV, so the benchmarks check the
+# current engines and EIA data preparation against the code they replace and
+# not against themselves.
+# These implementations are slow (the decade sizes take minutes), they
+# only run for python -m benchmarks.run --update-golden.
+
+import contextlib
+import importlib.util
+import io
+import os
+import re
+import subprocess
+import tempfile
+import pandas as pd
+
+from .generators import hourly_series, write_eba
+
+BASELINE_REV = "3a451c7"
+
+BASELINE_MODULES = ("battery", "cas", "utils", "download_and_process")
+
+# block_size of the baseline prepareEIAData's read_json
+BASELINE_BLOCK_SIZE = 2048576
+
+# hourly net generation series, the ones the EIA benchmarks count
+NG_SERIES = re.compile(r"^EBA\.[^.]+-ALL\.NG\.[^.]+\.H$")
+
+# Load src/<name>.py of rev as a module. battery, cas and utils only import
+# numpy and pandas, download_and_process also imports wget and pyarrow
+def load_module(name, rev=BASELINE_REV):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    source = subprocess.run(["git", "show", "{0}:src/{1}.py".format(rev, name)], cwd=root,
+                            check=True, capture_output=True, text=True).stdout
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = os.path.join(work_dir, name + ".py")
+        with open(path, "w") as f:
+            f.write(source)
+        spec = importlib.util.spec_from_file_location("baseline_" + name, path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module
+
+# Baseline modules of rev by name, each loaded (fresh) on first use
+class BaselineModules:
+    def __init__(self, rev=BASELINE_REV):
+        self.rev = rev
+        self.modules = {}
+
+    def __getitem__(self, name):
+        if name not in BASELINE_MODULES:
+            raise KeyError(name)
+        if name not in self.modules:
+            self.modules[name] = load_module(name, self.rev)
+        return self.modules[name]
+
+# Baseline runs: setup(hours, work_dir) returns the input state, like the
+# setups in run.py, and run(state, modules) the output summary of the
+# benchmark of the same name in run.py. A setup returns None for sizes the
+# baseline cannot run, their golden outputs are pinned instead.
+
+def setup_series(hours, work_dir):
+    return hourly_series(hours)
+
+# the benchmark's EBA.txt with string values, which the baseline reader
+# (pyarrow with inferred types) can parse, None if a series is longer than
+# the baseline reader's block size (as at the decade size), it then fails
+def setup_eba(hours, work_dir):
+    from .run import BAS
+    path = os.path.join(work_dir, "EBA.txt")
+    write_eba(path, hours + 24, BAS, as_strings=True)
+    with open(path, "rb") as f:
+        if max(map(len, f)) >= BASELINE_BLOCK_SIZE:
+            return None
+    return hours, work_dir
+
+def run_coverage(df, modules):
+    coverage = modules["utils"].calculate_coverage(df["tot_renewable"], df["avg_dc_power_mw"])
+    return {"coverage": float(coverage)}
+
+def run_sim_battery_247(df, modules):
+    b = modules["battery"].Battery2(10000, 10000)
+    feasible = modules["battery"].sim_battery_247(df["tot_renewable"], df, b)
+    return {"feasible": bool(feasible), "current_load": float(b.current_load)}
+
+def run_b2_sizer(df, modules):
+    capacity = modules["battery"].calculate_247_battery_capacity_b2_sim(df["tot_renewable"], df, 1e6)
+    return {"battery_capacity": float(capacity)}
+
+def run_cas(df, modules, flexible_workload_ratio=30, max_capacity=60):
+    from .run import schedule_summary
+    return schedule_summary(modules["cas"].cas(df, flexible_workload_ratio, max_capacity))
+
+def run_cas_max_capacity(df, modules):
+    return run_cas(df, modules, 50, 50)
+
+def run_cas_grid_mix(df, modules):
+    from .run import schedule_summary
+    return schedule_summary(modules["cas"].cas_grid_mix(df, 30, 60))
+
+# cosim is cas followed by apply_battery on its output
+def run_cosim(df, modules):
+    balanced_df = modules["cas"].cas(df, 30, 60)
+    non_ren_mwh, _ = modules["battery"].apply_battery(200, balanced_df["tot_renewable"].copy(), balanced_df)
+    sum_dc = balanced_df["avg_dc_power_mw"].sum()
+    return {"non_renewable_mwh": float(non_ren_mwh),
+            "coverage": float((sum_dc - non_ren_mwh) / sum_dc * 100)}
+
+def prepare(work_dir, modules):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return modules["download_and_process"].prepareEIAData(work_dir)
+
+def run_prepare(state, modules):
+    _, work_dir = state
+    eba_json, ba_list, ts_list = prepare(work_dir, modules)
+    total_mwh = 0.0
+    series = 0
+    for sid, data in zip(eba_json["series_id"], eba_json["data"]):
+        if isinstance(sid, str) and NG_SERIES.match(sid):
+            series += 1
+            total_mwh += pd.to_numeric(pd.Series([x[1] for x in data]), errors="coerce").sum()
+    return {"ba_list": list(ba_list), "ts_list": list(ts_list),
+            "series": series, "total_mwh": float(total_mwh)}
+
+def run_extract(state, modules):
+    from .run import BAS, START, end_day
+    hours, work_dir = state
+    prepare(work_dir, modules)
+    summary = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for ba in BAS:
+            dfa = modules["download_and_process"].extractBARange(ba, START, end_day(hours))
+            summary[ba] = dfa.sum().tolist()
+    return summary
+
+# name: (setup, run)
+BASELINE_RUNS = {
+    "prepareEIAData": (setup_eba, run_prepare),
+    "prepareEIAData_streaming": (setup_eba, run_prepare),
+    "extractBARange": (setup_eba, run_extract),
+    "calculate_coverage": (setup_series, run_coverage),
+    "sim_battery_247": (setup_series, run_sim_battery_247),
+    "calculate_247_battery_capacity_b2_sim": (setup_series, run_b2_sizer),
+    "cas": (setup_series, run_cas),
+    "cas_max_capacity": (setup_series, run_cas_max_capacity),
+    "cas_grid_mix": (setup_series, run_cas_grid_mix),
+    "cosim": (setup_series, run_cosim),
+}
@@ -0,0 +1,96 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import json
+import numpy as np
+import pandas as pd
+
+# Deterministic synthetic inputs for the benchmarks, the same seed always
+# gives the same data.
+
+# Benchmark sizes, in hours
+SIZES = {
+    "month": 24 * 30,
+    "year": 24 * 365,
+    "decade": 24 * 3650,
+}
+
+START = "2015-01-01"
+
+FUELS = ["WND", "SUN", "WAT", "OIL", "NG", "COL", "NUC", "OTH"]
+
+# Hourly renewable supply, dc power and grid carbon intensity over hours
+# starting at START, as a dataframe in the layout cas expects:
+#   index: hour number
+#   tot_renewable: solar (diurnal) plus wind (AR(1) around a seasonal mean), MW
+#   avg_dc_power_mw: dc power with a diurnal swing and noise, MW
+#   carbon_intensity: grid carbon intensity, high when renewables are low
+def hourly_series(hours, seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(hours)
+    hour_of_day = t % 24
+    day_of_year = (t // 24) % 365
+
+    season = 1 + 0.3 * np.cos(2 * np.pi * (day_of_year - 172) / 365)
+    solar = 60 * season * np.clip(np.sin(np.pi * (hour_of_day - 6) / 12), 0, None)
+    solar *= rng.uniform(0.6, 1.0, hours)
+
+    noise = rng.normal(0, 6, hours)
+    wind = np.empty(hours)
+    level = 30.0
+    for i in range(hours):
+        level = 30 + 0.95 * (level - 30) + noise[i]
+        wind[i] = level
+    wind = np.clip(wind * (2 - season), 0, None)
+
+    ren = solar + wind
+    dc = 40 + 8 * np.sin(2 * np.pi * (hour_of_day - 14) / 24) + rng.normal(0, 2, hours)
+    carbon_intensity = 500 - 3 * ren + rng.normal(0, 10, hours)
+
+    return pd.DataFrame({
+        "index": t,
+        "tot_renewable": ren,
+        "avg_dc_power_mw": dc,
+        "carbon_intensity": carbon_intensity,
+    }, index=pd.date_range(START, periods=hours, freq="H", tz="UTC"))
+
+# [date, value] pairs of an EBA series, about 1% of the values null, the
+# other values as strings if as_strings
+def with_nulls(rng, stamps, values, null_fraction=0.01, as_strings=False):
+    missing = rng.uniform(size=len(values)) < null_fraction
+    values = values.astype(str) if as_strings else values
+    return [[stamp, None if m else value] for stamp, value, m in zip(stamps, values.tolist(), missing)]
+
+# Write an EBA.txt with hourly (.H) net generation series for every BA in bas
+# and fuel in FUELS starting at START, plus a demand series per BA.
+# Like EIA's file, every line is one json series with data newest first.
+# Values are numbers with about 1% nulls, as in EIA's file, so EBA.txt is
+# read through the same fallback as the real data. With as_strings=True the
+# same data is written with string values, which pyarrow (and the baseline
+# reader, see baseline.py) can read.
+def write_eba(path, hours, bas=("CISO", "BPAT", "ERCO"), seed=0, as_strings=False):
+    rng = np.random.default_rng(seed)
+    idx = pd.date_range(START, periods=hours, freq="H", tz="UTC")
+    stamps = list(idx.strftime("%Y%m%dT%HZ")[::-1])
+    with open(path, "w") as f:
+        f.write(json.dumps({"category_id": 0, "name": "synthetic", "childseries": []}) + "\n")
+        for ba in bas:
+            for fuel in FUELS:
+                values = rng.uniform(-5, 5000, hours).round().astype(int)[::-1]
+                data = with_nulls(rng, stamps, values, as_strings=as_strings)
+                f.write(json.dumps({
+                    "series_id": "EBA.{0}-ALL.NG.{1}.H".format(ba, fuel),
+                    "name": "Net generation from {0} for {1}, hourly - UTC time".format(fuel, ba),
+                    "start": stamps[-1],
+                    "end": stamps[0],
+                    "data": data,
+                }) + "\n")
+            demand = rng.uniform(1000, 40000, hours).round().astype(int)
+            f.write(json.dumps({
+                "series_id": "EBA.{0}-ALL.D.H".format(ba),
+                "name": "Demand for {0}, hourly - UTC time".format(ba),
+                "start": stamps[-1],
+                "end": stamps[0],
+                "data": with_nulls(rng, stamps, demand, as_strings=as_strings),
+            }) + "\n")
@@ -0,0 +1,301 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Benchmarks of the EIA data preparation, battery simulation and sizing,
+# carbon aware scheduling, co-simulation and coverage entry points on
+# synthetic data (see generators.py), at 1 month, 1 year and 10 years of
+# hourly data.
+#
+# Run from the repository root:
+#   python -m benchmarks.run                        all benchmarks and sizes
+#   python -m benchmarks.run --cases cas --sizes year
+#   python -m benchmarks.run --update-golden        regenerate golden.json
+#
+# Every benchmark runs in its own process, so the peak RSS reported is the
+# high-water mark of that benchmark (including its input data). Wall time is
+# the best of --repeat runs after a warm up run. Throughput is simulated (or
+# processed) hours per second of wall time; for the capacity sizer these are
+# the hours its candidate simulations actually stepped through.
+# The outputs are compared with golden.json. Where the baseline revision
+# has an implementation (see baseline.py) the golden outputs are computed with
+# it, the others are the outputs of the current code pinned when the golden
+# file was last updated. Every golden entry records its source and the
+# tolerance its outputs are compared with.
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+
+from .baseline import BASELINE_REV, BASELINE_RUNS, BaselineModules
+from .generators import SIZES, START, hourly_series, write_eba
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "golden.json")
+
+RTOL = 1e-9
+
+BAS = ("CISO", "BPAT", "ERCO")
+
+def end_day(hours):
+    return (pd.Timestamp(START) + pd.Timedelta(days=hours // 24)).strftime("%Y-%m-%d")
+
+# Benchmarks: setup(hours, work_dir) returns the input state, which is not
+# timed, run(state) returns the output summary and the hours simulated.
+
+def setup_series(hours, work_dir):
+    return hourly_series(hours)
+
+def setup_eba(hours, work_dir):
+    write_eba(os.path.join(work_dir, "EBA.txt"), hours + 24, BAS)
+    return work_dir
+
+def setup_prepared_eba(hours, work_dir):
+    from src.download_and_process import prepareEIAData
+    setup_eba(hours, work_dir)
+    with contextlib.redirect_stdout(io.StringIO()):
+        prepareEIAData(work_dir, use_cache=False)
+    return hours
+
+def run_prepare(work_dir, streaming=False):
+    from src import download_and_process
+    with contextlib.redirect_stdout(io.StringIO()):
+        download_and_process.prepareEIAData(work_dir, use_cache=False, streaming=streaming)
+    dataset = download_and_process.defaultDataset()
+    store = dataset.store
+    hours = int(sum(length for _, length in store.index.values()))
+    summary = {
+        "ba_list": dataset.ba_list,
+        "ts_list": dataset.ts_list,
+        "series": len(store.index),
+        "total_mwh": float(np.nansum(store.values, dtype=np.float64)),
+    }
+    return summary, hours
+
+def run_prepare_streaming(work_dir):
+    return run_prepare(work_dir, streaming=True)
+
+def run_extract(hours):
+    from src.download_and_process import extractBARange
+    summary = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for ba in BAS:
+            dfa = extractBARange(ba, START, end_day(hours))
+            summary[ba] = dfa.sum().tolist()
+    return summary, len(BAS) * (hours + 1)
+
+def run_coverage(df):
+    from src.utils import calculate_coverage
+    coverage = calculate_coverage(df["tot_renewable"], df["avg_dc_power_mw"])
+    return {"coverage": float(coverage)}, df.shape[0]
+
+def run_sim_battery_247(df):
+    from src.battery import Battery2, sim_battery_247
+    # large enough to stay feasible over the whole decade
+    b = Battery2(10000, 10000)
+    feasible = sim_battery_247(df["tot_renewable"], df, b)
+    return {"feasible": bool(feasible), "current_load": float(b.current_load)}, df.shape[0]
+
+def run_b2_sizer(df):
+    from src.battery import SizingStats, calculate_247_battery_capacity_b2_sim
+    stats = SizingStats()
+    capacity = calculate_247_battery_capacity_b2_sim(df["tot_renewable"], df, 1e6, stats)
+    return {"battery_capacity": float(capacity)}, stats.hours_simulated
+
+def schedule_summary(df):
+    ren = df["tot_renewable"].to_numpy()
+    dc = df["avg_dc_power_mw"].to_numpy()
+    ci = df["carbon_intensity"].to_numpy()
+    return {
+        "total_dc_mwh": float(dc.sum()),
+        "non_renewable_mwh": float(np.maximum(dc - ren, 0).sum()),
+        "avg_carbon_intensity": float((ci * dc).sum() / dc.sum()),
+        "checksum": float((dc * np.arange(dc.shape[0])).sum()),
+    }
+
+def run_cas(df):
+    from src.cas import cas
+    return schedule_summary(cas(df, 30, 60)), df.shape[0]
+
+# half of the load is flexible and max_capacity is close to the dc peaks, so
+# many hours are filled up to max_capacity
+def run_cas_max_capacity(df):
+    from src.cas import cas
+    return schedule_summary(cas(df, 50, 50)), df.shape[0]
+
+def run_cas_grid_mix(df):
+    from src.cas import cas_grid_mix
+    return schedule_summary(cas_grid_mix(df, 30, 60)), df.shape[0]
+
+def run_cas_optimal(df):
+    from src.cas import cas_optimal
+    return schedule_summary(cas_optimal(df, 30, 60)), df.shape[0]
+
+def run_cas_grid_mix_optimal(df):
+    from src.cas import cas_grid_mix_optimal
+    return schedule_summary(cas_grid_mix_optimal(df, 30, 60)), df.shape[0]
+
+def run_cosim(df):
+    from src.cosim import cosim
+    non_ren_mwh, coverage, _ = cosim(df["tot_renewable"], df["avg_dc_power_mw"], 30, 60, 200)
+    return {"non_renewable_mwh": float(non_ren_mwh), "coverage": float(coverage)}, df.shape[0]
+
+# name: (setup, run, absolute tolerance of the outputs), the outputs are also
+# compared with a relative tolerance of RTOL
+BENCHMARKS = {
+    "prepareEIAData": (setup_eba, run_prepare, 0),
+    "prepareEIAData_streaming": (setup_eba, run_prepare_streaming, 0),
+    "extractBARange": (setup_prepared_eba, run_extract, 0),
+    "calculate_coverage": (setup_series, run_coverage, 1e-9),
+    "sim_battery_247": (setup_series, run_sim_battery_247, 1e-6),
+    # bisection stops within 0.1 of the smallest feasible capacity, the
+    # baseline returns the last midpoint instead of the upper bound
+    "calculate_247_battery_capacity_b2_sim": (setup_series, run_b2_sizer, 0.1),
+    "cas": (setup_series, run_cas, 1e-6),
+    "cas_max_capacity": (setup_series, run_cas_max_capacity, 1e-6),
+    "cas_grid_mix": (setup_series, run_cas_grid_mix, 1e-6),
+    "cas_optimal": (setup_series, run_cas_optimal, 1e-6),
+    "cas_grid_mix_optimal": (setup_series, run_cas_grid_mix_optimal, 1e-6),
+    "cosim": (setup_series, run_cosim, 1e-6),
+}
+
+# Run one benchmark in this process, returns its measurements
+def run_benchmark(name, size, repeat=1):
+    setup, run, _ = BENCHMARKS[name]
+    with tempfile.TemporaryDirectory() as work_dir:
+        state = setup(SIZES[size], work_dir)
+        setup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        # untimed warm up run, for imports and numba compilation
+        run(state)
+        times = []
+        for _ in range(repeat):
+            t = time.perf_counter()
+            summary, hours = run(state)
+            times.append(time.perf_counter() - t)
+    wall = min(times)
+    return {
+        "benchmark": name,
+        "size": size,
+        "wall_s": wall,
+        "setup_rss_mb": setup_rss,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "hours": hours,
+        "hours_per_s": hours / wall if wall > 0 else float("inf"),
+        "summary": summary,
+    }
+
+# Output summary of a benchmark computed with the baseline code, None if
+# the baseline cannot run it at this size
+def run_baseline(name, size):
+    import warnings
+    setup, run = BASELINE_RUNS[name]
+    with tempfile.TemporaryDirectory() as work_dir, warnings.catch_warnings():
+        # the baseline cas assigns through chained indexing
+        warnings.simplefilter("ignore")
+        state = setup(SIZES[size], work_dir)
+        return None if state is None else run(state, BaselineModules())
+
+# Golden entry of a benchmark's outputs
+def golden_entry(name, summary, source):
+    return {"outputs": summary, "source": source, "atol": BENCHMARKS[name][2], "rtol": RTOL}
+
+# Compare a summary with its golden entry, returns the mismatching keys.
+# Numbers are compared within the entry's tolerances, strings exactly
+def compare(summary, golden):
+    mismatches = []
+    for key, expected in golden["outputs"].items():
+        got = summary.get(key)
+        if np.asarray(expected).dtype.kind == "U":
+            if got != expected:
+                mismatches.append(key)
+        elif got is None or not np.allclose(np.asarray(got, dtype=float), np.asarray(expected, dtype=float),
+                                          rtol=golden["rtol"], atol=golden["atol"], equal_nan=True):
+            mismatches.append(key)
+    return mismatches
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Carbon Explorer benchmarks")
+    parser.add_argument("--cases", nargs="*", default=list(BENCHMARKS), choices=list(BENCHMARKS))
+    parser.add_argument("--sizes", nargs="*", default=list(SIZES), choices=list(SIZES))
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--update-golden", action="store_true")
+    parser.add_argument("--json", help="write the measurements to this file")
+    parser.add_argument("--child", nargs=2, metavar=("CASE", "SIZE"), help=argparse.SUPPRESS)
+    parser.add_argument("--baseline", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.child and args.baseline:
+        print(json.dumps(run_baseline(args.child[0], args.child[1])))
+        return 0
+    if args.child:
+        print(json.dumps(run_benchmark(args.child[0], args.child[1], args.repeat)))
+        return 0
+
+    golden = {}
+    if os.path.exists(GOLDEN_PATH):
+        with open(GOLDEN_PATH) as f:
+            golden = json.load(f)
+
+    results = []
+    failed = False
+    print("{0:40s} {1:7s} {2:>10s} {3:>10s} {4:>14s}  {5}".format(
+        "benchmark", "size", "wall (s)", "RSS (MB)", "hours/s", "golden"))
+    for name in args.cases:
+        for size in args.sizes:
+            out = subprocess.run([sys.executable, "-m", "benchmarks.run", "--child", name, size,
+                                  "--repeat", str(args.repeat)], capture_output=True, text=True)
+            if out.returncode != 0:
+                print(out.stderr, file=sys.stderr)
+                failed = True
+                continue
+            result = json.loads(out.stdout.strip().splitlines()[-1])
+            results.append(result)
+
+            key = "{0}/{1}".format(name, size)
+            if args.update_golden and name in BASELINE_RUNS:
+                out = subprocess.run([sys.executable, "-m", "benchmarks.run", "--child", name, size,
+                                      "--baseline"], capture_output=True, text=True)
+                if out.returncode != 0:
+                    print(out.stderr, file=sys.stderr)
+                    failed = True
+                    continue
+                baseline = json.loads(out.stdout.strip().splitlines()[-1])
+                if baseline is None:
+                    golden[key] = golden_entry(name, result["summary"],
+                                               "pinned, baseline {0} cannot run this size".format(BASELINE_REV))
+                    status = "updated (pinned)"
+                else:
+                    golden[key] = golden_entry(name, baseline, "baseline " + BASELINE_REV)
+                    mismatches = compare(result["summary"], golden[key])
+                    status = "updated (baseline)" + ("" if not mismatches else ", MISMATCH " + ", ".join(mismatches))
+                    failed = failed or bool(mismatches)
+            elif args.update_golden:
+                golden[key] = golden_entry(name, result["summary"], "pinned")
+                status = "updated (pinned)"
+            elif key not in golden:
+                status = "-"
+            else:
+                mismatches = compare(result["summary"], golden[key])
+                status = "ok" if not mismatches else "MISMATCH " + ", ".join(mismatches)
+                failed = failed or bool(mismatches)
+            print("{0:40s} {1:7s} {2:10.4f} {3:10.1f} {4:14.0f}  {5}".format(
+                name, size, result["wall_s"], result["peak_rss_mb"], result["hours_per_s"], status))
+
+    if args.update_golden:
+        with open(GOLDEN_PATH, "w") as f:
+            json.dump(golden, f, indent=1, sort_keys=True)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -2,7 +2,30 @@
 # This source code is licensed under the CC-BY-NC license found in the
 # LICENSE file in the root directory of this source tree.
 
+import math
 import numpy as np
+import pandas as pd
+from collections import namedtuple
+
+from . import profiling, result_cache
+
+try:
+    from numba import njit, prange
+except ImportError:  # numba is optional, kernels then run as plain python
+    njit = None
+    prange = range
+
+# compile the simulation kernels when numba is available
+def _kernel(func):
+    if njit is None:
+        return func
+    return njit(cache=True)(func)
+
+# same as _kernel, spreading prange loops over all cores
+def _parallel_kernel(func):
+    if njit is None:
+        return func
+    return njit(cache=True, parallel=True)(func)
 
 class Battery:
     capacity = 0 # Max MWh storage capacity
@@ -40,6 +63,12 @@ class Battery:
     def find_and_init_capacity(self, input_load):
         self.capacity = self.capacity + input_load
 
+# Plain parameter struct of Battery2 passed to the array simulation kernels
+Battery2Params = namedtuple(
+    "Battery2Params",
+    ["eff_c", "eff_d", "c_lim", "d_lim", "upper_u", "upper_v", "lower_u", "lower_v"],
+)
+
 # Battery model that includes efficiency and 
 # linear charging/discharging rate limits with respect to battery capacity
 # refer to C/L/C model in following reference for details: 
@@ -89,6 +118,12 @@ class Battery2:
         self.lower_lim_u = lower_u
         self.lower_lim_v = lower_v
 
+    # returns the model coefficients as a Battery2Params struct
+    def params(self):
+        return Battery2Params(self.eff_c, self.eff_d, self.c_lim, self.d_lim,
+                              self.upper_lim_u, self.upper_lim_v,
+                              self.lower_lim_u, self.lower_lim_v)
+
     def calc_max_charge(self, T_u):
 
         # energy content in current (next) time step: b_k (b_{k+1}, which is just b_k + p_k*eff_c)
@@ -126,6 +161,26 @@ class Battery2:
             return max_discharge*T_u
         return output_load*T_u
 
+    # charge the battery with a constant input_load for one hour,
+    # same as calling charge(input_load, 1/points_per_hour) points_per_hour times
+    # returns the total load after charging
+    def charge_hour(self, input_load, points_per_hour=60):
+        self.current_load = _charge_steps(self.current_load, input_load, self.capacity,
+                                          self.eff_c, self.c_lim,
+                                          self.upper_lim_u, self.upper_lim_v,
+                                          1/points_per_hour, points_per_hour)
+        return self.current_load
+
+    # draw a constant output_load from the battery for one hour,
+    # same as calling discharge(output_load, 1/points_per_hour) points_per_hour times
+    # returns how much energy is discharged within the hour
+    def discharge_hour(self, output_load, points_per_hour=60):
+        self.current_load, discharged = _discharge_steps(self.current_load, output_load, self.capacity,
+                                                         self.eff_d, self.d_lim,
+                                                         self.lower_lim_u, self.lower_lim_v,
+                                                         1/points_per_hour, points_per_hour)
+        return discharged
+
     def is_full(self):
         return (self.capacity == self.current_load)
     
@@ -137,27 +192,257 @@ class Battery2:
 
         self.capacity = self.capacity + input_load*self.eff_d
 
-        # increase the capacity until we can discharge input_load
-        # TODO: find analytical value for this
+        # increase the capacity in 0.1 MWh steps until we can discharge input_load,
+        # after k steps power_lim = (new_capacity + 0.1*k*(1 - lower_v) - lower_v*capacity)/(lower_u + eff_d)
+        # so the number of steps follows directly
         new_capacity = input_load*self.eff_d
-        while True:
-            power_lim = (new_capacity - self.lower_lim_v*self.capacity)/(self.lower_lim_u + self.eff_d)
-            if power_lim < input_load:
-                self.capacity += 0.1
-                new_capacity += 0.1
-            else:
-                break
+        shortfall = input_load*(self.lower_lim_u + self.eff_d) - (new_capacity - self.lower_lim_v*self.capacity)
+        if shortfall > 0:
+            if self.lower_lim_v >= 1:
+                raise ValueError("no capacity can discharge {0} MWh with lower_v = {1}".format(
+                    input_load, self.lower_lim_v))
+            self.capacity += 0.1 * math.ceil(shortfall / (0.1*(1 - self.lower_lim_v)))
     
+# Advance the battery by steps time steps of T_u hours, charging with a
+# constant input_load. While the charge rate limit is the binding term the
+# load grows linearly, once the upper limit (u * applied power) + v binds
+# the distance to v * capacity shrinks geometrically by (1 - r) per step.
+# returns the load after the last step
+@_kernel
+def _charge_steps(current_load, input_load, capacity, eff_c, c_lim,
+                  upper_u, upper_v, T_u, steps):
+    rate_lim = min((capacity/eff_c) * c_lim, input_load)
+    denom = (eff_c*T_u) - upper_u
+    v_cap = upper_v*capacity
+    if denom <= 0 or eff_c*T_u > denom:
+        # no geometric decay for these coefficients, step through
+        for j in range(steps):
+            max_charge = min((capacity/eff_c) * c_lim, (v_cap - current_load)/denom)
+            current_load = current_load + (min(max_charge, input_load) * eff_c * T_u)
+        return current_load
+
+    step_load = rate_lim * eff_c * T_u
+    threshold = v_cap - rate_lim*denom
+    linear_steps = 0
+    if current_load <= threshold:
+        if step_load > 0 and (threshold - current_load)/step_load < steps:
+            linear_steps = int((threshold - current_load)/step_load) + 1
+        else:
+            linear_steps = steps
+    current_load = current_load + linear_steps*step_load
+    if linear_steps < steps:
+        r = (eff_c*T_u)/denom
+        current_load = v_cap - (1 - r)**(steps - linear_steps) * (v_cap - current_load)
+    return current_load
+
+# Advance the battery by steps time steps of T_u hours, discharging a
+# constant output_load, analogous to _charge_steps.
+# returns the load after the last step and the energy discharged in total
+@_kernel
+def _discharge_steps(current_load, output_load, capacity, eff_d, d_lim,
+                     lower_u, lower_v, T_u, steps):
+    start_load = current_load
+    rate_lim = min((capacity/eff_d) * d_lim, output_load)
+    denom = lower_u + (eff_d*T_u)
+    v_cap = lower_v*capacity
+    if denom <= 0 or eff_d*T_u > denom:
+        discharged = 0.0
+        for j in range(steps):
+            max_discharge = min((capacity/eff_d) * d_lim, (current_load - v_cap)/denom)
+            current_load = current_load - (min(max_discharge, output_load) * eff_d * T_u)
+            discharged += min(max_discharge, output_load) * T_u
+        return current_load, discharged
+
+    step_load = rate_lim * eff_d * T_u
+    threshold = v_cap + rate_lim*denom
+    linear_steps = 0
+    if current_load >= threshold:
+        if step_load > 0 and (current_load - threshold)/step_load < steps:
+            linear_steps = int((current_load - threshold)/step_load) + 1
+        else:
+            linear_steps = steps
+    current_load = current_load - linear_steps*step_load
+    if linear_steps < steps:
+        q = (eff_d*T_u)/denom
+        current_load = v_cap + (1 - q)**(steps - linear_steps) * (current_load - v_cap)
+    return current_load, (start_load - current_load)/eff_d
+
+# C/L/C simulation kernel over hourly arrays, each hour is advanced in
+# closed form with points_per_hour sub steps.
+# Returns (feasible, final load, failing hour or -1)
+@_kernel
+def _sim_247_kernel(ren_mw, dc_mw, capacity, current_load,
+                    eff_c, eff_d, c_lim, d_lim,
+                    upper_u, upper_v, lower_u, lower_v, points_per_hour):
+    T_u = 1 / points_per_hour
+    for i in range(len(dc_mw)):
+        net_load = ren_mw[i] - dc_mw[i]
+
+        if net_load > 0:
+            current_load = _charge_steps(current_load, net_load, capacity, eff_c, c_lim,
+                                         upper_u, upper_v, T_u, points_per_hour)
+        else:
+            current_load, actual_discharge = _discharge_steps(
+                current_load, -net_load, capacity, eff_d, d_lim,
+                lower_u, lower_v, T_u, points_per_hour)
+            if net_load < 0 and actual_discharge < -net_load - 0.0001:
+                return False, current_load, i
+    return True, current_load, -1
+
+# Kernel of apply_battery, writes the adjusted renewable supply
+# into ren_out. Returns (non renewable mw, final load)
+@_kernel
+def _apply_battery_kernel(ren_mw, dc_mw, ren_out, capacity, current_load,
+                          eff_c, eff_d, c_lim, d_lim,
+                          upper_u, upper_v, lower_u, lower_v, points_per_hour):
+    T_u = 1 / points_per_hour
+    tot_non_ren_mw = 0.0
+    for i in range(len(dc_mw)):
+        gap = dc_mw[i] - ren_mw[i]
+        if gap > 0:
+            current_load, discharged_amount = _discharge_steps(
+                current_load, gap, capacity, eff_d, d_lim,
+                lower_u, lower_v, T_u, points_per_hour)
+            tot_non_ren_mw = tot_non_ren_mw + gap - discharged_amount
+            ren_out[i] = ren_mw[i] + discharged_amount
+        else:
+            current_load = _charge_steps(current_load, -gap, capacity, eff_c, c_lim,
+                                         upper_u, upper_v, T_u, points_per_hour)
+            ren_out[i] = ren_mw[i] + gap
+    return tot_non_ren_mw, current_load
+
+# Array based simulation engine behind sim_battery_247.
+# ren_mw and dc_mw are hourly numpy arrays, params is a Battery2Params.
+# Matches stepping Battery2.charge/discharge points_per_hour times per hour
+# to floating point rounding (relative error ~1e-12).
+# returns (feasible, final battery load, first hour demand could not be met or -1)
+def sim_battery_247_arrays(ren_mw, dc_mw, capacity, current_load, params, points_per_hour=60):
+    ren_mw = np.ascontiguousarray(ren_mw, dtype=np.float64)
+    dc_mw = np.ascontiguousarray(dc_mw, dtype=np.float64)
+    feasible, current_load, fail_hour = _sim_247_kernel(
+        ren_mw[:dc_mw.shape[0]], dc_mw, float(capacity), float(current_load), *params,
+        int(points_per_hour))
+    return bool(feasible), current_load, int(fail_hour)
+
+# Array based simulation engine behind apply_battery, does not modify its inputs.
+# returns (non renewable mw battery cannot cover, adjusted renewable array, final battery load)
+def apply_battery_arrays(ren_mw, dc_mw, capacity, current_load, params, points_per_hour=60):
+    dc_mw = np.ascontiguousarray(dc_mw, dtype=np.float64)
+    ren_mw = np.ascontiguousarray(ren_mw, dtype=np.float64)[:dc_mw.shape[0]]
+    ren_out = np.empty_like(ren_mw)
+    tot_non_ren_mw, current_load = _apply_battery_kernel(
+        ren_mw, dc_mw, ren_out, float(capacity), float(current_load), *params,
+        int(points_per_hour))
+    return tot_non_ren_mw, ren_out, current_load
+
+# Array versions of _charge_steps/_discharge_steps, every argument except
+# params may be a numpy array, all arrays are broadcast against each other
+def _charge_steps_batch(current_load, input_load, capacity, params, T_u, steps):
+    eff_c, c_lim, upper_u, upper_v = params.eff_c, params.c_lim, params.upper_u, params.upper_v
+    denom = (eff_c*T_u) - upper_u
+    v_cap = upper_v*capacity
+    if denom <= 0 or eff_c*T_u > denom:
+        for j in range(steps):
+            max_charge = np.minimum((capacity/eff_c) * c_lim, (v_cap - current_load)/denom)
+            current_load = current_load + (np.minimum(max_charge, input_load) * eff_c * T_u)
+        return current_load
+
+    rate_lim = np.minimum((capacity/eff_c) * c_lim, input_load)
+    step_load = rate_lim * eff_c * T_u
+    threshold = v_cap - rate_lim*denom
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = (threshold - current_load)/step_load
+    linear_steps = np.where(current_load <= threshold,
+                            np.where((step_load > 0) & (k < steps), np.floor(k) + 1, steps), 0)
+    current_load = current_load + linear_steps*step_load
+    r = (eff_c*T_u)/denom
+    return v_cap - (1 - r)**(steps - linear_steps) * (v_cap - current_load)
+
+def _discharge_steps_batch(current_load, output_load, capacity, params, T_u, steps):
+    eff_d, d_lim, lower_u, lower_v = params.eff_d, params.d_lim, params.lower_u, params.lower_v
+    start_load = current_load
+    denom = lower_u + (eff_d*T_u)
+    v_cap = lower_v*capacity
+    if denom <= 0 or eff_d*T_u > denom:
+        discharged = 0.0
+        for j in range(steps):
+            max_discharge = np.minimum((capacity/eff_d) * d_lim, (current_load - v_cap)/denom)
+            current_load = current_load - (np.minimum(max_discharge, output_load) * eff_d * T_u)
+            discharged = discharged + np.minimum(max_discharge, output_load) * T_u
+        return current_load, discharged
+
+    rate_lim = np.minimum((capacity/eff_d) * d_lim, output_load)
+    step_load = rate_lim * eff_d * T_u
+    threshold = v_cap + rate_lim*denom
+    with np.errstate(divide="ignore", invalid="ignore"):
+        k = (current_load - threshold)/step_load
+    linear_steps = np.where(current_load >= threshold,
+                            np.where((step_load > 0) & (k < steps), np.floor(k) + 1, steps), 0)
+    current_load = current_load - linear_steps*step_load
+    q = (eff_d*T_u)/denom
+    current_load = v_cap + (1 - q)**(steps - linear_steps) * (current_load - v_cap)
+    return current_load, (start_load - current_load)/eff_d
+
+# Compiled batch kernel, runs one scalar simulation per (scenario, candidate)
+# element of capacity in parallel and stores its feasibility in feasible
+@_parallel_kernel
+def _sim_247_batch_kernel(ren_mw, dc_mw, capacity, feasible,
+                          eff_c, eff_d, c_lim, d_lim,
+                          upper_u, upper_v, lower_u, lower_v, points_per_hour):
+    num_candidates = capacity.shape[1]
+    for n in prange(capacity.shape[0] * num_candidates):
+        s = n // num_candidates
+        k = n % num_candidates
+        feasible[s, k] = _sim_247_kernel(ren_mw[s], dc_mw[s], capacity[s, k], capacity[s, k],
+                                         eff_c, eff_d, c_lim, d_lim,
+                                         upper_u, upper_v, lower_u, lower_v, points_per_hour)[0]
+
+# Simulate a (scenarios x candidates) matrix of batteries that start full.
+# ren_mw and dc_mw are (scenarios x hours) arrays.
+# returns a boolean matrix, True where the battery meets all demand
+@profiling.instrument("battery.sim_battery_247_batch")
+def sim_battery_247_batch(ren_mw, dc_mw, capacity, params, points_per_hour=60):
+    ren_mw = np.ascontiguousarray(ren_mw, dtype=np.float64)
+    dc_mw = np.ascontiguousarray(dc_mw, dtype=np.float64)
+    capacity = np.ascontiguousarray(capacity, dtype=np.float64)
+    profiling.count("battery.simulations", capacity.size)
+    if njit is not None:
+        feasible = np.empty(capacity.shape, dtype=np.bool_)
+        _sim_247_batch_kernel(ren_mw, dc_mw, capacity, feasible, *params, int(points_per_hour))
+        return feasible
+
+    # without a compiler step all simulations hour by hour in lockstep
+    T_u = 1 / points_per_hour
+    current_load = capacity.copy()
+    feasible = np.ones(capacity.shape, dtype=bool)
+    for i in range(dc_mw.shape[1]):
+        net_load = (ren_mw[:, i] - dc_mw[:, i])[:, None]
+        charged = _charge_steps_batch(current_load, np.maximum(net_load, 0), capacity,
+                                      params, T_u, points_per_hour)
+        discharged_load, actual_discharge = _discharge_steps_batch(
+            current_load, np.maximum(-net_load, 0), capacity, params, T_u, points_per_hour)
+        current_load = np.where(net_load > 0, charged, discharged_load)
+        feasible &= ~((net_load < 0) & (actual_discharge < -net_load - 0.0001))
+        if not feasible.any():
+            break
+    return feasible
+
 # return True if battery can meet all demand, False otherwise
-def sim_battery_247(df_ren, df_dc_pow, b):
+@profiling.instrument("battery.sim_battery_247")
+def sim_battery_247(df_ren, df_dc_pow, b, points_per_hour=60):
 
-    points_per_hour = 60
+    dc_mw = df_dc_pow["avg_dc_power_mw"].to_numpy(dtype=np.float64)
+    ren_mw = np.asarray(df_ren, dtype=np.float64)
 
+    if isinstance(b, Battery2):
+        feasible, b.current_load, fail_hour = sim_battery_247_arrays(
+            ren_mw, dc_mw, b.capacity, b.current_load, b.params(), points_per_hour)
+        profiling.count("battery.hours_simulated", dc_mw.shape[0] if feasible else fail_hour + 1)
+        return feasible
 
-    for i in range(df_dc_pow.shape[0]):
-        ren_mw = df_ren.iloc[i]
-        df_dc = df_dc_pow["avg_dc_power_mw"].iloc[i]
-        net_load = ren_mw - df_dc
+    for i in range(dc_mw.shape[0]):
+        profiling.count("battery.hours_simulated")
+        net_load = ren_mw[i] - dc_mw[i]
 
         actual_discharge = 0
         # Apply the net power points_per_hour times
@@ -178,18 +463,120 @@ def sim_battery_247(df_ren, df_dc_pow, b):
 
 
 
-# binary search for smallest battery size that meets all demand    
-def calculate_247_battery_capacity_b2_sim(df_ren, df_dc_pow, max_bsize):
+# Depth of discharge trajectory of a battery that starts full and is large
+# enough for no capacity dependent limit to bind (needs upper_v = 1, lower_v = 0,
+# where the C/L/C update only depends on the energy drawn from the battery).
+# Fills depth[i] with the energy drawn before hour i and bound[i] with the
+# smallest capacity for which hour i still follows this trajectory
+@_kernel
+def _unconstrained_kernel(ren_mw, dc_mw, depth, bound, eff_c, eff_d, c_lim, d_lim,
+                          upper_u, lower_u, points_per_hour):
+    T_u = 1 / points_per_hour
+    c_denom = (eff_c*T_u) - upper_u
+    d_denom = lower_u + (eff_d*T_u)
+    r = (eff_c*T_u)/c_denom
+    drawn = 0.0
+    for i in range(len(dc_mw)):
+        depth[i] = drawn
+        net_load = ren_mw[i] - dc_mw[i]
+        if net_load > 0:
+            bound[i] = net_load * eff_c / c_lim
+            step_load = net_load * eff_c * T_u
+            threshold = net_load * c_denom
+            linear_steps = 0
+            if drawn >= threshold:
+                if (drawn - threshold)/step_load < points_per_hour:
+                    linear_steps = int((drawn - threshold)/step_load) + 1
+                else:
+                    linear_steps = points_per_hour
+            drawn = drawn - linear_steps*step_load
+            if linear_steps < points_per_hour:
+                drawn = (1 - r)**(points_per_hour - linear_steps) * drawn
+        else:
+            bound[i] = max(-net_load * eff_d / d_lim,
+                           drawn - net_load*eff_d*(points_per_hour - 1)*T_u - net_load*d_denom)
+            drawn = drawn - net_load*eff_d
+
+# Counters of a capacity search, pass an instance to the sizers to fill it in
+class SizingStats:
+    def __init__(self):
+        self.simulations = 0 # candidate capacities checked
+        self.full_simulations = 0 # simulations that had to start at hour 0
+        self.hours_simulated = 0
+        self.binding_hours = [] # first hour a capacity dependent limit binds, per candidate
+        self.fail_hours = [] # first hour demand was not met, per infeasible candidate
+        self.windows = [] # (start, end) hours of the worst deficit window ending at each failure
+
+# binary search for smallest battery size that meets all demand
+# returns the smallest capacity found feasible (within 0.1 MWh of the
+# smallest feasible one), not the last midpoint checked as it used to, and
+# nan if no capacity below max_bsize was found feasible (max size was too small)
+# The battery starts full, so until the first hour a capacity dependent limit
+# binds every candidate follows the same depth of discharge trajectory. That
+# trajectory is computed once and each candidate is only simulated from its
+# first binding hour on, candidates that never bind are feasible without any
+# simulation. The search is bracketed by that largest binding capacity.
+# Pass a SizingStats as stats to see how many hours were actually simulated.
+@profiling.instrument("battery.calculate_247_battery_capacity_b2_sim")
+@result_cache.memoize("battery.calculate_247_battery_capacity_b2_sim",
+                      version=lambda arguments: Battery2(0).params(),
+                      bypass=lambda arguments: arguments["stats"] is not None)
+def calculate_247_battery_capacity_b2_sim(df_ren, df_dc_pow, max_bsize, stats=None, points_per_hour=60):
+    if stats is None:
+        stats = SizingStats()
+    params = Battery2(0).params()
+    dc_mw = df_dc_pow["avg_dc_power_mw"].to_numpy(dtype=np.float64)
+    ren_mw = np.ascontiguousarray(np.asarray(df_ren, dtype=np.float64)[:dc_mw.shape[0]])
+    num_hours = dc_mw.shape[0]
+    cum_deficit = np.concatenate(([0.0], np.cumsum(dc_mw - ren_mw)))
+
+    T_u = 1 / points_per_hour
+    depth = np.zeros(num_hours)
+    max_bound = np.full(num_hours, np.inf)
+    if (params.upper_v == 1 and params.lower_v == 0
+            and 0 < params.eff_c*T_u <= (params.eff_c*T_u) - params.upper_u):
+        _unconstrained_kernel(ren_mw, dc_mw, depth, max_bound, params.eff_c, params.eff_d,
+                              params.c_lim, params.d_lim, params.upper_u, params.lower_u,
+                              int(points_per_hour))
+        max_bound = np.maximum.accumulate(max_bound)
+
+    # returns True if a battery of size capacity that starts full meets all demand
+    def feasible(capacity):
+        start = int(np.searchsorted(max_bound, capacity, side="right"))
+        stats.simulations += 1
+        profiling.count("battery.simulations")
+        stats.binding_hours.append(start)
+        if start == num_hours:
+            return True
+        if start == 0:
+            stats.full_simulations += 1
+        ok, _, fail_hour = sim_battery_247_arrays(ren_mw[start:], dc_mw[start:], capacity,
+                                                  capacity - depth[start], params, points_per_hour)
+        if ok:
+            stats.hours_simulated += num_hours - start
+            profiling.count("battery.hours_simulated", num_hours - start)
+            return True
+        fail_hour += start
+        stats.hours_simulated += fail_hour - start + 1
+        profiling.count("battery.hours_simulated", fail_hour - start + 1)
+        stats.fail_hours.append(fail_hour)
+        # window ending at the failure with the largest cumulative deficit
+        stats.windows.append((fail_hour - int(np.argmin(cum_deficit[fail_hour::-1])), fail_hour))
+        return False
 
     # first check special case, no battery:
-    if sim_battery_247(df_ren, df_dc_pow, Battery2(0,0)):
+    if feasible(0):
         return 0
 
     l = 0
     u = max_bsize
+    # no limit ever binds above the largest bound
+    if max_bound[-1] < u:
+        u = max_bound[-1]
     while u - l > 0.1:
+        profiling.count("battery.bisection_iterations")
         med = (u + l) / 2
-        if sim_battery_247(df_ren, df_dc_pow, Battery2(med,med)):
+        if feasible(med):
             u = med
         else:
             l = med
@@ -197,9 +584,14 @@ def calculate_247_battery_capacity_b2_sim(df_ren, df_dc_pow, max_bsize):
     # check if max size was too small
     if u == max_bsize:
         return np.nan
-    return med
-
-# binary search for smallest battery size that meets all demand    
+    return u
+
+# binary search for smallest battery size that meets all demand
+# returns the smallest capacity found feasible (within 0.1 MWh of the
+# smallest feasible one), not the last midpoint checked as it used to, like
+# calculate_247_battery_capacity_b2_sim, and nan if no capacity below
+# max_bsize was found feasible (max size was too small)
+@profiling.instrument("battery.calculate_247_battery_capacity_b1_sim")
 def calculate_247_battery_capacity_b1_sim(df_ren, df_dc_pow, max_bsize):
 
     # first check special case, no battery:
@@ -209,6 +601,7 @@ def calculate_247_battery_capacity_b1_sim(df_ren, df_dc_pow, max_bsize):
     l = 0
     u = max_bsize
     while u - l > 0.1:
+        profiling.count("battery.bisection_iterations")
         med = (u + l) / 2
         if sim_battery_247(df_ren, df_dc_pow, Battery(med,med)):
             u = med
@@ -218,18 +611,84 @@ def calculate_247_battery_capacity_b1_sim(df_ren, df_dc_pow, max_bsize):
     # check if max size was too small
     if u == max_bsize:
         return np.nan
-    return med
+    return u
         
+# Batched version of calculate_247_battery_capacity_b2_sim for many scenarios.
+# df_ren holds one renewable supply column per scenario, df_dc_pow holds either
+# the shared "avg_dc_power_mw" column or one dc power column per scenario.
+# Each round simulates candidates_per_round capacities of every unfinished
+# scenario at once and, since feasibility is monotone in capacity, narrows all
+# searches in lockstep to the interval between the largest infeasible and the
+# smallest feasible candidate. By default plain bisection is used when the
+# kernels are compiled (scenarios run in parallel) and 8 candidates otherwise,
+# where the per hour numpy overhead is shared by the whole batch.
+# returns a DataFrame of minimal capacities (within tolerance MWh) keyed by scenario,
+# the smallest candidate found feasible like calculate_247_battery_capacity_b2_sim
+# (not the last midpoint checked), nan where no capacity below max_bsize is
+# feasible (max size was too small)
+@profiling.instrument("battery.calculate_247_battery_capacity_b2_batch")
+@result_cache.memoize("battery.calculate_247_battery_capacity_b2_batch",
+                      version=lambda arguments: Battery2(0).params())
+def calculate_247_battery_capacity_b2_batch(df_ren, df_dc_pow, max_bsize, candidates_per_round=None,
+                                            tolerance=0.1, points_per_hour=60, params=None):
+    if params is None:
+        params = Battery2(0).params()
+    if candidates_per_round is None:
+        candidates_per_round = 1 if njit is not None else 8
+
+    ren_mw = df_ren.to_numpy(dtype=np.float64).T
+    if "avg_dc_power_mw" in df_dc_pow:
+        dc_mw = np.broadcast_to(df_dc_pow["avg_dc_power_mw"].to_numpy(dtype=np.float64),
+                                ren_mw.shape)
+    else:
+        dc_mw = df_dc_pow[df_ren.columns].to_numpy(dtype=np.float64).T
+    ren_mw = ren_mw[:, :dc_mw.shape[1]]
+    num_scenarios = ren_mw.shape[0]
+
+    # first check the special cases, no battery and max size
+    bounds = np.tile([0.0, max_bsize], (num_scenarios, 1))
+    feasible = sim_battery_247_batch(ren_mw, dc_mw, bounds, params, points_per_hour)
+    result = np.where(feasible[:, 0], 0.0, np.where(feasible[:, 1], max_bsize, np.nan))
+
+    l = np.zeros(num_scenarios)
+    u = np.full(num_scenarios, float(max_bsize))
+    active = ~feasible[:, 0] & feasible[:, 1]
+    steps = np.arange(1, candidates_per_round + 1) / (candidates_per_round + 1)
+    while True:
+        active &= (u - l > tolerance)
+        idx = np.flatnonzero(active)
+        if idx.shape[0] == 0:
+            break
+        profiling.count("battery.bisection_iterations")
+        candidates = l[idx, None] + (u - l)[idx, None] * steps
+        feasible = sim_battery_247_batch(ren_mw[idx], dc_mw[idx], candidates, params, points_per_hour)
+
+        any_feasible = feasible.any(axis=1)
+        first = np.argmax(feasible, axis=1)
+        rows = np.arange(idx.shape[0])
+        u[idx] = np.where(any_feasible, candidates[rows, first], u[idx])
+        below = np.where(any_feasible, first - 1, candidates_per_round - 1)
+        l[idx] = np.where(below >= 0, candidates[rows, np.maximum(below, 0)], l[idx])
+
+    # max_bsize itself is not a result, as in calculate_247_battery_capacity_b2_sim
+    result = np.where(~np.isnan(result) & (result > 0), np.where(u < max_bsize, u, np.nan), result)
+    return pd.DataFrame({"battery_capacity": result},
+                        index=df_ren.columns)
+
 # Takes renewable supply and dc power as input dataframes
 # returns how much battery capacity is needed to make
 # dc operate on renewables 24/7
+@profiling.instrument("battery.calculate_247_battery_capacity")
+@result_cache.memoize("battery.calculate_247_battery_capacity")
 def calculate_247_battery_capacity(df_ren, df_dc_pow):
     battery_cap = 0 # return value stored here, capacity needed
     b = Battery(0) # start with an empty battery
 
+    ren_list = np.asarray(df_ren, dtype=np.float64).tolist()
+    dc_list = df_dc_pow["avg_dc_power_mw"].to_numpy(dtype=np.float64).tolist()
     for i in range(df_dc_pow.shape[0]):
-        ren_mw = df_ren.iloc[i]
-        df_dc = df_dc_pow["avg_dc_power_mw"].iloc[i]
+        ren_mw = ren_list[i]
+        df_dc = dc_list[i]
 
         if df_dc > ren_mw:  # if there's not enough renewable supply, need to discharge
             if(b.capacity == 0):
@@ -253,28 +712,51 @@ def calculate_247_battery_capacity(df_ren, df_dc_pow):
  
     return battery_cap
 
+# Battery2 version of calculate_247_battery_capacity, the battery is grown
+# with find_and_init_capacity whenever it cannot supply an hourly deficit
+# and charged/discharged with the C/L/C model in between
+@profiling.instrument("battery.calculate_247_battery_capacity_b2")
+@result_cache.memoize("battery.calculate_247_battery_capacity_b2",
+                      version=lambda arguments: Battery2(0).params())
+def calculate_247_battery_capacity_b2(df_ren, df_dc_pow, points_per_hour=60):
+    battery_cap = 0 # return value stored here, capacity needed
+    b = Battery2(0) # start with an empty battery
+
+    ren_list = np.asarray(df_ren, dtype=np.float64).tolist()
+    dc_list = df_dc_pow["avg_dc_power_mw"].to_numpy(dtype=np.float64).tolist()
+    for i in range(df_dc_pow.shape[0]):
+        ren_mw = ren_list[i]
+        df_dc = dc_list[i]
+
+        if df_dc > ren_mw:  # if there's not enough renewable supply, need to discharge
+            if(b.capacity == 0 or b.current_load == 0):
+                b.find_and_init_capacity(df_dc - ren_mw) # find how much battery cap needs to be
+            else:
+                drawn_amount = b.discharge_hour(df_dc - ren_mw, points_per_hour)
+                if(drawn_amount < (df_dc - ren_mw) - 0.0001):
+                    b.find_and_init_capacity((df_dc - ren_mw) - drawn_amount)
+        elif b.capacity > 0:  # there's excess renewable supply, charge batteries
+            b.charge_hour(ren_mw - df_dc, points_per_hour)
+
+        battery_cap = max(battery_cap, b.capacity)
+
+    return battery_cap
+
 # Takes battery capacity, renewable supply and dc power as input dataframes
 # and calculates how much battery can increase renewable coverage
-# returns the non renewable amount that battery cannot cover
-def apply_battery(battery_capacity, df_ren, df_dc_pow):
+# returns the non renewable amount that battery cannot cover and the
+# renewable supply adjusted for the battery as a new series (df_ren is not
+# modified), hours past the end of df_dc_pow are kept as they are
+@profiling.instrument("battery.apply_battery")
+def apply_battery(battery_capacity, df_ren, df_dc_pow, points_per_hour=60):
     b = Battery2(battery_capacity, battery_capacity)
-    tot_non_ren_mw = 0 # store the mw amount battery cannot supply here
-
-    points_per_hour = 60
-    for i in range(df_dc_pow.shape[0]):
-        ren_mw = df_ren.iloc[i]
-        df_dc = df_dc_pow["avg_dc_power_mw"].iloc[i]
-        gap = df_dc - ren_mw
-        discharged_amount = 0
-        for j in range(points_per_hour):
-            # lack or excess renewable supply
-            if gap > 0: #discharging from battery
-                discharged_amount += b.discharge(gap, 1/points_per_hour)
-            else: # charging the battery
-                b.charge(-gap, 1/points_per_hour)
-                df_ren.iloc[i] += gap * (1 / points_per_hour) # decrease the available renewable energy
-        if gap > 0:
-            tot_non_ren_mw = tot_non_ren_mw + gap - discharged_amount
-            df_ren.iloc[i] += discharged_amount  # increase the renewables available by the discharged
-    return tot_non_ren_mw, df_ren
 
+    n = df_dc_pow.shape[0]
+    profiling.count("battery.hours_simulated", n)
+    ren_mw = np.asarray(df_ren, dtype=np.float64)
+    tot_non_ren_mw, ren_out, b.current_load = apply_battery_arrays(
+        ren_mw, df_dc_pow["avg_dc_power_mw"].to_numpy(dtype=np.float64),
+        b.capacity, b.current_load, b.params(), points_per_hour)
+    # the renewables used for charging are drawn and the discharged amount is added
+    ren_out = np.concatenate((ren_out, ren_mw[n:]))
+    return tot_non_ren_mw, pd.Series(ren_out, index=df_ren.index, name=df_ren.name)
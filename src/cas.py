@@ -2,120 +2,433 @@
 # This source code is licensed under the CC-BY-NC license found in the
 # LICENSE file in the root directory of this source tree.
 
+import numpy as np
 import pandas as pd
 
+from . import profiling, result_cache
+from .battery import _kernel
+from .utils import calculate_coverage, process_pool
+
+# Two pointer workload shifting of cas over one window, sorted by ascending
+# renewable supply (and dc power), dc_mw is updated in place.
+# This is the single implementation of the cas steps, used window by window
+# by cas, cas_sweep, RollingCAS and the co-simulation (see cosim.py)
+@_kernel
+def _cas_window(ren_mw, dc_mw, flexible_workload_ratio, max_capacity):
+    start = 0
+    end = dc_mw.shape[0] - 1
+    work_to_move = 0.0
+    while start < end:
+        renewable_surplus = ren_mw[end] - dc_mw[end]
+        renewable_gap = dc_mw[start] - ren_mw[start]
+        # no surplus at the end pointer moves end, no gap at the start pointer moves start
+        if renewable_surplus <= 0:
+            end -= 1
+            continue
+        if renewable_gap <= 0:
+            start += 1
+            continue
+        available_space = min(renewable_surplus, max_capacity - dc_mw[end])
+        if work_to_move <= 0:
+            work_to_move = min(renewable_gap, flexible_workload_ratio / 100 * dc_mw[start])
+        if available_space > work_to_move:
+            dc_mw[end] += work_to_move
+            dc_mw[start] -= work_to_move
+            start += 1
+            work_to_move = 0.0
+        else:
+            dc_mw[end] += available_space
+            dc_mw[start] -= available_space
+            end -= 1
+            work_to_move -= available_space
+
+# Two pointer workload shifting of cas_grid_mix over one window, sorted by
+# ascending carbon intensity (and dc power), dc_mw is updated in place
+@_kernel
+def _cas_grid_mix_window(dc_mw, flexible_workload_ratio, max_capacity):
+    start = 0
+    end = dc_mw.shape[0] - 1
+    work_to_move = 0.0
+    while start < end:
+        available_space = max_capacity - dc_mw[start]
+        if work_to_move <= 0:
+            work_to_move = flexible_workload_ratio / 100 * dc_mw[end]
+        if available_space > work_to_move:
+            dc_mw[start] += work_to_move
+            dc_mw[end] -= work_to_move
+            end -= 1
+            work_to_move = 0.0
+        else:
+            dc_mw[start] = max_capacity
+            dc_mw[end] -= available_space
+            work_to_move -= available_space
+            start += 1
+
+# _cas_window over the rows of a (windows x hours) matrix, dc_mw is updated in place
+@_kernel
+def _cas_windows(ren_mw, dc_mw, flexible_workload_ratio, max_capacity):
+    for r in range(dc_mw.shape[0]):
+        _cas_window(ren_mw[r], dc_mw[r], flexible_workload_ratio, max_capacity)
+
+# _cas_grid_mix_window over the rows of a (windows x hours) matrix, dc_mw is
+# updated in place
+@_kernel
+def _cas_grid_mix_windows(dc_mw, flexible_workload_ratio, max_capacity):
+    for r in range(dc_mw.shape[0]):
+        _cas_grid_mix_window(dc_mw[r], flexible_workload_ratio, max_capacity)
+
+# Split an hourly array into blocks of windows, the full windows form one
+# (windows x window) matrix and a shorter last window its own (1 x rest) matrix
+def _to_windows(values, window):
+    num_full = values.shape[0] // window * window
+    blocks = [values[:num_full].reshape(-1, window)]
+    if num_full < values.shape[0]:
+        blocks.append(values[num_full:].reshape(1, -1))
+    return blocks
+
+# Sort every window of the hourly arrays by (key, dc_mw).
+# returns the per block sort orders and the sorted dc power blocks
+def _sort_window_arrays(key, dc_mw, window):
+    orders = []
+    dc_sorted = []
+    for key_block, dc_block in zip(_to_windows(key, window), _to_windows(dc_mw, window)):
+        order = np.lexsort((dc_block, key_block), axis=1)
+        orders.append(order)
+        dc_sorted.append(np.take_along_axis(dc_block, order, axis=1))
+    return orders, dc_sorted
+
+# Sort every window of df_all by (sort_by, avg_dc_power_mw).
+# returns the per block sort orders and the sorted dc power blocks
+def _sort_windows(df_all, sort_by, window):
+    return _sort_window_arrays(df_all[sort_by].to_numpy(dtype=np.float64),
+                               df_all["avg_dc_power_mw"].to_numpy(dtype=np.float64), window)
+
+# column of df_all as blocks in the sorted hour order of orders
+def _sorted_column(df_all, column, orders, window):
+    return [np.take_along_axis(values, order, axis=1) for values, order in
+            zip(_to_windows(df_all[column].to_numpy(dtype=np.float64), window), orders)]
+
+# Scatter the sorted dc power back into the original hour order
+def _unsort_windows(dc_sorted, orders):
+    dc_mw = []
+    for block, order in zip(dc_sorted, orders):
+        unsorted = np.empty_like(block)
+        np.put_along_axis(unsorted, order, block, axis=1)
+        dc_mw.append(unsorted.ravel())
+    return np.concatenate(dc_mw)
+
+# Balanced copy of df_all with the shifted dc power
+def _balanced_frame(df_all, dc_mw):
+    balanced_df = df_all.copy()
+    balanced_df["avg_dc_power_mw"] = dc_mw
+    return balanced_df.sort_values(by=["index"])
+
+# Array based engine behind cas, ren_mw and dc_mw are hourly numpy arrays
+# and are not modified.
+# returns the shifted dc power array
+def cas_arrays(ren_mw, dc_mw, flexible_workload_ratio, max_capacity, window=24):
+    ren_mw = np.asarray(ren_mw, dtype=np.float64)
+    dc_mw = np.asarray(dc_mw, dtype=np.float64)
+    profiling.count("cas.hours_scheduled", dc_mw.shape[0])
+    orders, dc_sorted = _sort_window_arrays(ren_mw, dc_mw, window)
+    for order, ren_block, dc_block in zip(orders, _to_windows(ren_mw, window), dc_sorted):
+        _cas_windows(np.take_along_axis(ren_block, order, axis=1), dc_block,
+                     flexible_workload_ratio, max_capacity)
+    return _unsort_windows(dc_sorted, orders)
+
+# Array based engine behind cas_grid_mix, see cas_arrays
+def cas_grid_mix_arrays(carbon_intensity, dc_mw, flexible_workload_ratio, max_capacity, window=24):
+    dc_mw = np.asarray(dc_mw, dtype=np.float64)
+    profiling.count("cas.hours_scheduled", dc_mw.shape[0])
+    orders, dc_sorted = _sort_window_arrays(np.asarray(carbon_intensity, dtype=np.float64), dc_mw, window)
+    for dc_block in dc_sorted:
+        _cas_grid_mix_windows(dc_block, flexible_workload_ratio, max_capacity)
+    return _unsort_windows(dc_sorted, orders)
+
 # Carbon Aware Scheduling Algorithm, to optimize for 24/7
 # takes a dataframe that contains renewable and dc power, dc_all
 # applies cas within the flexible_workload_ratio, and max_capacity constraints
 # returns the carbon balanced version of the input dataframe, balanced_df
-def cas(df_all, flexible_workload_ratio, max_capacity):
-    # work on 24 hour basis
+@profiling.instrument("cas.cas")
+@result_cache.memoize("cas.cas")
+def cas(df_all, flexible_workload_ratio, max_capacity, window=24):
+    # work on window (default 24) hour basis
     # sort the df in terms of ascending renewable en
     # take flexible_workload_ratio from the highest carbon intensity hours
     # to lowest ones if there is not enough renewables until max_capacity is hit
-    balanced_df = []
-    for i in range(0, df_all.shape[0], 24):
-        sorted_df = df_all[i : i + 24].sort_values(
-            by=["tot_renewable", "avg_dc_power_mw"]
-        )
-        start = 0
-        end = 23
-        if sorted_df.shape[0] < 23:
-            break
-        work_to_move = 0
-        while start < end:
-            renewable_surplus = (
-                sorted_df["tot_renewable"].iloc[end]
-                - sorted_df["avg_dc_power_mw"].iloc[end]
-            )
-            renewable_gap = (
-                sorted_df["avg_dc_power_mw"].iloc[start]
-                - sorted_df["tot_renewable"].iloc[start]
-            )
-            available_space = min(
-                renewable_surplus,
-                (max_capacity - sorted_df["avg_dc_power_mw"].iloc[end]),
-            )
-            if renewable_surplus <= 0:
-                end = end - 1
-                continue
-            if renewable_gap <= 0:
-                start = start + 1
-                continue
-            if work_to_move <= 0 and renewable_gap > 0:
-                work_to_move = min(
-                    renewable_gap,
-                    (
-                        flexible_workload_ratio
-                        / 100
-                        * sorted_df["avg_dc_power_mw"].iloc[start]
-                    ),
-                )
-
-            if available_space > work_to_move:
-                sorted_df["avg_dc_power_mw"].iloc[end] = (
-                    sorted_df["avg_dc_power_mw"].iloc[end]
-                    + work_to_move
-                )
-                sorted_df["avg_dc_power_mw"].iloc[start] = (
-                    sorted_df["avg_dc_power_mw"].iloc[start]
-                    - work_to_move
-                )
-                start = start + 1
-                work_to_move = 0
-            else:
-                sorted_df["avg_dc_power_mw"].iloc[end] = (
-                    sorted_df["avg_dc_power_mw"].iloc[end]
-                    + available_space
-                )
-                sorted_df["avg_dc_power_mw"].iloc[start] = (
-                    sorted_df["avg_dc_power_mw"].iloc[start]
-                    - available_space
-                )
-                work_to_move = work_to_move - available_space
-                end = end - 1
-        balanced_df.append(sorted_df)
-
-    final_balanced_df = pd.concat(balanced_df).sort_values(by=["index"])
-    return final_balanced_df
+    # all windows are sorted and shifted at once, a shorter last window included
+    dc_mw = cas_arrays(df_all["tot_renewable"].to_numpy(dtype=np.float64),
+                       df_all["avg_dc_power_mw"].to_numpy(dtype=np.float64),
+                       flexible_workload_ratio, max_capacity, window)
+    return _balanced_frame(df_all, dc_mw)
 
 
 # Carbon Aware Scheduling Algorithm, to optimize for Grid Carbon Mix
-def cas_grid_mix(df_all, flexible_workload_ratio, max_capacity):
-    # work on 24 hour basis
-    # work on 24 hour basis
+@profiling.instrument("cas.cas_grid_mix")
+@result_cache.memoize("cas.cas_grid_mix")
+def cas_grid_mix(df_all, flexible_workload_ratio, max_capacity, window=24):
+    # work on window (default 24) hour basis
     # sort the df in terms of ascending carbon
     # take flexible_workload_ratio from the highest carbon intensity hours
     # to lowest ones until max_capacity is hit
     # until avg carbon is hit or shifting does not reduce
-    balanced_df = []
-    for i in range(0, df_all.shape[0], 24):
-        sorted_df = df_all[i : i + 24].sort_values(by=["carbon_intensity", "avg_dc_power_mw"])
-        start = 0
-        end = 23
-        if sorted_df.shape[0] < 23:
-            break
-        work_to_move = 0
-        while start < end:
-            available_space = max_capacity - sorted_df["avg_dc_power_mw"].iloc[start]
-            if work_to_move <= 0:
-                work_to_move = flexible_workload_ratio / 100 * sorted_df["avg_dc_power_mw"].iloc[end]
-            if available_space > work_to_move:
-                sorted_df["avg_dc_power_mw"].iloc[start] = (
-                    sorted_df["avg_dc_power_mw"].iloc[start] + work_to_move
-                )
-                sorted_df["avg_dc_power_mw"].iloc[end] = sorted_df["avg_dc_power_mw"].iloc[end] - work_to_move
-                end = end - 1
-                work_to_move = 0
+    # all windows are sorted and shifted at once, a shorter last window included
+    dc_mw = cas_grid_mix_arrays(df_all["carbon_intensity"].to_numpy(dtype=np.float64),
+                                df_all["avg_dc_power_mw"].to_numpy(dtype=np.float64),
+                                flexible_workload_ratio, max_capacity, window)
+    return _balanced_frame(df_all, dc_mw)
+
+
+# Optimal workload shifting of a (windows x hours) matrix as a transportation
+# problem. Every hour can give up to give[w, h] MW of its load and take up to
+# take[w, h] MW. In order (per window) the hours that take first come first,
+# the hours that give first last. As any hour can move load to any other
+# hour of the window, the optimum moves the largest total from the first
+# givers to the first takers:
+#   split=False: all of it, min(total give, total take)
+#   split=True: only from the hours after a split point to the hours before
+#       it (the order is by cost), the best split over all split points
+# returns the shifted dc power matrix
+def _transport_windows(dc_mw, give, take, order, split=False):
+    dc_sorted = np.take_along_axis(dc_mw, order, axis=1)
+    take_sorted = np.take_along_axis(take, order, axis=1)
+    # givers first to last, i.e. in reverse order
+    give_sorted = np.take_along_axis(give, order[:, ::-1], axis=1)
+    take_cum = np.cumsum(take_sorted, axis=1)
+    give_cum = np.cumsum(give_sorted, axis=1)
+    if split:
+        # takers before the split against givers from it on
+        zeros = np.zeros((dc_mw.shape[0], 1))
+        takers = np.concatenate([zeros, take_cum], axis=1)
+        givers = np.concatenate([give_cum[:, ::-1], zeros], axis=1)
+        total = np.minimum(takers, givers).max(axis=1)
+    else:
+        total = np.minimum(give_cum[:, -1], take_cum[:, -1])
+
+    taken = np.clip(total[:, None] - (take_cum - take_sorted), 0, take_sorted)
+    given = np.clip(total[:, None] - (give_cum - give_sorted), 0, give_sorted)
+    shifted = np.empty_like(dc_mw)
+    np.put_along_axis(shifted, order, dc_sorted + taken - given[:, ::-1], axis=1)
+    return shifted
+
+# Solve the shifting of one window as a linear program (scipy's HiGHS), for
+# validating the transportation solution. Hour h may take up to take[h]
+# and give up to give[h]; minimizes the non renewable energy if ren_mw is
+# given, otherwise sum(carbon_intensity * dc power).
+# returns the shifted dc power of the window
+def _lp_window(dc_mw, give, take, ren_mw=None, carbon_intensity=None):
+    from scipy.optimize import linprog
+    n = dc_mw.shape[0]
+    bounds = list(zip(-give, take))
+    if ren_mw is not None:
+        # load moved into each hour x and non renewable power u >= dc + x - ren
+        c = np.concatenate([np.zeros(n), np.ones(n)])
+        a_ub = np.hstack([np.eye(n), -np.eye(n)])
+        b_ub = ren_mw - dc_mw
+        a_eq = np.concatenate([np.ones(n), np.zeros(n)])[None, :]
+        bounds += [(0, None)] * n
+    else:
+        c = carbon_intensity
+        a_ub = b_ub = None
+        a_eq = np.ones((1, n))
+    res = linprog(c, A_ub=a_ub, b_ub=b_ub, A_eq=a_eq, b_eq=[0], bounds=bounds, method="highs")
+    if not res.success:
+        raise RuntimeError("linprog failed: {0}".format(res.message))
+    return dc_mw + res.x[:n]
+
+def _check_solver(solver):
+    if solver not in ("transport", "lp"):
+        raise ValueError("solver must be 'transport' or 'lp', got {0}".format(solver))
+    if solver == "lp":
+        try:
+            import scipy.optimize
+        except ImportError:  # scipy is optional, only needed for the "lp" solver
+            raise ImportError("the 'lp' solver needs scipy")
+
+# Array based engine behind cas_optimal, ren_mw and dc_mw are hourly numpy
+# arrays and are not modified.
+# returns the shifted dc power array
+def cas_optimal_arrays(ren_mw, dc_mw, flexible_workload_ratio, max_capacity, window=24,
+                       solver="transport"):
+    _check_solver(solver)
+    ren_mw = np.asarray(ren_mw, dtype=np.float64)
+    dc_mw = np.asarray(dc_mw, dtype=np.float64)
+    profiling.count("cas.hours_scheduled", dc_mw.shape[0])
+    shifted = []
+    for ren_block, dc_block in zip(_to_windows(ren_mw, window), _to_windows(dc_mw, window)):
+        # only load beyond the renewable supply is worth moving, and only
+        # into the renewable surplus below max_capacity
+        give = np.clip(dc_block - ren_block, 0, flexible_workload_ratio / 100 * dc_block)
+        take = np.clip(np.minimum(ren_block - dc_block, max_capacity - dc_block), 0, None)
+        if solver == "lp":
+            shifted.append(np.empty_like(dc_block))
+            for i in range(dc_block.shape[0]):
+                shifted[-1][i] = _lp_window(dc_block[i], give[i], take[i], ren_mw=ren_block[i])
+            continue
+        # highest supply takes first, lowest supply gives first, like cas
+        order = np.lexsort((dc_block, ren_block), axis=1)[:, ::-1]
+        shifted.append(_transport_windows(dc_block, give, take, order))
+    return np.concatenate([block.ravel() for block in shifted])
+
+# Array based engine behind cas_grid_mix_optimal, see cas_optimal_arrays
+def cas_grid_mix_optimal_arrays(carbon_intensity, dc_mw, flexible_workload_ratio, max_capacity,
+                                window=24, solver="transport"):
+    _check_solver(solver)
+    carbon_intensity = np.asarray(carbon_intensity, dtype=np.float64)
+    dc_mw = np.asarray(dc_mw, dtype=np.float64)
+    profiling.count("cas.hours_scheduled", dc_mw.shape[0])
+    shifted = []
+    for ci_block, dc_block in zip(_to_windows(carbon_intensity, window), _to_windows(dc_mw, window)):
+        give = np.clip(flexible_workload_ratio / 100 * dc_block, 0, None)
+        take = np.clip(max_capacity - dc_block, 0, None)
+        if solver == "lp":
+            shifted.append(np.empty_like(dc_block))
+            for i in range(dc_block.shape[0]):
+                shifted[-1][i] = _lp_window(dc_block[i], give[i], take[i], carbon_intensity=ci_block[i])
+            continue
+        # lowest carbon intensity takes first, highest gives first, moving
+        # load only pays off from hours after a split point to hours before it
+        order = np.lexsort((dc_block, ci_block), axis=1)
+        shifted.append(_transport_windows(dc_block, give, take, order, split=True))
+    return np.concatenate([block.ravel() for block in shifted])
+
+# Optimal version of cas: within every window, up to flexible_workload_ratio
+# of the load of each hour can move to other hours up to max_capacity, and
+# the non renewable energy is minimized. Solved in closed form as a
+# transportation problem for all windows at once (solver "transport"), or
+# window by window with a linear program (solver "lp", needs scipy) to
+# validate it. The minimum is the same, the schedules may differ where
+# several schedules reach it.
+# returns the carbon balanced version of the input dataframe, balanced_df
+@profiling.instrument("cas.cas_optimal")
+@result_cache.memoize("cas.cas_optimal")
+def cas_optimal(df_all, flexible_workload_ratio, max_capacity, window=24, solver="transport"):
+    dc_mw = cas_optimal_arrays(df_all["tot_renewable"].to_numpy(dtype=np.float64),
+                               df_all["avg_dc_power_mw"].to_numpy(dtype=np.float64),
+                               flexible_workload_ratio, max_capacity, window, solver)
+    return _balanced_frame(df_all, dc_mw)
+
+# Optimal version of cas_grid_mix, minimizes the carbon of the dc power
+# (sum of carbon_intensity * avg_dc_power_mw) under the constraints of cas_optimal
+@profiling.instrument("cas.cas_grid_mix_optimal")
+@result_cache.memoize("cas.cas_grid_mix_optimal")
+def cas_grid_mix_optimal(df_all, flexible_workload_ratio, max_capacity, window=24, solver="transport"):
+    dc_mw = cas_grid_mix_optimal_arrays(df_all["carbon_intensity"].to_numpy(dtype=np.float64),
+                                        df_all["avg_dc_power_mw"].to_numpy(dtype=np.float64),
+                                        flexible_workload_ratio, max_capacity, window, solver)
+    return _balanced_frame(df_all, dc_mw)
+
+
+# Run one flexible_workload_ratio of a sweep over all max_capacities on the
+# presorted windows, coverage and carbon intensity do not depend on the hour
+# order within a window so the shifted load is evaluated without unsorting it
+def _sweep_ratio(ren_sorted, ci_sorted, dc_sorted, objective, flexible_workload_ratio, max_capacities):
+    rows = []
+    for max_capacity in max_capacities:
+        dc_blocks = [block.copy() for block in dc_sorted]
+        for i, dc_mw in enumerate(dc_blocks):
+            if objective == "renewable":
+                _cas_windows(ren_sorted[i], dc_mw, flexible_workload_ratio, max_capacity)
             else:
-                sorted_df["avg_dc_power_mw"].iloc[start] = max_capacity
-                sorted_df["avg_dc_power_mw"].iloc[end] = (
-                    sorted_df["avg_dc_power_mw"].iloc[end] - available_space
-                )
-                work_to_move = work_to_move - available_space
-                start = start + 1
-        balanced_df.append(sorted_df)
+                _cas_grid_mix_windows(dc_mw, flexible_workload_ratio, max_capacity)
+        dc_mw = np.concatenate([block.ravel() for block in dc_blocks])
+        coverage = np.nan
+        if ren_sorted is not None:
+            ren_mw = np.concatenate([block.ravel() for block in ren_sorted])
+            coverage = calculate_coverage(ren_mw, dc_mw)
+        avg_carbon_intensity = np.nan
+        if ci_sorted is not None:
+            ci = np.concatenate([block.ravel() for block in ci_sorted])
+            avg_carbon_intensity = (ci * dc_mw).sum() / dc_mw.sum()
+        rows.append((flexible_workload_ratio, max_capacity, coverage, avg_carbon_intensity))
+    return rows
+
+# Parameter sweep of cas (objective "renewable") or cas_grid_mix (objective "carbon")
+# over all combinations of flexible_workload_ratios and max_capacities.
+# The per window sort order does not depend on the sweep parameters, so it is
+# computed once and shared by every grid point. With processes > 1 the
+# flexible_workload_ratios are spread over a process pool.
+# returns a tidy dataframe with one row per grid point holding the renewable
+# coverage (%) of the shifted dc power and its average carbon intensity,
+# nan where df_all has no tot_renewable or carbon_intensity column
+@profiling.instrument("cas.cas_sweep")
+def cas_sweep(df_all, flexible_workload_ratios, max_capacities, objective="renewable",
+              processes=None, window=24):
+    if objective not in ("renewable", "carbon"):
+        raise ValueError("objective must be 'renewable' or 'carbon', got {0}".format(objective))
+    sort_by = "tot_renewable" if objective == "renewable" else "carbon_intensity"
+    orders, dc_sorted = _sort_windows(df_all, sort_by, window)
+
+    # renewable supply and carbon intensity in the sorted hour order
+    ren_sorted = None
+    if "tot_renewable" in df_all:
+        ren_sorted = _sorted_column(df_all, "tot_renewable", orders, window)
+    ci_sorted = None
+    if "carbon_intensity" in df_all:
+        ci_sorted = _sorted_column(df_all, "carbon_intensity", orders, window)
+
+    flexible_workload_ratios = list(flexible_workload_ratios)
+    max_capacities = list(max_capacities)
+    profiling.count("cas.hours_scheduled",
+                    df_all.shape[0] * len(max_capacities) * len(flexible_workload_ratios))
+    args = [(ren_sorted, ci_sorted, dc_sorted, objective, ratio, max_capacities)
+            for ratio in flexible_workload_ratios]
+    if processes is not None and processes > 1:
+        with process_pool(processes) as executor:
+            results = list(executor.map(_sweep_ratio, *zip(*args)))
+    else:
+        results = [_sweep_ratio(*a) for a in args]
+
+    return pd.DataFrame([row for rows in results for row in rows],
+                        columns=["flexible_workload_ratio", "max_capacity",
+                                 "coverage", "avg_carbon_intensity"])
+
+
+# Rolling horizon version of cas (objective "renewable") and cas_grid_mix
+# (objective "carbon") for a streaming hourly feed. Every add_hour call
+# reschedules only the open window with the hours received so far, so the
+# cost per hour does not grow with the history. Once a window has window
+# hours its schedule is final and equal to the batch schedulers' result.
+class RollingCAS:
+    def __init__(self, flexible_workload_ratio, max_capacity, window=24, objective="renewable"):
+        if objective not in ("renewable", "carbon"):
+            raise ValueError("objective must be 'renewable' or 'carbon', got {0}".format(objective))
+        self.flexible_workload_ratio = flexible_workload_ratio
+        self.max_capacity = max_capacity
+        self.window = window
+        self.objective = objective
+
+        self.scheduled = [] # final dc power schedule of the closed windows
+        self.key = [] # sort key and dc power of the open window
+        self.dc_mw = []
+        self.open_schedule = np.zeros(0)
+
+    # add the next hour of the feed, tot_renewable is needed for the
+    # "renewable" objective and carbon_intensity for the "carbon" objective
+    # returns the updated dc power schedule of the open window
+    def add_hour(self, avg_dc_power_mw, tot_renewable=None, carbon_intensity=None):
+        self.key.append(tot_renewable if self.objective == "renewable" else carbon_intensity)
+        self.dc_mw.append(avg_dc_power_mw)
+
+        key = np.array(self.key, dtype=np.float64).reshape(1, -1)
+        dc_mw = np.array(self.dc_mw, dtype=np.float64).reshape(1, -1)
+        order = np.lexsort((dc_mw, key), axis=1)
+        dc_sorted = np.take_along_axis(dc_mw, order, axis=1)
+        if self.objective == "renewable":
+            _cas_windows(np.take_along_axis(key, order, axis=1), dc_sorted,
+                         self.flexible_workload_ratio, self.max_capacity)
+        else:
+            _cas_grid_mix_windows(dc_sorted, self.flexible_workload_ratio, self.max_capacity)
+        np.put_along_axis(dc_mw, order, dc_sorted, axis=1)
+        self.open_schedule = dc_mw[0]
 
-    final_balanced_df = pd.concat(balanced_df).sort_values(by=["index"])
-    return final_balanced_df
+        if len(self.dc_mw) == self.window:
+            self.scheduled.append(self.open_schedule)
+            self.key = []
+            self.dc_mw = []
+            self.open_schedule = np.zeros(0)
+        return dc_mw[0]
 
+    # returns the dc power schedule of all hours added so far
+    def schedule(self):
+        return np.concatenate(self.scheduled + [self.open_schedule])
@@ -0,0 +1,129 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+
+from . import profiling
+from .battery import Battery2, _kernel, _parallel_kernel, _charge_steps, _discharge_steps, prange
+from .cas import _cas_window
+
+# Co-simulation of carbon aware scheduling (cas) and a battery in one pass
+# over hourly arrays. Window by window the dc power is shifted as cas does
+# and the battery is then charged and discharged over the window's hours in
+# time order, so neither a shifted dc power frame nor an adjusted renewable
+# frame is built, and the inputs are not copied or modified.
+# The result equals cas followed by apply_battery on its output.
+
+# Co-simulation kernel, writes the battery load after every hour into
+# soc_mwh when it is not empty. Returns (non renewable mw, final load)
+@_kernel
+def _cosim_kernel(ren_mw, dc_mw, soc_mwh, flexible_workload_ratio, max_capacity, window,
+                  capacity, current_load, eff_c, eff_d, c_lim, d_lim,
+                  upper_u, upper_v, lower_u, lower_v, points_per_hour):
+    T_u = 1 / points_per_hour
+    tot_non_ren_mw = 0.0
+    num_hours = dc_mw.shape[0]
+    ren_sorted = np.empty(window)
+    dc_sorted = np.empty(window)
+    dc_shifted = np.empty(window)
+    for first in range(0, num_hours, window):
+        n = min(window, num_hours - first)
+        ren_w = ren_mw[first:first + n]
+        dc_w = dc_mw[first:first + n]
+
+        # sort by (renewable supply, dc power) like cas and shift
+        by_dc = np.argsort(dc_w, kind="mergesort")
+        order = by_dc[np.argsort(ren_w[by_dc], kind="mergesort")]
+        for k in range(n):
+            ren_sorted[k] = ren_w[order[k]]
+            dc_sorted[k] = dc_w[order[k]]
+        if flexible_workload_ratio > 0:
+            _cas_window(ren_sorted[:n], dc_sorted[:n], flexible_workload_ratio, max_capacity)
+        for k in range(n):
+            dc_shifted[order[k]] = dc_sorted[k]
+
+        # battery over the window in time order
+        for k in range(n):
+            gap = dc_shifted[k] - ren_w[k]
+            if gap > 0:
+                current_load, discharged_amount = _discharge_steps(
+                    current_load, gap, capacity, eff_d, d_lim,
+                    lower_u, lower_v, T_u, points_per_hour)
+                tot_non_ren_mw = tot_non_ren_mw + gap - discharged_amount
+            else:
+                current_load = _charge_steps(current_load, -gap, capacity, eff_c, c_lim,
+                                             upper_u, upper_v, T_u, points_per_hour)
+            if soc_mwh.shape[0] > 0:
+                soc_mwh[first + k] = current_load
+    return tot_non_ren_mw, current_load
+
+# Co-simulate cas with flexible_workload_ratio and max_capacity and a
+# Battery2 of capacity MWh (starting with current_load, full by default).
+# ren_mw and dc_mw are hourly arrays, params a Battery2Params (the Battery2
+# defaults if None). A flexible_workload_ratio of 0 skips the scheduling.
+# returns (non renewable MWh the battery cannot cover, renewable coverage (%),
+# battery load (MWh) after every hour)
+@profiling.instrument("cosim.cosim")
+def cosim(ren_mw, dc_mw, flexible_workload_ratio, max_capacity, capacity, current_load=None,
+          params=None, window=24, points_per_hour=60):
+    dc_mw = np.asarray(dc_mw, dtype=np.float64)
+    ren_mw = np.asarray(ren_mw, dtype=np.float64)[:dc_mw.shape[0]]
+    if params is None:
+        params = Battery2(0).params()
+    if current_load is None:
+        current_load = capacity
+    profiling.count("cosim.hours_simulated", dc_mw.shape[0])
+    soc_mwh = np.empty(dc_mw.shape[0])
+    tot_non_ren_mw, _ = _cosim_kernel(ren_mw, dc_mw, soc_mwh, float(flexible_workload_ratio),
+                                      float(max_capacity), int(window), float(capacity),
+                                      float(current_load), *params, int(points_per_hour))
+    sum_dc = dc_mw.sum()
+    coverage = (sum_dc - tot_non_ren_mw) / sum_dc * 100
+    return tot_non_ren_mw, coverage, soc_mwh
+
+@_parallel_kernel
+def _cosim_batch_kernel(ren_mw, dc_mw, flexible_workload_ratio, max_capacity, capacity,
+                        non_ren_mw, window, eff_c, eff_d, c_lim, d_lim,
+                        upper_u, upper_v, lower_u, lower_v, points_per_hour):
+    no_trace = np.empty(0)
+    for c in prange(capacity.shape[0]):
+        non_ren_mw[c] = _cosim_kernel(ren_mw[c], dc_mw[c], no_trace, flexible_workload_ratio[c],
+                                      max_capacity[c], window, capacity[c], capacity[c],
+                                      eff_c, eff_d, c_lim, d_lim, upper_u, upper_v,
+                                      lower_u, lower_v, points_per_hour)[0]
+
+# Co-simulate many configurations at once, batteries start full.
+# ren_mw and dc_mw are either one hourly array shared by all configurations
+# or a (configurations x hours) array, flexible_workload_ratio, max_capacity
+# and capacity a value per configuration or one for all of them.
+# Configurations are spread over all cores when the kernels are compiled.
+# returns the non renewable MWh and the renewable coverage (%) per configuration
+@profiling.instrument("cosim.cosim_batch")
+def cosim_batch(ren_mw, dc_mw, flexible_workload_ratio, max_capacity, capacity,
+                params=None, window=24, points_per_hour=60):
+    ren_mw = np.asarray(ren_mw, dtype=np.float64)
+    dc_mw = np.asarray(dc_mw, dtype=np.float64)
+    num_hours = dc_mw.shape[-1]
+    flexible_workload_ratio, max_capacity, capacity = np.broadcast_arrays(
+        np.asarray(flexible_workload_ratio, dtype=np.float64),
+        np.asarray(max_capacity, dtype=np.float64),
+        np.asarray(capacity, dtype=np.float64))
+    num_configs = max(flexible_workload_ratio.size,
+                      ren_mw.shape[0] if ren_mw.ndim == 2 else 1,
+                      dc_mw.shape[0] if dc_mw.ndim == 2 else 1)
+    # shared hourly arrays are broadcast as views, not copied
+    ren_mw = np.broadcast_to(ren_mw[..., :num_hours], (num_configs, num_hours))
+    dc_mw = np.broadcast_to(dc_mw, (num_configs, num_hours))
+    flexible_workload_ratio, max_capacity, capacity = (
+        np.ascontiguousarray(np.broadcast_to(a.ravel(), (num_configs,)))
+        for a in (flexible_workload_ratio, max_capacity, capacity))
+    if params is None:
+        params = Battery2(0).params()
+    profiling.count("cosim.hours_simulated", num_configs * num_hours)
+
+    non_ren_mw = np.empty(num_configs)
+    _cosim_batch_kernel(ren_mw, dc_mw, flexible_workload_ratio, max_capacity, capacity,
+                        non_ren_mw, int(window), *params, int(points_per_hour))
+    sum_dc = dc_mw.sum(axis=1)
+    return non_ren_mw, (sum_dc - non_ren_mw) / sum_dc * 100
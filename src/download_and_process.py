@@ -2,78 +2,52 @@
 # This source code is licensed under the CC-BY-NC license found in the
 # LICENSE file in the root directory of this source tree.
 
-import wget
 import zipfile
 import pandas as pd
 import math
-import re
+import os
+import shutil
+import tempfile
+import threading
+import warnings
 import numpy as np
-from pyarrow import json
+from . import profiling, result_cache
+from .eia_store import readEBATable, readEBAFrame, buildSeriesStore, streamSeriesStore, CachedSeriesStore, loadSeriesCache, writeSeriesCache, appendSeriesCache, listBAsAndSeries
+
+# wget and pyarrow are imported when first needed, so that importing this
+# module (and the analysis modules built on it) stays fast in CLI tools and
+# worker processes.
 
 # Download EIA's U.S. Electric System Operating Data
-def downloadAndExtract(path):
+# With incremental=True, a path prepared with use_cache=True is updated with
+# refreshEIAData instead of being overwritten.
+def downloadAndExtract(path, incremental=False):
+    import wget
     url = "https://api.eia.gov/bulk/EBA.zip"
     
     wget.download(url)
     
+    if incremental:
+        return refreshEIAData(path, "EBA.zip", use_cache=True)
+
     # extract the data
     with zipfile.ZipFile("EBA.zip","r") as zip_ref:
         zip_ref.extractall(path)
 
 
 # Split json into multiple csv's for manual analysis, view
+# Files are written to path as EBA_sub_<i>.csv
 #
-def writeCSV(eba_json):
+def writeCSV(eba_json, path):
     numRecords = eba_json.shape[0]
     recordsPerFile = 100
     numFiles = math.ceil(numRecords / recordsPerFile)
 
     for i in range(numFiles):
-        if i == numFiles - 1:
-            r = range(recordsPerFile * i + 1, numRecords)
-        else:
-            r = range(recordsPerFile * i + 1, recordsPerFile * (i + 1))
+        r = range(recordsPerFile * i, min(recordsPerFile * (i + 1), numRecords))
         print("Writing csv records in {0}".format(r))
         df = eba_json.iloc[r, :]
-        df.to_csv("{0}/EBA_sub_{1}.csv".format(EIA_bulk_data_dir,i))
-
-eba_json = None
-ba_list = []
-ts_list = []
-
-def prepareEIAData(EIA_data_path):
-    global eba_json
-    global ba_list
-    global ts_list
-
-    # EBA.txt includes time series for power generation from
-    # each balancing authority in json format.
-    read_options = json.ReadOptions(block_size=2048576)
-    table = json.read_json("{0}/EBA.txt".format(EIA_data_path), read_options=read_options)
-    eba_json = table.to_pandas()
-    #writeCSV(eba_json)
-
-    # Construct list of BAs (ba_list)
-    # Construct list of time series (ts_list) using CISO as reference
-    #
-    series_id_unique = list(eba_json.series_id.unique())
-    series_id_unique = list(filter(lambda x: type(x) == str, series_id_unique))
-    
-    ba_num = 0
-    for sid in series_id_unique:
-        m = re.search("EBA.(.+?)-", str(sid))
-        ba_this = m.group(1)
-        if ba_this not in ba_list:
-            ba_list.append(ba_this)
-            ba_num = ba_num + 1
-
-        if ba_this == "CISO":
-            m = re.search("EBA.CISO-([A-Z\-]+\.)([A-Z\.\-]*)", str(sid))
-            ts_list.append(m.group(2))
-    print("EIA data prep done!")
-
-    return eba_json, ba_list, ts_list
-
+        df.to_csv("{0}/EBA_sub_{1}.csv".format(path, i))
 
 # Energy types
 ng_list = [
@@ -102,35 +76,30 @@ carbon_intensity = {
     "OTH": 230,
 }
 
-# Construct dataframe from json
-# Target specific balancing authority and day
-def extractBARange(ba_idx, start_day, end_day): 
-    global eba_json
-    start_idx = pd.Timestamp('{0}T00Z'.format(start_day), tz='UTC')
-    end_idx = pd.Timestamp('{0}T00Z'.format(end_day), tz='UTC')
-
-    idx = pd.date_range(start_day, end_day, freq = "H", tz='UTC')
+# Hourly generation series of a balancing authority, in the order of ng_list
+def baSeries(ba_idx):
+    return ['EBA.{0}-ALL.NG.{1}.H'.format(ba_idx, ng_idx) for ng_idx in ng_list]
 
-    # Loop over generating assets and append data to ba_list
-    #
-    ba_list = []
+# Fill power, an (hours x energy types) matrix, with the generation of a
+# balancing authority in store from start_idx to end_idx (pd.Timestamps),
+# hours without data are left as is
+def fillBARange(store, power, ba_idx, start_idx, end_idx):
+    hour_ns = pd.Timedelta(hours=1).value
+    profiling.count("eia.hours_extracted", power.shape[0])
 
-    for ng_idx in ng_list:
-        # Target json for specific balancing authority. 
+    for col, (ng_idx, series_idx) in enumerate(zip(ng_list, baSeries(ba_idx))):
+        # Target series for specific balancing authority. 
         # Note .H series means timestamps are in GMT / UTC 
         #
-        series_idx = 'EBA.{0}-ALL.NG.{1}.H'.format(ba_idx, ng_idx)
-        this_json = eba_json[eba_json['series_id'] == series_idx]
-        this_json = this_json.reset_index(drop=True)
-        if this_json.empty:
+        series = store.get(series_idx)
+        if series is None or len(series[0]) == 0:
             #print('Dataset does not include {0} data'.format(ng_idx))
-            ba_list.append([0]*(idx.shape[0])) # append a list with zeros
             continue
 
-        # Check start/end dates for BA's json include target day
+        # Check start/end dates for BA's series include target day
         #
-        start_dat = pd.Timestamp(this_json['start'].reset_index(drop=True)[0], tz='UTC')
-        end_dat = pd.Timestamp(this_json['end'].reset_index(drop=True)[0], tz='UTC')
+        start_dat = pd.Timestamp(series[0][0], tz='UTC')
+        end_dat = pd.Timestamp(series[0][-1], tz='UTC')
         if (start_idx < start_dat):
             print('Indexed start ({0}) precedes {1} dataset range ({2})'.format(start_idx, ng_idx, start_dat))
             #continue
@@ -139,39 +108,353 @@ def extractBARange(ba_idx, start_day, end_day):
             print('Indexed end ({0}) beyond {1} dataset range ({2})'.format(end_idx, ng_idx, end_dat))
             #continue
 
-        # Extract data tuples for target day
-        # this_json['data'][0] is a list of items x = [date, MWh] tuples 
+        # Extract [date, MWh] points for target day and scatter them
+        # into their hour rows, points off the hourly grid are dropped
         #
-        tuple_list = this_json['data'][0]
-        tuple_filtered = list(filter(\
-            lambda x: (pd.Timestamp(x[0], tz='UTC') >= start_idx) & (pd.Timestamp(x[0], tz='UTC') <= end_idx), \
-            tuple_list))
-        df = pd.DataFrame(tuple_filtered, columns =['timestamp', 'power'])
-        df['timestamp'] = pd.to_datetime(df['timestamp'], utc=True)
-        df = df.sort_values(by=['timestamp'], ascending=(True))
-        df.set_index(pd.DatetimeIndex(df['timestamp']), inplace=True)
-        df.drop(columns=['timestamp'], inplace=True)
-        df = df.reindex(index=idx, fill_value=0).reset_index()
-        ba_list.append(df['power'].tolist())
-
-    ba_list = pd.to_numeric(ba_list, errors='coerce')
-    dfa = pd.DataFrame(np.array(ba_list).transpose(), columns=ng_list).fillna(0).astype(int)
-    dfa = dfa.set_index(idx)
-    return dfa
+        timestamps, values = store.range(series_idx, start_idx, end_idx)
+        offset = timestamps - start_idx.value
+        on_hour = offset % hour_ns == 0
+        power[offset[on_hour] // hour_ns, col] = values[on_hour]
+
+# Carbon intensity of generation arrays whose last axis is energy types
+# (in the order of fuels), negative generation counts as 0
+def carbonIntensityOf(power, fuels):
+    power = np.maximum(power, 0)
+    intensity = np.array([carbon_intensity[c] for c in carbon_intensity])
+    cols = [fuels.index(c) for c in carbon_intensity]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return (power[..., cols] @ intensity) / np.nansum(power, axis=-1)
 
 # Calculate carbon intensity of the grid (kg CO2/MWh)
 # Takes a dataframe of energy generation as input (i.e. output of extractBARange)
 # Returns a time series of carbon intensity dataframe
+@profiling.instrument("eia.calculateAVGCarbonIntensity")
 def calculateAVGCarbonIntensity(db):
-    tot_carbon = None
-    db[db < 0] = 0
-    sum_db = db.sum(axis=1)
-    for c in carbon_intensity:
-        if tot_carbon is None:
-            tot_carbon = carbon_intensity[c]*db[c]
-        else:
-            tot_carbon = tot_carbon + carbon_intensity[c]*db[c]
-    tot_carbon = tot_carbon.div(sum_db).to_frame()
-    tot_carbon.rename(columns={tot_carbon.columns[0]: "carbon_intensity"}, inplace=True)
+    tot_carbon = carbonIntensityOf(db.to_numpy(), list(db.columns))
+    tot_carbon = pd.DataFrame({"carbon_intensity": tot_carbon}, index=db.index)
+    return tot_carbon
+
+# Calculate carbon intensity of the grid for several balancing authorities
+# Takes the output of extractBARangeMulti as input
+# Returns a dataframe with the carbon intensity of each BA as a column
+@profiling.instrument("eia.calculateAVGCarbonIntensityMulti")
+def calculateAVGCarbonIntensityMulti(dfa):
+    bas = list(dfa.columns.get_level_values(0).unique())
+    fuels = list(dfa.columns.get_level_values(1).unique())
+    power = dfa.to_numpy().reshape(dfa.shape[0], len(bas), len(fuels))
+    tot_carbon = pd.DataFrame(carbonIntensityOf(power, fuels), columns=bas, index=dfa.index)
     return tot_carbon
 
+
+# EIA data of one directory (EIA_data_path, holding EBA.txt), i.e. one
+# vintage of the bulk file. Several datasets can be used side by side:
+#   old = EIADataset("EIA_2021")
+#   new = EIADataset("EIA_2022")
+#   old.extractBARange("CISO", "2021-01-01", "2021-02-01")
+# The data is prepared (see prepare) on first use, or explicitly with prepare.
+# Once prepared a dataset is only read, so it can be shared across threads,
+# preparing and refreshing replace its data as a whole.
+class EIADataset:
+    def __init__(self, EIA_data_path, use_cache=False, streaming=False, ba_filter=None,
+                 fuel_filter=None):
+        self.EIA_data_path = EIA_data_path
+        self.use_cache = use_cache
+        self.streaming = streaming
+        self.ba_filter = ba_filter
+        self.fuel_filter = fuel_filter
+        self._eba_json = None
+        self._store = None
+        self._ba_list = []
+        self._ts_list = []
+        self._lock = threading.RLock()
+
+    # Dataset over an already built series store (e.g. attached to in a
+    # worker process), ba_list and ts_list are derived from its series
+    @classmethod
+    def fromStore(cls, store, EIA_data_path=None):
+        dataset = cls(EIA_data_path)
+        series_ids = store.index if hasattr(store, "index") else store.partitions
+        dataset._ba_list, dataset._ts_list = listBAsAndSeries(series_ids)
+        dataset._store = store
+        return dataset
+
+    # prepare the data on first use, once across threads
+    def _prepared(self):
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self.prepare()
+        return self
+
+    # series store of the hourly generation series (see eia_store)
+    @property
+    def store(self):
+        return self._prepared()._store
+
+    # EBA.txt as a pandas frame, None when the data came from the cache, was
+    # streamed or was refreshed incrementally (see refresh); prepare a
+    # dataset with use_cache=False to get it
+    @property
+    def eba_json(self):
+        return self._prepared()._eba_json
+
+    # list of BAs
+    @property
+    def ba_list(self):
+        return self._prepared()._ba_list
+
+    # list of time series, using CISO as reference
+    @property
+    def ts_list(self):
+        return self._prepared()._ts_list
+
+    def _replace(self, eba_json, store, ba_list, ts_list):
+        self._eba_json = eba_json
+        self._ba_list = list(ba_list)
+        self._ts_list = list(ts_list)
+        self._store = store
+        return self._eba_json, self._ba_list, self._ts_list
+
+    # By default EBA.txt is parsed every time. With use_cache=True the parsed
+    # series are cached in <EIA_data_path>/EBA_cache and reused for as long as
+    # EBA.txt does not change, in which case eba_json is not loaded (None).
+    # If the cache cannot be written (e.g. a read-only EIA_data_path) a warning
+    # is issued and the data is used uncached.
+    # With streaming=True EBA.txt is read one series at a time into compact arrays
+    # instead of as a whole pandas frame (eba_json is None), for machines that
+    # cannot hold the full file in memory, and faster for EIA's own files,
+    # which pyarrow cannot read and are otherwise parsed into a frame record
+    # by record. ba_filter and fuel_filter then limit the
+    # series kept to the given BAs and energy types (a filtered store is not cached).
+    # Preparing again reloads the data.
+    # returns eba_json, ba_list and ts_list
+    @profiling.instrument("eia.prepareEIAData")
+    def prepare(self):
+        with self._lock:
+            return self._prepare()
+
+    def _prepare(self):
+        eba_path = "{0}/EBA.txt".format(self.EIA_data_path)
+        cache_path = "{0}/EBA_cache".format(self.EIA_data_path)
+        if self.use_cache:
+            store, manifest = loadSeriesCache(cache_path, eba_path)
+            if store is not None:
+                print("EIA data prep done! (cached)")
+                return self._replace(None, store, manifest["ba_list"], manifest["ts_list"])
+
+        if self.streaming:
+            store, ba_this_file, ts_this_file, peak_mb = streamSeriesStore(
+                eba_path, ba_filter=self.ba_filter, fuel_filter=self.fuel_filter)
+            if self.use_cache and self.ba_filter is None and self.fuel_filter is None:
+                store = self._writeCache(store, cache_path, eba_path, ba_this_file, ts_this_file)
+            print("EIA data prep done! (peak memory {0:.0f} MB)".format(peak_mb))
+            return self._replace(None, store, ba_this_file, ts_this_file)
+
+        # EBA.txt includes time series for power generation from
+        # each balancing authority in json format.
+        with profiling.stage("eia.read_json"):
+            table = readEBATable(eba_path)
+            if table is not None:
+                eba_json = table.to_pandas()
+        #writeCSV(eba_json, self.EIA_data_path)
+
+        # Index the hourly generation series so that extractBARange
+        # does not have to scan eba_json for every BA and fuel type
+        with profiling.stage("eia.build_store"):
+            if table is not None:
+                store = buildSeriesStore(table)
+            else:
+                # values are numbers as in EIA's files, read line by line,
+                # no faster than the original reader (see readEBAFrame)
+                eba_json, store = readEBAFrame(eba_path)
+
+        # Construct list of BAs (ba_list)
+        # Construct list of time series (ts_list) using CISO as reference
+        #
+        series_id_unique = list(eba_json.series_id.unique())
+        series_id_unique = list(filter(lambda x: type(x) == str, series_id_unique))
+        ba_this_file, ts_this_file = listBAsAndSeries(series_id_unique)
+
+        if self.use_cache:
+            store = self._writeCache(store, cache_path, eba_path, ba_this_file, ts_this_file)
+        print("EIA data prep done!")
+
+        return self._replace(eba_json, store, ba_this_file, ts_this_file)
+
+    # Write store to the cache, returns the cached store, or store itself
+    # with a warning if the cache cannot be written
+    def _writeCache(self, store, cache_path, eba_path, ba_list, ts_list):
+        try:
+            with profiling.stage("eia.write_cache"):
+                manifest = writeSeriesCache(store, cache_path, eba_path,
+                                            {"ba_list": ba_list, "ts_list": ts_list})
+        except OSError as e:
+            warnings.warn("EIA data cache {0} not written, using the data uncached: {1}".format(
+                cache_path, e))
+            return store
+        return CachedSeriesStore(cache_path, manifest)
+
+    # Update EIA_data_path with a newer EBA bulk file, source is EBA.zip,
+    # an EBA.txt or a directory containing EBA.txt.
+    # When EIA_data_path has an up to date cache (prepared with use_cache=True,
+    # see prepare), only the new hours of each series are appended to it and
+    # only results derived from the series that changed are recomputed (see
+    # extractBACarbonIntensity), otherwise EBA.txt is replaced and prepared
+    # from scratch (with use_cache as for prepare).
+    # An incremental refresh does not parse EBA.txt as a whole, eba_json is
+    # then None (also for the dataset's eba_json afterwards), even if it was
+    # loaded before the refresh.
+    # returns eba_json, ba_list and ts_list
+    @profiling.instrument("eia.refreshEIAData")
+    def refresh(self, source):
+        with self._lock:
+            eba_path = "{0}/EBA.txt".format(self.EIA_data_path)
+            cache_path = "{0}/EBA_cache".format(self.EIA_data_path)
+            store = None
+            if os.path.exists(eba_path):
+                store, _ = loadSeriesCache(cache_path, eba_path)
+
+            with tempfile.TemporaryDirectory(dir=self.EIA_data_path) as tmp_dir:
+                if os.path.isdir(source):
+                    source = os.path.join(source, "EBA.txt")
+                elif zipfile.is_zipfile(source):
+                    with zipfile.ZipFile(source, "r") as zip_ref:
+                        zip_ref.extract("EBA.txt", tmp_dir)
+                    source = os.path.join(tmp_dir, "EBA.txt")
+                shutil.copy2(source, eba_path)
+
+            if store is None:
+                return self._prepare()
+
+            try:
+                store, manifest, updated = appendSeriesCache(cache_path, eba_path)
+            except OSError as e:
+                warnings.warn("EIA data cache {0} not updated, preparing the data again: {1}".format(
+                    cache_path, e))
+                return self._prepare()
+            print("EIA data refresh done! {0} series updated".format(len(updated)))
+            return self._replace(None, store, manifest["ba_list"], manifest["ts_list"])
+
+    # Version of the generation data of a balancing authority, results
+    # extracted from it are cached with it (see result_cache)
+    def baDataVersion(self, ba_idx):
+        return self.store.dataVersion(baSeries(ba_idx))
+
+    # Results of the methods are cached on the version of the data they
+    # read (see baDataVersion), not on the dataset object
+    def cache_key(self):
+        return None
+
+    # Construct dataframe from json
+    # Target specific balancing authority and day
+    @profiling.instrument("eia.extractBARange")
+    @result_cache.memoize("eia.extractBARange",
+                          version=lambda arguments: arguments["self"].baDataVersion(arguments["ba_idx"]))
+    def extractBARange(self, ba_idx, start_day, end_day): 
+        start_idx = pd.Timestamp('{0}T00Z'.format(start_day), tz='UTC')
+        end_idx = pd.Timestamp('{0}T00Z'.format(end_day), tz='UTC')
+
+        idx = pd.date_range(start_day, end_day, freq = "H", tz='UTC')
+
+        # (hours x energy types) generation matrix, hours without data stay 0
+        #
+        power = np.zeros((idx.shape[0], len(ng_list)))
+        fillBARange(self.store, power, ba_idx, start_idx, end_idx)
+
+        power[np.isnan(power)] = 0
+        dfa = pd.DataFrame(power.astype(int), columns=ng_list, index=idx)
+        return dfa
+
+    # Extract several balancing authorities at once
+    # Returns a (BA x hour x energy type) array, in the order of ba_idx_list
+    # and ng_list, and the hourly index
+    @profiling.instrument("eia.extractBARangeArray")
+    def extractBARangeArray(self, ba_idx_list, start_day, end_day):
+        start_idx = pd.Timestamp('{0}T00Z'.format(start_day), tz='UTC')
+        end_idx = pd.Timestamp('{0}T00Z'.format(end_day), tz='UTC')
+
+        idx = pd.date_range(start_day, end_day, freq = "H", tz='UTC')
+
+        store = self.store
+        power = np.zeros((len(ba_idx_list), idx.shape[0], len(ng_list)))
+        for i, ba_idx in enumerate(ba_idx_list):
+            fillBARange(store, power[i], ba_idx, start_idx, end_idx)
+
+        power[np.isnan(power)] = 0
+        return power.astype(int), idx
+
+    # Extract several balancing authorities at once as a dataframe with
+    # (BA, energy type) columns, dfa[ba_idx] equals extractBARange(ba_idx, ...)
+    def extractBARangeMulti(self, ba_idx_list, start_day, end_day):
+        power, idx = self.extractBARangeArray(ba_idx_list, start_day, end_day)
+        columns = pd.MultiIndex.from_product([list(ba_idx_list), ng_list])
+        dfa = pd.DataFrame(power.transpose(1, 0, 2).reshape(idx.shape[0], -1), columns=columns, index=idx)
+        return dfa
+
+    # Result of compute() derived from the generation of the balancing
+    # authorities in ba_idx_list, key (any repr-able value) identifies it and
+    # all other inputs of compute, e.g. for a renewable coverage:
+    #   dataset.derived(("coverage", ba_idx, start_day, end_day, scenario), [ba_idx],
+    #                   lambda: calculate_coverage(...))
+    # With a cached store the result is kept with the cache and only recomputed
+    # after one of the BAs' series is refreshed, otherwise it is computed on
+    # every call.
+    def derived(self, key, ba_idx_list, compute):
+        store = self.store
+        if not hasattr(store, "derived"):
+            return compute()
+        series = [sid for ba_idx in ba_idx_list for sid in baSeries(ba_idx)]
+        return store.derived(key, series, compute)
+
+    # Carbon intensity of a balancing authority between start_day and end_day,
+    # kept with a cached store until the BA's series are refreshed (see derived)
+    @profiling.instrument("eia.extractBACarbonIntensity")
+    def extractBACarbonIntensity(self, ba_idx, start_day, end_day):
+        return self.derived(("carbon_intensity", ba_idx, start_day, end_day), [ba_idx],
+                            lambda: calculateAVGCarbonIntensity(self.extractBARange(ba_idx, start_day, end_day)))
+
+
+# The functions below work on the default dataset, the one last prepared
+# with prepareEIAData or refreshEIAData (or set with setDefaultDataset),
+# as used by the notebooks:
+#   eba_json, ba_list, ts_list = prepareEIAData(EIA_bulk_data_dir)
+#   extractBARange(ba_list[0], "2021-01-01", "2021-02-01")
+_default = None
+
+def defaultDataset():
+    if _default is None:
+        raise RuntimeError("no EIA data prepared, call prepareEIAData first")
+    return _default
+
+def setDefaultDataset(dataset):
+    global _default
+    _default = dataset
+
+# Prepare the EIA data in EIA_data_path as the default dataset, see
+# EIADataset.prepare for the options
+# returns eba_json (None when loaded from the cache or streamed), ba_list and ts_list
+def prepareEIAData(EIA_data_path, use_cache=False, streaming=False, ba_filter=None, fuel_filter=None):
+    dataset = EIADataset(EIA_data_path, use_cache, streaming, ba_filter, fuel_filter)
+    result = dataset.prepare()
+    setDefaultDataset(dataset)
+    return result
+
+# Refresh EIA_data_path with source (see EIADataset.refresh) as the default dataset
+# returns eba_json (None after an incremental refresh), ba_list and ts_list
+def refreshEIAData(EIA_data_path, source, use_cache=False):
+    dataset = EIADataset(EIA_data_path, use_cache)
+    result = dataset.refresh(source)
+    setDefaultDataset(dataset)
+    return result
+
+def extractBARange(ba_idx, start_day, end_day):
+    return defaultDataset().extractBARange(ba_idx, start_day, end_day)
+
+def extractBARangeArray(ba_idx_list, start_day, end_day):
+    return defaultDataset().extractBARangeArray(ba_idx_list, start_day, end_day)
+
+def extractBARangeMulti(ba_idx_list, start_day, end_day):
+    return defaultDataset().extractBARangeMulti(ba_idx_list, start_day, end_day)
+
+def extractBACarbonIntensity(ba_idx, start_day, end_day):
+    return defaultDataset().extractBACarbonIntensity(ba_idx, start_day, end_day)
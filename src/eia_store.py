@@ -0,0 +1,495 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import hashlib
+import json
+import os
+import pickle
+import re
+import resource
+import shutil
+import threading
+import uuid
+import numpy as np
+import pandas as pd
+
+# pyarrow is imported by the functions that read or write Arrow data, so that
+# importing this module does not load it
+
+# Hourly (UTC) net generation series by energy source, EBA.<BA>-ALL.NG.<fuel>.H
+ng_series_pattern = r"^EBA\.[^.]+-ALL\.NG\.[^.]+\.H$"
+
+# Columnar store of EIA time series.
+# The (timestamp, MWh) points of all series are kept in two contiguous arrays,
+# timestamps as int64 nanoseconds since epoch (UTC) and values as float64
+# (float32 when streamed, nan where EIA has no value), with the points of
+# each series sorted by time.
+# index maps a series_id to the (offset, length) of its points in the arrays.
+class EIASeriesStore:
+    def __init__(self, index, timestamps, values):
+        self.index = index
+        self.timestamps = timestamps
+        self.values = values
+        self.token = uuid.uuid4().hex
+
+    def __contains__(self, series_id):
+        return series_id in self.index
+
+    # returns the timestamp and value arrays of series_id, None if it is not stored
+    def get(self, series_id):
+        if series_id not in self.index:
+            return None
+        offset, length = self.index[series_id]
+        return self.timestamps[offset:offset + length], self.values[offset:offset + length]
+
+    # returns the points of series_id with start <= timestamp <= end,
+    # start and end are pd.Timestamps
+    def range(self, series_id, start, end):
+        return sliceRange(*self.get(series_id), start, end)
+
+    # Version of the data of series_ids, results computed from them can be
+    # reused while it is unchanged. An in memory store has no record of its
+    # source, so every store is its own version.
+    def dataVersion(self, series_ids):
+        return self.token
+
+def sliceRange(timestamps, values, start, end):
+    first = np.searchsorted(timestamps, start.value, side="left")
+    last = np.searchsorted(timestamps, end.value, side="right")
+    return timestamps[first:last], values[first:last]
+
+days_in_month = np.array([31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31])
+
+# Parse EIA timestamps (e.g. 20210101T00Z) into int64 nanoseconds since epoch (UTC)
+def parseEIATimestamps(stamps):
+    # fixed width YYYYMMDDTHHZ, decode the digits directly
+    chars = np.asarray(stamps, dtype="U12")
+    codes = chars.view(np.uint32).reshape(len(chars), 12).astype(np.int64)
+    digits = codes[:, [0, 1, 2, 3, 4, 5, 6, 7, 9, 10]] - ord("0")
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    hour = digits[:, 8] * 10 + digits[:, 9]
+    leap = ((year % 4 == 0) & (year % 100 != 0)) | (year % 400 == 0)
+    month_days = days_in_month[np.clip(month, 1, 12) - 1] + ((month == 2) & leap)
+    # anything else (e.g. 20210230T00Z) is left to pandas to parse or reject
+    if len(chars) > 0 and (codes[:, 8] == ord("T")).all() and (codes[:, 11] == ord("Z")).all() \
+            and ((digits >= 0) & (digits <= 9)).all() \
+            and ((month >= 1) & (month <= 12) & (day >= 1) & (day <= month_days) & (hour <= 23)).all():
+        days = ((year - 1970).astype("datetime64[Y]").astype("datetime64[M]")
+                + (month - 1).astype("timedelta64[M]")).astype("datetime64[D]") \
+            + (day - 1).astype("timedelta64[D]")
+        return days.astype("datetime64[ns]").astype(np.int64) + hour * 3600 * 10**9
+
+    try:
+        parsed = pd.to_datetime(stamps, format="%Y%m%dT%HZ", utc=True)
+    except ValueError:
+        parsed = pd.to_datetime(stamps, utc=True)
+    return np.asarray(parsed.asi8, dtype=np.int64)
+
+# Read EBA.txt into a pyarrow table, None if pyarrow cannot read the file,
+# which is then read with readEBAFrame. In EIA's own files the values of the
+# [date, value] pairs are numbers (or null) next to string dates, which
+# pyarrow cannot type, so those always take the fallback.
+# A series (line) longer than the block size is read again with blocks that
+# hold the longest line.
+def readEBATable(eba_path, block_size=2048576):
+    import pyarrow as pa
+    from pyarrow import json as arrow_json
+    try:
+        try:
+            return arrow_json.read_json(eba_path, read_options=arrow_json.ReadOptions(block_size=block_size))
+        except pa.ArrowInvalid as e:
+            if "straddling object" not in str(e):
+                raise
+            with open(eba_path, "rb") as f:
+                longest = max(map(len, f))
+            return arrow_json.read_json(eba_path, read_options=arrow_json.ReadOptions(block_size=longest + 1))
+    except pa.ArrowInvalid:
+        return None
+
+# Read EBA.txt line by line, for files pyarrow cannot read (see readEBATable).
+# Returns the records as a pandas frame, like the pyarrow table's to_pandas(),
+# and the store of the series whose series_id matches series_pattern
+# (values as float64, like buildSeriesStore).
+# Every record is parsed with json into a dict for the frame, so for EIA's own
+# files preparing is bound by json parsing and not faster than the original
+# pyarrow read (the gain is in the extraction from the store afterwards).
+# Streaming (streamSeriesStore) parses the series into the store without
+# building the frame.
+def readEBAFrame(eba_path, series_pattern=ng_series_pattern):
+    keep_pattern = re.compile(series_pattern)
+    records = []
+
+    def series():
+        with open(eba_path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                records.append(record)
+                sid = record.get("series_id")
+                if isinstance(sid, str) and keep_pattern.match(sid):
+                    yield (sid,) + parseSeriesData(record.get("data") or [])
+
+    store = collectSeriesStore(series(), np.float64)
+    return pd.DataFrame.from_records(records), store
+
+# Build the series store from the EBA pyarrow table (as read from EBA.txt),
+# keeping the series whose series_id matches series_pattern.
+# The nested [date, MWh] lists are flattened and parsed in bulk.
+def buildSeriesStore(table, series_pattern=ng_series_pattern):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    series_ids = table.column("series_id").to_pandas()
+    keep = series_ids.str.match(series_pattern).fillna(False).to_numpy(dtype=bool)
+    series_ids = series_ids[keep].tolist()
+    data = table.column("data").combine_chunks().filter(pa.array(keep))
+
+    lengths = data.value_lengths().fill_null(0).to_numpy(zero_copy_only=False).astype(np.int64)
+    pairs = data.flatten()
+    if pairs.null_count > 0 or not pc.all(pc.equal(pairs.value_lengths(), 2)).as_py():
+        raise ValueError("EIA data points are expected to be [date, value] pairs")
+    points = pairs.flatten().to_numpy(zero_copy_only=False)
+
+    timestamps = parseEIATimestamps(points[0::2])
+    values = pd.to_numeric(points[1::2], errors="coerce").astype(np.float64)
+
+    # sort the points of every series by time
+    series_code = np.repeat(np.arange(len(series_ids)), lengths)
+    order = np.lexsort((timestamps, series_code))
+    timestamps = timestamps[order]
+    values = values[order]
+
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])) if len(series_ids) else []
+    index = {sid: (int(offset), int(length))
+             for sid, offset, length in zip(series_ids, offsets, lengths)}
+    return EIASeriesStore(index, timestamps, values)
+
+# Read EBA.txt one line (series) at a time without materializing the file.
+# Yields (series_id, timestamps, values) for the series matching series_pattern,
+# optionally restricted to the BAs in ba_filter and fuel types in fuel_filter,
+# with timestamps as sorted int64 ns and values as float32.
+# series_ids, if given, collects the series_id of every series in the file.
+# since, if given, maps series_id to the timestamp of its last known point,
+# series with no newer points are skipped without decoding their data.
+def iterEBASeries(eba_path, series_pattern=ng_series_pattern, ba_filter=None,
+                  fuel_filter=None, series_ids=None, since=None):
+    keep_pattern = re.compile(series_pattern)
+    id_pattern = re.compile(r'"series_id"\s*:\s*"([^"]*)"')
+    ng_pattern = re.compile(r"EBA\.(.+)-ALL\.NG\.(.+)\.H$")
+    first_pattern = re.compile(r'"data"\s*:\s*\[\s*\[\s*"(\d{8}T\d{2}Z)"')
+    last_pattern = re.compile(r'\[\s*"(\d{8}T\d{2}Z)"[^\[]*\]\s*\]\s*[,}]?\s*$')
+
+    with open(eba_path, "r") as f:
+        for line in f:
+            # look at the series_id before parsing the (large) data array
+            m = id_pattern.search(line)
+            if m is None:
+                continue
+            sid = m.group(1)
+            if series_ids is not None:
+                series_ids.append(sid)
+            if not keep_pattern.match(sid):
+                continue
+            ng = ng_pattern.match(sid)
+            if ng is not None:
+                if ba_filter is not None and ng.group(1) not in ba_filter:
+                    continue
+                if fuel_filter is not None and ng.group(2) not in fuel_filter:
+                    continue
+            if since is not None and since.get(sid) is not None:
+                # data is sorted (newest first in EIA files), so the newest
+                # point is at one of the two ends of the array
+                first = first_pattern.search(line)
+                last = last_pattern.search(line)
+                if first is not None and last is not None and \
+                        parseEIATimestamps([first.group(1), last.group(1)]).max() <= since[sid]:
+                    continue
+
+            yield (sid,) + parseSeriesData(json.loads(line).get("data") or [], np.float32)
+
+# Parse the [date, value] pairs of a series (values strings, numbers or null)
+# returns the timestamps as sorted int64 ns and the values as dtype, nan for null
+def parseSeriesData(data, dtype=np.float64):
+    timestamps = parseEIATimestamps([x[0] for x in data])
+    values = pd.to_numeric(pd.Series([x[1] for x in data], dtype=object),
+                           errors="coerce").to_numpy(dtype=dtype)
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], values[order]
+
+# Store of the (series_id, timestamps, values) of series, concatenated
+# into the contiguous arrays of the store
+def collectSeriesStore(series, dtype=np.float32):
+    index = {}
+    timestamp_chunks = []
+    value_chunks = []
+    offset = 0
+    for sid, timestamps, values in series:
+        index[sid] = (offset, len(timestamps))
+        offset += len(timestamps)
+        timestamp_chunks.append(timestamps)
+        value_chunks.append(values)
+
+    timestamps = np.concatenate(timestamp_chunks) if timestamp_chunks else np.zeros(0, dtype=np.int64)
+    del timestamp_chunks
+    values = np.concatenate(value_chunks) if value_chunks else np.zeros(0, dtype=dtype)
+    del value_chunks
+    return EIASeriesStore(index, timestamps, values)
+
+# Construct list of BAs (ba_list) and list of time series (ts_list) using
+# CISO as reference from the series_ids of EBA.txt
+def listBAsAndSeries(series_ids):
+    ba_list = {}
+    ts_list = []
+    for sid in series_ids:
+        m = re.search("EBA.(.+?)-", sid)
+        ba_list[m.group(1)] = None
+        if m.group(1) == "CISO":
+            m = re.search("EBA.CISO-([A-Z\\-]+\\.)([A-Z\\.\\-]*)", sid)
+            ts_list.append(m.group(2))
+    return list(ba_list), ts_list
+
+# Streaming alternative to reading EBA.txt with pyarrow and building the store
+# from the table, peak memory is bounded by the largest series plus the
+# compact arrays of the series kept.
+# Returns the store, ba_list and ts_list (derived from all series in the file)
+# and the peak resident memory of the process in MB.
+def streamSeriesStore(eba_path, series_pattern=ng_series_pattern, ba_filter=None, fuel_filter=None):
+    series_ids = []
+    store = collectSeriesStore(iterEBASeries(eba_path, series_pattern, ba_filter, fuel_filter, series_ids))
+
+    ba_list, ts_list = listBAsAndSeries(series_ids)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return store, ba_list, ts_list, peak_mb
+
+# On-disk cache of a series store, Arrow IPC files per BA and fuel type:
+#   <cache_path>/manifest.json
+#   <cache_path>/ba=<BA>/<fuel>.<part>.arrow
+#   <cache_path>/derived/<key hash>.pkl
+# The manifest records the sha256 of the EBA.txt it was built from, so a
+# new download invalidates the cache, unless it is applied with
+# appendSeriesCache, which adds the new points of a series as another part
+# (and merges parts past a threshold).
+# Every series has a version, bumped when points are appended, so that
+# results derived from it are recomputed (see derived).
+# Partitions are memory-mapped when a series is first requested, so only the
+# BAs that are analyzed are ever read from disk. A store can be read from
+# several threads, each series is loaded once.
+class CachedSeriesStore:
+    def __init__(self, cache_path, manifest):
+        self.cache_path = cache_path
+        self.partitions = manifest["partitions"]
+        self.versions = manifest["versions"]
+        self.origin = manifest.get("origin", manifest["source"]["sha256"])
+        self.loaded = {}
+        self.lock = threading.Lock()
+
+    def __contains__(self, series_id):
+        return series_id in self.partitions
+
+    def get(self, series_id):
+        if series_id not in self.partitions:
+            return None
+        series = self.loaded.get(series_id)
+        if series is not None:
+            return series
+        with self.lock:
+            if series_id not in self.loaded:
+                timestamps = []
+                values = []
+                for partition in self.partitions[series_id]:
+                    part_timestamps, part_values = readPartition(os.path.join(self.cache_path, partition))
+                    timestamps.append(part_timestamps)
+                    values.append(part_values)
+                if len(timestamps) == 1:
+                    self.loaded[series_id] = (timestamps[0], values[0])
+                else:
+                    self.loaded[series_id] = (np.concatenate(timestamps), np.concatenate(values))
+            return self.loaded[series_id]
+
+    def range(self, series_id, start, end):
+        return sliceRange(*self.get(series_id), start, end)
+
+    # Version of the data of series_ids, the file the cache was built from
+    # and the number of refreshes that added points to each series
+    def dataVersion(self, series_ids):
+        return (self.origin, tuple(self.versions.get(sid, 0) for sid in series_ids))
+
+    # Result of compute() for key, computed from the series in series_ids.
+    # The result is kept on disk with the versions of these series and
+    # reused until one of them gets new points.
+    def derived(self, key, series_ids, compute):
+        versions = {sid: self.versions.get(sid, 0) for sid in series_ids}
+        path = os.path.join(self.cache_path, "derived",
+                            hashlib.sha256(repr(key).encode()).hexdigest() + ".pkl")
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                saved_key, saved_versions, result = pickle.load(f)
+            if saved_key == key and saved_versions == versions:
+                return result
+
+        result = compute()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # a temporary file of its own, other threads may write the same result
+        tmp_path = "{0}.{1}.tmp".format(path, uuid.uuid4().hex)
+        with open(tmp_path, "wb") as f:
+            pickle.dump((key, versions, result), f)
+        os.replace(tmp_path, path)
+        return result
+
+# sha256 of a file, read in chunks
+def hashFile(path, chunk_size=1 << 24):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+def sourceInfo(source_path):
+    stat = os.stat(source_path)
+    return {
+        "path": os.path.abspath(source_path),
+        "sha256": hashFile(source_path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns,
+    }
+
+# Path of the part-th partition of series_id, relative to the cache
+def partitionPath(series_id, part):
+    m = re.match(r"EBA\.(.+)-ALL\.NG\.(.+)\.H$", series_id)
+    return os.path.join("ba={0}".format(m.group(1)), "{0}.{1}.arrow".format(m.group(2), part))
+
+def writePartition(path, timestamps, values):
+    import pyarrow as pa
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.table({
+        "timestamp": pa.array(timestamps, type=pa.int64()).cast(pa.timestamp("ns", tz="UTC")),
+        "value": pa.array(values, type=pa.float64()),
+    })
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+# returns the timestamp and value arrays of a partition, memory-mapped
+def readPartition(path):
+    import pyarrow as pa
+    with pa.memory_map(path) as source:
+        table = pa.ipc.open_file(source).read_all()
+    return (table.column("timestamp").combine_chunks().cast(pa.int64()).to_numpy(),
+            table.column("value").combine_chunks().to_numpy())
+
+def readManifest(cache_path):
+    manifest_path = os.path.join(cache_path, "manifest.json")
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+def writeManifest(cache_path, manifest):
+    manifest_path = os.path.join(cache_path, "manifest.json")
+    with open(manifest_path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(manifest_path + ".tmp", manifest_path)
+
+# Load the cached store built from source_path, None if there is no cache or
+# it was built from a different file.
+# Returns the store and the manifest.
+def loadSeriesCache(cache_path, source_path):
+    manifest = readManifest(cache_path)
+    if manifest is None:
+        return None, None
+
+    # Skip hashing the source file if it was not touched since the cache was built
+    stat = os.stat(source_path)
+    source = manifest["source"]
+    if (source["size"], source["mtime_ns"]) != (stat.st_size, stat.st_mtime_ns):
+        if hashFile(source_path) != source["sha256"]:
+            return None, None
+
+    return CachedSeriesStore(cache_path, manifest), manifest
+
+# Write store to cache_path, built from source_path.
+# extra is saved in the manifest along with the partitions (e.g. ba_list, ts_list).
+# The cache is written next to cache_path and moved in place when complete,
+# a cache that fails to be written is removed.
+def writeSeriesCache(store, cache_path, source_path, extra=None):
+    tmp_path = cache_path + ".tmp"
+    if os.path.exists(tmp_path):
+        shutil.rmtree(tmp_path)
+    os.makedirs(tmp_path)
+
+    try:
+        manifest = dict(extra) if extra is not None else {}
+        manifest["source"] = sourceInfo(source_path)
+        manifest["origin"] = manifest["source"]["sha256"]
+        manifest["partitions"] = {}
+        manifest["last"] = {}
+        manifest["versions"] = {}
+        for series_id in store.index:
+            timestamps, values = store.get(series_id)
+            partition = partitionPath(series_id, 0)
+            writePartition(os.path.join(tmp_path, partition), timestamps, values)
+            manifest["partitions"][series_id] = [partition]
+            manifest["last"][series_id] = int(timestamps[-1]) if len(timestamps) else None
+            manifest["versions"][series_id] = 0
+        writeManifest(tmp_path, manifest)
+
+        if os.path.exists(cache_path):
+            shutil.rmtree(cache_path)
+        os.rename(tmp_path, cache_path)
+    except BaseException:
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        raise
+    return manifest
+
+# Bring the cache up to date with source_path, a newer EBA.txt.
+# Only the points after the last cached point of each series are written,
+# as a new partition (named by the series' new version), and the versions of
+# the series that changed are bumped.
+# A series that already has max_parts partitions is compacted while
+# appending: its appended partitions are merged with the new points into one,
+# together with the first (the full history) once they hold as many points,
+# so loading a series maps a bounded number of files and the cost of a
+# refresh stays proportional to the data appended since the last merge.
+# Merged partitions are deleted, stores opened on the previous manifest
+# must not read series they have not loaded yet.
+# Revisions of already cached points are not picked up.
+# Returns the store, the manifest and the series_ids that got new points.
+def appendSeriesCache(cache_path, source_path, max_parts=8):
+    manifest = readManifest(cache_path)
+    last = manifest["last"]
+    series_ids = []
+    updated = []
+    merged = []
+    for series_id, timestamps, values in iterEBASeries(source_path, series_ids=series_ids, since=last):
+        if last.get(series_id) is not None:
+            new = timestamps > last[series_id]
+            timestamps, values = timestamps[new], values[new]
+        if len(timestamps) == 0:
+            continue
+
+        partitions = manifest["partitions"].setdefault(series_id, [])
+        version = manifest["versions"].get(series_id, 0) + 1
+        if len(partitions) >= max_parts:
+            parts = [readPartition(os.path.join(cache_path, partition)) for partition in partitions]
+            tail_points = sum(len(part[0]) for part in parts[1:]) + len(timestamps)
+            first = 0 if tail_points >= len(parts[0][0]) else 1
+            timestamps = np.concatenate([part[0] for part in parts[first:]] + [timestamps])
+            values = np.concatenate([part[1] for part in parts[first:]] + [values.astype(np.float64)])
+            merged.extend(partitions[first:])
+            del partitions[first:]
+        partition = partitionPath(series_id, version)
+        writePartition(os.path.join(cache_path, partition), timestamps, values)
+        partitions.append(partition)
+        last[series_id] = int(timestamps[-1])
+        manifest["versions"][series_id] = version
+        updated.append(series_id)
+
+    manifest["ba_list"], manifest["ts_list"] = listBAsAndSeries(series_ids)
+    manifest["source"] = sourceInfo(source_path)
+    writeManifest(cache_path, manifest)
+    for partition in merged:
+        os.remove(os.path.join(cache_path, partition))
+    return CachedSeriesStore(cache_path, manifest), manifest, updated
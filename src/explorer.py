@@ -0,0 +1,163 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import bisect
+import itertools
+import numpy as np
+import pandas as pd
+
+from . import profiling
+from .battery import Battery2, apply_battery_arrays
+from .cas import cas_arrays
+from .utils import pareto_frontier
+
+# Design space exploration of renewable investments for a datacenter:
+# solar and wind capacity built for it, battery size and the share of
+# flexible workload shifted by carbon aware scheduling (cas).
+# Every design point scales the solar and wind capacity factor profiles,
+# reschedules the dc power with cas and applies the battery, giving the
+# renewable coverage and the non renewable energy left. The Pareto front of
+# investment cost against coverage is returned.
+
+# Hourly capacity factors (generation per MW installed) of solar and wind
+# from a BA's generation (i.e. output of extractBARange), the installed
+# capacity is estimated as the peak generation.
+# returns the solar and wind capacity factor arrays
+def capacity_factors(db):
+    profiles = []
+    for fuel in ("SUN", "WND"):
+        gen = np.clip(db[fuel].to_numpy(dtype=np.float64), 0, None)
+        peak = gen.max() if gen.shape[0] else 0
+        profiles.append(gen / peak if peak > 0 else np.zeros_like(gen))
+    return profiles[0], profiles[1]
+
+# Counters of an exploration, pass an instance to explore to fill it in
+class ExploreStats:
+    def __init__(self):
+        self.points = 0 # design points in the grid
+        self.evaluated = 0 # design points simulated
+        self.pruned = 0 # design points skipped as dominated
+        self.schedules = 0 # cas runs
+
+# Best coverage found so far as a staircase of (cost, coverage) points with
+# increasing cost and coverage, best(cost) is the highest coverage of any
+# point evaluated so far that costs at most cost
+class _Staircase:
+    def __init__(self):
+        self.costs = []
+        self.coverages = []
+
+    def best(self, cost):
+        i = bisect.bisect_right(self.costs, cost)
+        return self.coverages[i - 1] if i > 0 else -np.inf
+
+    def add(self, cost, coverage):
+        if coverage <= self.best(cost):
+            return
+        i = bisect.bisect_left(self.costs, cost)
+        # drop the points this one dominates
+        j = i
+        while j < len(self.costs) and self.coverages[j] <= coverage:
+            j += 1
+        self.costs[i:j] = [cost]
+        self.coverages[i:j] = [coverage]
+
+# Explore all combinations of solar_mw, wind_mw (MW installed), battery_mwh
+# and flexible_workload_ratios (% of dc power cas may shift, 0 for none).
+# solar_cf and wind_cf are hourly capacity factors (see capacity_factors) and
+# dc_mw the hourly dc power, max_capacity the dc power limit for cas.
+# costs holds the cost per MW of "solar" and "wind", per MWh of "battery" and
+# optionally per % of "flexible" workload (0 by default), in any unit.
+#
+# Coverage never decreases with more battery, solar or wind, so a design
+# point can be skipped once a point that costs no more reaches the highest
+# coverage it could get. Design points are visited in ascending cost of
+# (solar, wind, flexible workload), for each of them the largest battery is
+# simulated first as the coverage bound of the smaller ones, which are then
+# simulated in ascending size until the bound is reached or a cheaper point
+# already covers as much. With prune=False every point is simulated.
+# returns the Pareto front as a dataframe sorted by cost, with return_points
+# also a dataframe of all simulated design points
+@profiling.instrument("explorer.explore")
+def explore(solar_cf, wind_cf, dc_mw, solar_mw, wind_mw, battery_mwh, flexible_workload_ratios,
+            max_capacity, costs, prune=True, window=24, points_per_hour=60, stats=None,
+            return_points=False):
+    if stats is None:
+        stats = ExploreStats()
+    dc_mw = np.asarray(dc_mw, dtype=np.float64)
+    solar_cf = np.nan_to_num(np.asarray(solar_cf, dtype=np.float64)[:dc_mw.shape[0]])
+    wind_cf = np.nan_to_num(np.asarray(wind_cf, dtype=np.float64)[:dc_mw.shape[0]])
+    sum_dc = dc_mw.sum()
+    params = Battery2(0).params()
+    battery_mwh = np.sort(np.asarray(battery_mwh, dtype=np.float64))
+    flexible_cost = costs.get("flexible", 0)
+
+    def cost_of(solar, wind, battery, ratio):
+        return (costs["solar"] * solar + costs["wind"] * wind + costs["battery"] * battery
+                + flexible_cost * ratio)
+
+    # returns the non renewable energy left with a battery of size capacity
+    def non_renewable(ren, dc, capacity):
+        stats.evaluated += 1
+        profiling.count("explorer.points_evaluated")
+        if capacity == 0:
+            return np.fmax(dc - ren, 0).sum()
+        return apply_battery_arrays(ren, dc, capacity, capacity, params, points_per_hour)[0]
+
+    combos = sorted(itertools.product(solar_mw, wind_mw, flexible_workload_ratios),
+                    key=lambda c: cost_of(c[0], c[1], 0, c[2]))
+    stats.points += len(combos) * battery_mwh.shape[0]
+    best = _Staircase()
+    rows = []
+    for solar, wind, ratio in combos:
+        batteries = battery_mwh
+        # nothing in this combination can beat a cheaper full coverage
+        if prune and best.best(cost_of(solar, wind, batteries[0], ratio)) >= 100:
+            stats.pruned += batteries.shape[0]
+            continue
+
+        ren = solar * solar_cf + wind * wind_cf
+        dc = dc_mw
+        if ratio > 0:
+            dc = cas_arrays(ren, dc_mw, ratio, max_capacity, window)
+            stats.schedules += 1
+
+        def add(battery, residual):
+            coverage = (sum_dc - residual) / sum_dc * 100
+            cost = cost_of(solar, wind, battery, ratio)
+            rows.append((solar, wind, battery, ratio, cost, coverage, residual))
+            best.add(cost, coverage)
+            return coverage
+
+        if not prune:
+            for battery in batteries:
+                add(battery, non_renewable(ren, dc, battery))
+            continue
+
+        # the largest battery bounds the coverage of the smaller ones
+        bound = add(batteries[-1], non_renewable(ren, dc, batteries[-1]))
+        for k, battery in enumerate(batteries[:-1]):
+            if best.best(cost_of(solar, wind, battery, ratio)) >= bound:
+                stats.pruned += batteries.shape[0] - 1 - k
+                break
+            if add(battery, non_renewable(ren, dc, battery)) >= bound:
+                # larger batteries cost more for the same coverage
+                stats.pruned += batteries.shape[0] - 2 - k
+                break
+
+    profiling.count("explorer.points_pruned", stats.pruned)
+    points = pd.DataFrame(rows, columns=["solar_mw", "wind_mw", "battery_mwh",
+                                         "flexible_workload_ratio", "cost", "coverage",
+                                         "non_renewable_mwh"])
+    # lowest cost first, for equal costs the highest coverage, and keep
+    # only the points that improve the coverage
+    _, _, idx = pareto_frontier(-points["cost"].to_numpy(), points["coverage"].to_numpy(),
+                                return_index=True)
+    front = points.iloc[idx]
+    improves = np.ones(front.shape[0], dtype=bool)
+    improves[1:] = np.diff(front["coverage"].to_numpy()) > 0
+    front = front[improves].reset_index(drop=True)
+    if return_points:
+        return front, points
+    return front
@@ -0,0 +1,109 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import pandas as pd
+
+from . import profiling
+from .battery import calculate_247_battery_capacity_b2_sim
+from .utils import process_pool
+
+# Battery sizing across weather variability. Synthetic renewable years are
+# built from history by a seasonal block bootstrap of days, every synthetic
+# year is sized with calculate_247_battery_capacity_b2_sim and the capacity
+# distribution and its percentiles are returned.
+#
+# The renewable history is hourly supply starting at 00h of a day, e.g. for
+# solar_mw and wind_mw built at a BA:
+#   solar_cf, wind_cf = explorer.capacity_factors(extractBARange(ba_idx, start_day, end_day))
+#   ren_history = solar_mw * solar_cf + wind_mw * wind_cf
+# Resampling whole days of the supply keeps the hourly shape of a day and
+# the correlation of solar and wind within it.
+
+# Bootstrap blocks of block_days consecutive days of a synthetic year of
+# num_days days, from num_history_days days of history.
+# The block at day p of the synthetic year is drawn from the history blocks
+# starting within season_days days of the same day of the year (p days after
+# the start of any history year), blocks at positions without such a history
+# block are drawn from all history blocks.
+# returns a (blocks x candidates) matrix of candidate start days, padded
+# with -1, and the number of candidates per block
+def bootstrap_candidates(num_history_days, num_days, block_days=7, season_days=15):
+    if num_history_days < block_days:
+        raise ValueError("history of {0} days is shorter than a block of {1} days".format(
+            num_history_days, block_days))
+    starts = np.arange(num_history_days - block_days + 1)
+    positions = np.arange(0, num_days, block_days)
+    # circular distance between days of the year
+    distance = np.abs((starts[None, :] - positions[:, None]) % 365)
+    distance = np.minimum(distance, 365 - distance)
+    near = distance <= season_days
+    near[~near.any(axis=1)] = True
+
+    counts = near.sum(axis=1)
+    candidates = np.full((positions.shape[0], counts.max()), -1, dtype=np.int64)
+    for i in range(positions.shape[0]):
+        candidates[i, :counts[i]] = starts[near[i]]
+    return candidates, counts
+
+# One synthetic year of num_hours hours from the hourly history ren_history,
+# candidates and counts are from bootstrap_candidates, rng a numpy Generator
+def synthetic_year(ren_history, num_hours, candidates, counts, block_days, rng):
+    days = ren_history[:ren_history.shape[0] // 24 * 24].reshape(-1, 24)
+    picks = candidates[np.arange(counts.shape[0]), (rng.random(counts.shape[0]) * counts).astype(np.int64)]
+    day_idx = (picks[:, None] + np.arange(block_days)).ravel()
+    return days[day_idx].ravel()[:num_hours]
+
+# Size the synthetic years of the given seed sequences (one per sample)
+def _size_samples(ren_history, df_dc_pow, max_bsize, block_days, season_days, seeds):
+    num_hours = df_dc_pow.shape[0]
+    candidates, counts = bootstrap_candidates(ren_history.shape[0] // 24, -(-num_hours // 24),
+                                              block_days, season_days)
+    capacities = np.empty(len(seeds))
+    for i, seed in enumerate(seeds):
+        ren_mw = synthetic_year(ren_history, num_hours, candidates, counts, block_days,
+                                np.random.default_rng(seed))
+        capacities[i] = calculate_247_battery_capacity_b2_sim(ren_mw, df_dc_pow, max_bsize)
+    return capacities
+
+# Worker side of the process pool, the history and dc power are sent once
+# per worker instead of with every chunk of samples
+def _init_worker(*args):
+    _init_worker.args = args
+
+def _size_chunk(seeds):
+    return _size_samples(*_init_worker.args, seeds)
+
+# Monte Carlo battery sizing: minimal Battery2 capacities meeting all demand
+# of df_dc_pow (avg_dc_power_mw, hourly) on num_samples synthetic years
+# bootstrapped from ren_history (see bootstrap_candidates).
+# Every sample draws from its own random stream spawned from seed, so the
+# result only depends on seed and not on processes. With processes > 1 the
+# samples are spread over a process pool.
+# returns the capacity of every sample (nan where max_bsize is too small)
+# and a series of the capacity percentiles (P50, P90, P99 by default), the
+# smallest capacity that suffices in at least that share of the samples
+# (inf if max_bsize is too small for more than the rest)
+@profiling.instrument("monte_carlo.monte_carlo_battery_capacity")
+def monte_carlo_battery_capacity(ren_history, df_dc_pow, max_bsize, num_samples=1000, block_days=7,
+                                 season_days=15, seed=None, processes=None,
+                                 percentiles=(50, 90, 99)):
+    ren_history = np.nan_to_num(np.asarray(ren_history, dtype=np.float64))
+    df_dc_pow = df_dc_pow[["avg_dc_power_mw"]]
+    seeds = np.random.SeedSequence(seed).spawn(num_samples)
+    args = (ren_history, df_dc_pow, max_bsize, block_days, season_days)
+    profiling.count("monte_carlo.samples", num_samples)
+
+    if processes is None or processes <= 1:
+        capacities = _size_samples(*args, seeds)
+    else:
+        chunks = [list(chunk) for chunk in np.array_split(np.array(seeds, dtype=object), processes * 4)
+                  if len(chunk)]
+        with process_pool(processes, initializer=_init_worker, initargs=args) as executor:
+            capacities = np.concatenate(list(executor.map(_size_chunk, chunks)))
+
+    summary = pd.Series(np.percentile(np.where(np.isnan(capacities), np.inf, capacities), percentiles,
+                                      method="inverted_cdf"),
+                        index=["P{0}".format(p) for p in percentiles], name="battery_capacity")
+    return capacities, summary
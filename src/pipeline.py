@@ -0,0 +1,142 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import numpy as np
+import pandas as pd
+from multiprocessing import shared_memory
+
+from . import download_and_process
+from .download_and_process import EIADataset
+from .eia_store import EIASeriesStore, CachedSeriesStore, readManifest
+from .utils import process_pool
+
+# Yearly wind and solar analysis of balancing authorities, as in the EIA
+# notebook, run per BA over a process pool.
+# Workers read the series from the parsed EBA arrays placed in shared memory
+# (or from the memory-mapped cache) instead of receiving a pickled copy.
+
+# Average of every hour of the day over the days of df (hourly rows from 00h)
+def hourlyAverage(df):
+    return df.groupby(np.arange(df.shape[0]) % 24).mean()
+
+# Analyze the generation of a BA over a year (output of extractBARange)
+# Returns None if the BA has no wind or solar generation, otherwise a dict of
+#   daily: daily WND and SUN generation
+#   largest_days, smallest_days: the n_days days with the highest and lowest
+#       WND + SUN generation
+#   hourly, hourly_highest, hourly_lowest: hourly average generation of all
+#       days, of the largest_days and of the smallest_days
+# dataset is the EIADataset db is from, the default dataset if None
+def analyzeBAYear(ba_idx, db, n_days=10, dataset=None):
+    if dataset is None:
+        dataset = download_and_process.defaultDataset()
+    db = db.clip(lower=0)
+    db_daily = db[["WND", "SUN"]].resample("D").sum()
+    if (db_daily == 0).all().all():
+        return None
+    db_ren = db_daily.sum(axis=1)
+
+    # Hours of a day are sliced from the year, days cut by the end of the
+    # year are extracted again as a whole
+    def days(day_list):
+        frames = []
+        for day in day_list:
+            first = db.index.searchsorted(day)
+            if first + 24 <= db.shape[0]:
+                frames.append(db.iloc[first:first + 24])
+            else:
+                dbi = dataset.extractBARange(
+                    ba_idx,
+                    day.strftime("%Y-%m-%d"),
+                    (day + pd.Timedelta(days=1)).strftime("%Y-%m-%d"),
+                )[:-1]
+                frames.append(dbi.clip(lower=0))
+        return pd.concat(frames)
+
+    largest_days = db_ren.nlargest(n_days).index
+    smallest_days = db_ren.nsmallest(n_days).index
+    return {
+        "daily": db_daily,
+        "largest_days": largest_days,
+        "smallest_days": smallest_days,
+        "hourly": hourlyAverage(db),
+        "hourly_highest": hourlyAverage(days(largest_days)),
+        "hourly_lowest": hourlyAverage(days(smallest_days)),
+    }
+
+def analyzeBA(ba_idx, year_start, year_end, n_days=10, dataset=None):
+    if dataset is None:
+        dataset = download_and_process.defaultDataset()
+    db = dataset.extractBARange(ba_idx, year_start, year_end)
+    return analyzeBAYear(ba_idx, db, n_days, dataset)
+
+# Worker side of the shared store, attached once per worker process as its
+# default dataset
+def attachStore(kind, arg):
+    if kind == "cache":
+        cache_path = arg
+        store = CachedSeriesStore(cache_path, readManifest(cache_path))
+    else:
+        index, blocks = arg
+        arrays = []
+        for name, shape, dtype in blocks:
+            shm = shared_memory.SharedMemory(name=name)
+            arrays.append(np.ndarray(shape, dtype=dtype, buffer=shm.buf))
+            attachStore.blocks.append(shm)
+        store = EIASeriesStore(index, arrays[0], arrays[1])
+    download_and_process.setDefaultDataset(EIADataset.fromStore(store))
+attachStore.blocks = []
+
+# Analyze the balancing authorities in ba_idx_list (see analyzeBAYear) between
+# year_start and year_end, using dataset (an EIADataset), by default the data
+# prepared with prepareEIAData.
+# With processes > 1 the BAs are spread over a process pool.
+# Returns a dict from BA to its analysis (None for BAs without wind or solar)
+def analyzeBAs(ba_idx_list, year_start, year_end, n_days=10, processes=None, dataset=None):
+    if dataset is None:
+        dataset = download_and_process.defaultDataset()
+    ba_idx_list = list(ba_idx_list)
+    if processes is None or processes <= 1:
+        return {ba_idx: analyzeBA(ba_idx, year_start, year_end, n_days, dataset)
+                for ba_idx in ba_idx_list}
+
+    store = dataset.store
+    blocks = []
+    try:
+        if isinstance(store, CachedSeriesStore):
+            initargs = ("cache", store.cache_path)
+        else:
+            specs = []
+            for array in (store.timestamps, store.values):
+                shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+                np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[:] = array
+                blocks.append(shm)
+                specs.append((shm.name, array.shape, array.dtype.str))
+            initargs = ("shared", (store.index, specs))
+
+        with process_pool(processes, initializer=attachStore, initargs=initargs) as executor:
+            results = executor.map(analyzeBA, ba_idx_list, [year_start] * len(ba_idx_list),
+                                   [year_end] * len(ba_idx_list), [n_days] * len(ba_idx_list))
+            return dict(zip(ba_idx_list, results))
+    finally:
+        for shm in blocks:
+            shm.close()
+            shm.unlink()
+
+# One row per analyzed BA with its average daily wind and solar generation
+# and the total of its highest and lowest days
+def summarizeBAs(results):
+    rows = {}
+    for ba_idx, result in results.items():
+        if result is None:
+            continue
+        daily = result["daily"]
+        ren = daily.sum(axis=1)
+        rows[ba_idx] = {
+            "avg_daily_WND": daily["WND"].mean(),
+            "avg_daily_SUN": daily["SUN"].mean(),
+            "largest_days_avg": ren[result["largest_days"]].mean(),
+            "smallest_days_avg": ren[result["smallest_days"]].mean(),
+        }
+    return pd.DataFrame.from_dict(rows, orient="index")
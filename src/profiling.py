@@ -0,0 +1,145 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import atexit
+import functools
+import json
+import os
+import resource
+import threading
+import time
+from collections import defaultdict
+
+# Opt-in instrumentation of the pipeline stages (EIA preparation and range
+# extraction, battery simulation and sizing, carbon aware scheduling).
+#
+# Enable it around a piece of code:
+#   with profiling.profile() as prof:
+#       ...
+#   prof.summary(); prof.to_json("profile.json"); prof.to_chrome_trace("trace.json")
+# or for a whole run with environment variables, written at exit:
+#   CARBON_EXPLORER_PROFILE=profile.json   per stage summary and counters
+#   CARBON_EXPLORER_TRACE=trace.json       Chrome trace (chrome://tracing, Perfetto)
+#
+# When profiling is off, an instrumented function costs one extra call and
+# a check of a global, count() a check of a global.
+
+# Recorded stages (one event per call) and counters
+class Profiler:
+    def __init__(self):
+        self.events = [] # (name, start s, duration s, thread id, max rss MB at the end)
+        self.counters = defaultdict(int)
+        self.origin = time.perf_counter()
+
+    def add_event(self, name, start, duration, rss_mb):
+        self.events.append((name, start - self.origin, duration, threading.get_ident(), rss_mb))
+
+    # per stage call count, total and max time and memory high-water mark
+    def summary(self):
+        stages = {}
+        for name, _, duration, _, rss_mb in self.events:
+            entry = stages.setdefault(name, {"calls": 0, "total_s": 0.0, "max_s": 0.0, "max_rss_mb": 0.0})
+            entry["calls"] += 1
+            entry["total_s"] += duration
+            entry["max_s"] = max(entry["max_s"], duration)
+            entry["max_rss_mb"] = max(entry["max_rss_mb"], rss_mb)
+        return {"stages": stages, "counters": dict(self.counters)}
+
+    def to_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=1)
+
+    # Chrome trace event format, counters are written as metadata
+    def to_chrome_trace(self, path):
+        pid = os.getpid()
+        events = [{
+            "name": name,
+            "cat": name.split(".")[0],
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": duration * 1e6,
+            "pid": pid,
+            "tid": tid,
+            "args": {"max_rss_mb": rss_mb},
+        } for name, start, duration, tid, rss_mb in self.events]
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms",
+                       "otherData": {"counters": dict(self.counters)}}, f)
+
+_active = None
+
+def active():
+    return _active
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+# Context manager that records everything run inside it,
+# profiles nest into the outermost one
+class profile:
+    def __init__(self):
+        self.profiler = None
+        self.previous = None
+
+    def __enter__(self):
+        global _active
+        self.previous = _active
+        if _active is None:
+            _active = Profiler()
+        self.profiler = _active
+        return self.profiler
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self.previous
+        return False
+
+# Time a block as stage name, no-op when profiling is off
+class stage:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.profiler = _active
+        if self.profiler is not None:
+            self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if self.profiler is not None:
+            self.profiler.add_event(self.name, self.start, time.perf_counter() - self.start, max_rss_mb())
+        return False
+
+# Decorator recording every call of a function as stage name
+def instrument(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _active is None:
+                return func(*args, **kwargs)
+            profiler = _active
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.add_event(name, start, time.perf_counter() - start, max_rss_mb())
+        return wrapper
+    return decorator
+
+# Add n to counter name, no-op when profiling is off
+def count(name, n=1):
+    if _active is not None:
+        _active.counters[name] += n
+
+# Environment variable activation, the results are written at exit
+def _write_at_exit(profiler, summary_path, trace_path):
+    if summary_path:
+        profiler.to_json(summary_path)
+    if trace_path:
+        profiler.to_chrome_trace(trace_path)
+
+if os.environ.get("CARBON_EXPLORER_PROFILE") or os.environ.get("CARBON_EXPLORER_TRACE"):
+    _active = Profiler()
+    atexit.register(_write_at_exit, _active, os.environ.get("CARBON_EXPLORER_PROFILE"),
+                    os.environ.get("CARBON_EXPLORER_TRACE"))
@@ -0,0 +1,248 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+import functools
+import hashlib
+import inspect
+import os
+import pickle
+import sys
+import threading
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
+
+from . import profiling
+
+# Opt-in memoization of EIA range extractions, battery sizings and cas
+# schedules. Results are keyed on a hash of the content of all the inputs
+# (arrays and dataframes by value) and parameters, plus the version of the
+# EIA data they are computed from, so a rerun of an unchanged sweep reuses
+# them and any change to an input computes them again.
+#
+# Enable it around a piece of code:
+#   with result_cache.caching(max_bytes=1 << 30, disk_path="results") as cache:
+#       ...
+#   cache.stats()
+# or with result_cache.enable(...) / result_cache.disable(), or for a whole
+# run with CARBON_EXPLORER_CACHE=<directory> (on disk tier in that directory).
+#
+# Results are kept in memory in an LRU bounded by max_bytes and, with a
+# disk_path, pickled to disk where they survive the session.
+# When caching is off, a memoized function costs one extra call and a check
+# of a global.
+
+# Feed the content of obj into the hash
+def _feed(sha, obj):
+    sha.update(type(obj).__name__.encode())
+    if obj is None or isinstance(obj, (bool, int, float, complex, str, bytes, np.generic)):
+        sha.update(repr(obj).encode())
+    elif isinstance(obj, np.ndarray):
+        sha.update("{0}{1}".format(obj.dtype.str, obj.shape).encode())
+        sha.update(np.ascontiguousarray(obj).view(np.uint8).data)
+    elif isinstance(obj, (pd.Series, pd.DataFrame)):
+        if isinstance(obj, pd.DataFrame):
+            _feed(sha, list(obj.columns))
+            _feed(sha, [str(dtype) for dtype in obj.dtypes])
+        else:
+            _feed(sha, obj.name)
+            _feed(sha, str(obj.dtype))
+        _feed(sha, pd.util.hash_pandas_object(obj, index=True).to_numpy())
+    elif isinstance(obj, pd.Index):
+        _feed(sha, str(obj.dtype))
+        _feed(sha, pd.util.hash_pandas_object(obj).to_numpy())
+    elif isinstance(obj, (list, tuple)):
+        sha.update(str(len(obj)).encode())
+        for item in obj:
+            _feed(sha, item)
+    elif isinstance(obj, dict):
+        sha.update(str(len(obj)).encode())
+        for key in sorted(obj, key=repr):
+            _feed(sha, key)
+            _feed(sha, obj[key])
+    elif isinstance(obj, pd.Timestamp):
+        sha.update(repr(obj).encode())
+    elif hasattr(obj, "cache_key"):
+        # e.g. EIADataset, by what it declares its results depend on
+        _feed(sha, obj.cache_key())
+    elif hasattr(obj, "__dict__"):
+        # e.g. Battery and Battery2, by their attributes
+        _feed(sha, vars(obj))
+    else:
+        sha.update(pickle.dumps(obj))
+
+# Content hash of a function's name and arguments
+def content_key(name, arguments):
+    sha = hashlib.sha256(name.encode())
+    _feed(sha, arguments)
+    return sha.hexdigest()
+
+# Approximate memory footprint of a result, in bytes
+def _nbytes(value):
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, pd.Series):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(_nbytes(item) for item in value)
+    return sys.getsizeof(value)
+
+# Results are handed out as copies, so that callers may modify them
+def _copy(value):
+    if isinstance(value, (np.ndarray, pd.Series, pd.DataFrame)):
+        return value.copy()
+    if isinstance(value, tuple):
+        return tuple(_copy(item) for item in value)
+    if isinstance(value, list):
+        return [_copy(item) for item in value]
+    return value
+
+# Two tier result cache, an in memory LRU of at most max_bytes and an
+# optional directory of pickled results
+class ResultCache:
+    def __init__(self, max_bytes=1 << 28, disk_path=None):
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.entries = OrderedDict() # key: (value, bytes), least recently used first
+        self.bytes = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def _disk_file(self, key):
+        return os.path.join(self.disk_path, key[:2], key + ".pkl")
+
+    def _remember(self, key, value):
+        size = _nbytes(value)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.bytes -= evicted
+                self.evictions += 1
+
+    # returns (True, result) for a cached key, (False, None) otherwise
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, _copy(entry[0])
+        if self.disk_path is not None and os.path.exists(self._disk_file(key)):
+            with open(self._disk_file(key), "rb") as f:
+                value = pickle.load(f)
+            self.disk_hits += 1
+            self._remember(key, value)
+            return True, _copy(value)
+        self.misses += 1
+        return False, None
+
+    def put(self, key, value):
+        value = _copy(value)
+        self._remember(key, value)
+        if self.disk_path is not None:
+            path = self._disk_file(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + ".tmp", "wb") as f:
+                pickle.dump(value, f)
+            os.replace(path + ".tmp", path)
+
+    # returns the cached result of key, calling compute() on a miss
+    def lookup(self, key, compute):
+        found, value = self.get(key)
+        if found:
+            profiling.count("result_cache.hits")
+            return value
+        profiling.count("result_cache.misses")
+        value = compute()
+        self.put(key, value)
+        return value
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+        }
+
+    # drop the in memory results, the disk tier is kept
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+_active = None
+
+def active():
+    return _active
+
+def enable(max_bytes=1 << 28, disk_path=None):
+    global _active
+    _active = ResultCache(max_bytes, disk_path)
+    return _active
+
+def disable():
+    global _active
+    _active = None
+
+# Context manager that caches results inside it, nested ones share the
+# outermost cache
+class caching:
+    def __init__(self, max_bytes=1 << 28, disk_path=None):
+        self.max_bytes = max_bytes
+        self.disk_path = disk_path
+        self.previous = None
+
+    def __enter__(self):
+        global _active
+        self.previous = _active
+        if _active is None:
+            _active = ResultCache(self.max_bytes, self.disk_path)
+        return _active
+
+    def __exit__(self, *exc):
+        global _active
+        _active = self.previous
+        return False
+
+# Decorator caching the results of a function as name.
+# version(arguments) adds the version of data the function reads besides its
+# arguments to the key, calls for which bypass(arguments) is True (e.g. ones
+# with an output argument) are not cached. arguments maps every parameter
+# name of the function to its value, defaults included.
+def memoize(name, version=None, bypass=None):
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            cache = _active
+            if cache is None:
+                return func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            if bypass is not None and bypass(arguments):
+                return func(*args, **kwargs)
+            if version is not None:
+                arguments["__version__"] = version(arguments)
+            return cache.lookup(content_key(name, arguments), lambda: func(*args, **kwargs))
+        return wrapper
+    return decorator
+
+if os.environ.get("CARBON_EXPLORER_CACHE"):
+    _active = ResultCache(disk_path=os.environ["CARBON_EXPLORER_CACHE"])
@@ -2,32 +2,73 @@
 # This source code is licensed under the CC-BY-NC license found in the
 # LICENSE file in the root directory of this source tree.
 
+import multiprocessing
+import numpy as np
+import pandas as pd
+from concurrent.futures import ProcessPoolExecutor
+
 # Function that calculates pareto frontier given a set of points
-def pareto_frontier(Xs, Ys, maxX=True, maxY= True):
-    # Sort the list in descending order of X
-    tmp_list = sorted([[Xs[i], Ys[i]] for i in range(len(Xs))], reverse=maxX)
-    # Start with the first value in the sorted list
-    front_point = [tmp_list[0]]    
-    for pair in tmp_list[1:]:
-        if maxY is True: 
-            if pair[1] >= front_point[-1][1]:
-                front_point.append(pair)
-        else:
-            if pair[1] <= front_point[-1][1]:
-                front_point.append(pair)
-    frontX = [pair[0] for pair in front_point]
-    frontY = [pair[1] for pair in front_point]
-    return frontX, frontY
+# Points are sorted in descending order of X (ascending if maxX is False), a
+# point is on the frontier if its Y is at least (at most if maxY is False)
+# the Y of every point before it. Sorting is O(n log n), the scan a running
+# max/min over the sorted Ys.
+# returns the frontier X and Y lists, and with return_index an array of the
+# indices of the frontier points in Xs and Ys
+def pareto_frontier(Xs, Ys, maxX=True, maxY= True, return_index=False):
+    Xs = np.asarray(Xs)
+    Ys = np.asarray(Ys)
+    # Sort by X, then Y, descending for maxX
+    order = np.lexsort((Ys, Xs))
+    if maxX:
+        order = order[::-1]
+    sorted_Ys = Ys[order]
+    # The first point starts the front, every point after it is compared
+    # with the best Y before it
+    best = np.maximum.accumulate(sorted_Ys) if maxY else np.minimum.accumulate(sorted_Ys)
+    on_front = np.ones(order.shape[0], dtype=bool)
+    if maxY:
+        on_front[1:] = sorted_Ys[1:] >= best[:-1]
+    else:
+        on_front[1:] = sorted_Ys[1:] <= best[:-1]
+    front_idx = order[on_front]
+    if return_index:
+        return Xs[front_idx].tolist(), Ys[front_idx].tolist(), front_idx
+    return Xs[front_idx].tolist(), Ys[front_idx].tolist()
 
 
 # Given renewable and dc power dataframes,
 # calculate renewable coverage percentage (%)
-def calculate_coverage(df_ren, df_dc):
-    non_ren_mw = 0
-    for i in range(df_ren.shape[0]):
-        if df_dc.iloc[i] > df_ren.iloc[i]:
-            non_ren_mw = non_ren_mw + df_dc.iloc[i] - df_ren.iloc[i]
-    sum_dc = df_dc.sum()
+# df_ren may hold many scenarios at once, as columns of a dataframe or a
+# 2-D (hours x scenarios) array, df_dc is one dc power series shared by all
+# scenarios or one column per scenario. Scenarios are processed in blocks
+# to bound the size of the temporaries.
+# returns the coverage, per scenario for 2-D df_ren (a series for a dataframe)
+def calculate_coverage(df_ren, df_dc, block_size=1024):
+    ren = np.asarray(df_ren, dtype=np.float64)
+    dc = np.asarray(df_dc, dtype=np.float64)
+    sum_dc = np.nansum(dc, axis=0)
+    dc = dc[:ren.shape[0]]
+    if ren.ndim == 1:
+        # hours without data (nan) count as covered
+        non_ren_mw = np.fmax(dc - ren, 0).sum()
+    else:
+        if dc.ndim == 1:
+            dc = dc[:, None]
+        non_ren_mw = np.empty(ren.shape[1])
+        for first in range(0, ren.shape[1], block_size):
+            block = slice(first, first + block_size)
+            deficit = np.subtract(dc[:, block] if dc.shape[1] > 1 else dc, ren[:, block])
+            non_ren_mw[block] = np.fmax(deficit, 0, out=deficit).sum(axis=0)
     coverage = (sum_dc - non_ren_mw) / sum_dc * 100
     # print("Renewable coverage ratio: ", coverage, "%")
+    if isinstance(df_ren, pd.DataFrame):
+        return pd.Series(coverage, index=df_ren.columns)
     return coverage
+
+# Process pool of the parallel sweeps and pipelines. Workers are spawned,
+# not forked: a process forked after numba's parallel kernels have started
+# their thread pool (e.g. after a battery sizing) hangs at exit. Scripts
+# using processes > 1 need an if __name__ == "__main__" guard.
+def process_pool(processes, initializer=None, initargs=()):
+    return ProcessPoolExecutor(max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+                               initializer=initializer, initargs=initargs)
@@ -0,0 +1,175 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# The array simulation engines against the per-minute Battery2 loop they
+# replace, with numba and as plain python.
+# Run from the repository root: python -m pytest tests
+
+import importlib.util
+import sys
+import numpy as np
+import pytest
+
+from src import battery
+from src.battery import Battery2
+
+# Each hour is advanced in closed form instead of in 60 sub steps, which
+# rounds differently: over 40 days of hourly data loads, adjusted renewables
+# and non renewable totals stay within ~5e-11 MWh of the per-minute loop.
+ATOL = 1e-8 # MWh
+RTOL = 1e-10
+
+# src.battery loaded again as if numba was not installed
+def _load_without_numba():
+    saved = sys.modules.get("numba")
+    sys.modules["numba"] = None
+    try:
+        spec = importlib.util.spec_from_file_location("src._battery_python", battery.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    finally:
+        if saved is None:
+            del sys.modules["numba"]
+        else:
+            sys.modules["numba"] = saved
+    assert module.njit is None
+    return module
+
+@pytest.fixture(scope="module", params=["numba", "python"])
+def engine(request):
+    if request.param == "numba":
+        if battery.njit is None:
+            pytest.skip("numba is not installed")
+        return battery
+    return _load_without_numba()
+
+# Per-minute loops of sim_battery_247 and apply_battery before the kernels
+def reference_sim(ren_mw, dc_mw, b, points_per_hour=60):
+    for i in range(dc_mw.shape[0]):
+        net_load = ren_mw[i] - dc_mw[i]
+        actual_discharge = 0
+        for j in range(points_per_hour):
+            if net_load > 0:
+                b.charge(net_load, 1/points_per_hour)
+            else:
+                actual_discharge += b.discharge(-net_load, 1/points_per_hour)
+        if net_load < 0 and actual_discharge < -net_load - 0.0001:
+            return False, b.current_load, i
+    return True, b.current_load, -1
+
+def reference_apply(ren_mw, dc_mw, b, points_per_hour=60):
+    tot_non_ren_mw = 0
+    ren_out = ren_mw.copy()
+    for i in range(dc_mw.shape[0]):
+        gap = dc_mw[i] - ren_mw[i]
+        discharged_amount = 0
+        for j in range(points_per_hour):
+            if gap > 0:
+                discharged_amount += b.discharge(gap, 1/points_per_hour)
+            else:
+                b.charge(-gap, 1/points_per_hour)
+                ren_out[i] += gap * (1 / points_per_hour)
+        if gap > 0:
+            tot_non_ren_mw = tot_non_ren_mw + gap - discharged_amount
+            ren_out[i] += discharged_amount
+    return tot_non_ren_mw, ren_out, b.current_load
+
+# Hourly solar-like supply with noise and a noisy dc power over days
+def hourly(days, seed):
+    rng = np.random.default_rng(seed)
+    t = np.arange(days * 24)
+    ren = np.clip(70 * np.sin(np.pi * ((t % 24) - 6) / 12), 0, None) * rng.uniform(0.5, 1, t.shape[0])
+    ren += rng.uniform(0, 30, t.shape[0])
+    dc = 40 + rng.normal(0, 4, t.shape[0])
+    return ren, dc
+
+# coefficients of the default cell and ones where both v limits bind
+PARAMS = [
+    {},
+    {"upper_u": -0.125, "upper_v": 0.9, "lower_u": 0.05, "lower_v": 0.1},
+]
+
+@pytest.mark.parametrize("coefficients", PARAMS)
+@pytest.mark.parametrize("capacity", [0, 20, 150, 600, 5000])
+def test_apply_battery_arrays(engine, capacity, coefficients):
+    ren, dc = hourly(40, seed=1)
+    b = Battery2(capacity, capacity, **coefficients)
+    expected = reference_apply(ren, dc, Battery2(capacity, capacity, **coefficients))
+    tot_non_ren_mw, ren_out, current_load = engine.apply_battery_arrays(
+        ren, dc, capacity, capacity, b.params())
+    np.testing.assert_allclose(tot_non_ren_mw, expected[0], rtol=RTOL, atol=ATOL)
+    np.testing.assert_allclose(ren_out, expected[1], rtol=RTOL, atol=ATOL)
+    np.testing.assert_allclose(current_load, expected[2], rtol=RTOL, atol=ATOL)
+
+@pytest.mark.parametrize("coefficients", PARAMS)
+@pytest.mark.parametrize("capacity, current_load", [(0, 0), (100, 0), (300, 150), (800, 800), (5000, 5000)])
+def test_sim_battery_247_arrays(engine, capacity, current_load, coefficients):
+    ren, dc = hourly(40, seed=2)
+    b = Battery2(capacity, current_load, **coefficients)
+    expected = reference_sim(ren, dc, Battery2(capacity, current_load, **coefficients))
+    feasible, load, fail_hour = engine.sim_battery_247_arrays(ren, dc, capacity, current_load, b.params())
+    assert (feasible, fail_hour) == (expected[0], expected[2])
+    np.testing.assert_allclose(load, expected[1], rtol=RTOL, atol=ATOL)
+
+def test_sim_battery_247_batch(engine):
+    scenarios = [hourly(20, seed) for seed in range(3)]
+    # enough supply for the larger batteries to carry the nights
+    ren = np.array([1.8 * s[0] for s in scenarios])
+    dc = np.array([s[1] for s in scenarios])
+    capacity = np.array([[0, 50, 200, 400, 1000]] * len(scenarios), dtype=float)
+    feasible = engine.sim_battery_247_batch(ren, dc, capacity, Battery2(0).params())
+    expected = [[reference_sim(ren[s], dc[s], Battery2(c, c))[0] for c in capacity[s]]
+                for s in range(len(scenarios))]
+    assert feasible.tolist() == expected
+    # the capacities span both outcomes
+    assert feasible.any() and not feasible.all()
+
+# Closed form hours around the step where the (u * power) + v limit starts
+# to bind, against stepping Battery2.charge/discharge
+STEPS = 60
+T_U = 1 / STEPS
+
+# loads a few steps and a few ulps around threshold
+def loads_around(threshold, step_load):
+    loads = [threshold + k * step_load for k in (-STEPS, -STEPS + 1, -2, -1, -0.5, 0, 0.5, 1, 2)]
+    loads += [np.nextafter(threshold, -np.inf), np.nextafter(threshold, np.inf)]
+    return loads
+
+@pytest.mark.parametrize("coefficients", PARAMS)
+@pytest.mark.parametrize("input_load", [5.0, 80.0, 1e4])
+def test_charge_steps_switch_point(engine, coefficients, input_load):
+    capacity = 200.0
+    b = Battery2(capacity, 0, **coefficients)
+    p = b.params()
+    rate_lim = min((capacity / p.eff_c) * p.c_lim, input_load)
+    threshold = p.upper_v * capacity - rate_lim * ((p.eff_c * T_U) - p.upper_u)
+    for load in loads_around(threshold, rate_lim * p.eff_c * T_U):
+        if not 0 <= load <= p.upper_v * capacity:
+            continue
+        reference = Battery2(capacity, load, **coefficients)
+        for _ in range(STEPS):
+            reference.charge(input_load, T_U)
+        got = engine._charge_steps(load, input_load, capacity, p.eff_c, p.c_lim,
+                                   p.upper_u, p.upper_v, T_U, STEPS)
+        np.testing.assert_allclose(got, reference.current_load, rtol=RTOL, atol=ATOL)
+
+@pytest.mark.parametrize("coefficients", PARAMS)
+@pytest.mark.parametrize("output_load", [5.0, 80.0, 1e4])
+def test_discharge_steps_switch_point(engine, coefficients, output_load):
+    capacity = 200.0
+    b = Battery2(capacity, 0, **coefficients)
+    p = b.params()
+    rate_lim = min((capacity / p.eff_d) * p.d_lim, output_load)
+    threshold = p.lower_v * capacity + rate_lim * (p.lower_u + (p.eff_d * T_U))
+    for load in loads_around(threshold, rate_lim * p.eff_d * T_U):
+        if not p.lower_v * capacity <= load <= capacity:
+            continue
+        reference = Battery2(capacity, load, **coefficients)
+        discharged = 0
+        for _ in range(STEPS):
+            discharged += reference.discharge(output_load, T_U)
+        got_load, got_discharged = engine._discharge_steps(load, output_load, capacity, p.eff_d, p.d_lim,
+                                                           p.lower_u, p.lower_v, T_U, STEPS)
+        np.testing.assert_allclose(got_load, reference.current_load, rtol=RTOL, atol=ATOL)
+        np.testing.assert_allclose(got_discharged, discharged, rtol=RTOL, atol=ATOL)
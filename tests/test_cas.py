@@ -0,0 +1,221 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# The window kernels of cas and cas_grid_mix against the per-hour loops they
+# replace, with numba and as plain python, and the rolling horizon scheduler
+# and the parameter sweep against the batch schedulers, and the closed form
+# optimal schedulers against a linear program.
+# Run from the repository root: python -m pytest tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import cas as cas_module
+from src.cas import cas, cas_grid_mix, cas_optimal, cas_grid_mix_optimal, cas_sweep
+from src.utils import calculate_coverage
+
+KERNELS = ["_cas_window", "_cas_grid_mix_window", "_cas_windows", "_cas_grid_mix_windows"]
+
+# src.cas with its numba kernels, or with their python functions
+@pytest.fixture(params=["numba", "python"])
+def engine(request, monkeypatch):
+    if request.param == "python":
+        if not hasattr(cas_module._cas_window, "py_func"):
+            pytest.skip("numba is not installed, the kernels are python already")
+        for name in KERNELS:
+            monkeypatch.setattr(cas_module, name, getattr(cas_module, name).py_func)
+    return cas_module
+
+# Per-hour loops of cas and cas_grid_mix before the window kernels, on the
+# hours of one window in time order, returns the shifted dc power
+def reference_cas(ren_mw, dc_mw, flexible_workload_ratio, max_capacity):
+    order = np.lexsort((dc_mw, ren_mw))
+    ren = ren_mw[order]
+    dc = dc_mw[order].copy()
+    start = 0
+    end = len(dc) - 1
+    work_to_move = 0
+    while start < end:
+        renewable_surplus = ren[end] - dc[end]
+        renewable_gap = dc[start] - ren[start]
+        available_space = min(renewable_surplus, max_capacity - dc[end])
+        if renewable_surplus <= 0:
+            end = end - 1
+            continue
+        if renewable_gap <= 0:
+            start = start + 1
+            continue
+        if work_to_move <= 0 and renewable_gap > 0:
+            work_to_move = min(renewable_gap, flexible_workload_ratio / 100 * dc[start])
+        if available_space > work_to_move:
+            dc[end] = dc[end] + work_to_move
+            dc[start] = dc[start] - work_to_move
+            start = start + 1
+            work_to_move = 0
+        else:
+            dc[end] = dc[end] + available_space
+            dc[start] = dc[start] - available_space
+            work_to_move = work_to_move - available_space
+            end = end - 1
+    out = np.empty_like(dc)
+    out[order] = dc
+    return out
+
+def reference_cas_grid_mix(carbon_intensity, dc_mw, flexible_workload_ratio, max_capacity):
+    order = np.lexsort((dc_mw, carbon_intensity))
+    dc = dc_mw[order].copy()
+    start = 0
+    end = len(dc) - 1
+    work_to_move = 0
+    while start < end:
+        available_space = max_capacity - dc[start]
+        if work_to_move <= 0:
+            work_to_move = flexible_workload_ratio / 100 * dc[end]
+        if available_space > work_to_move:
+            dc[start] = dc[start] + work_to_move
+            dc[end] = dc[end] - work_to_move
+            end = end - 1
+            work_to_move = 0
+        else:
+            dc[start] = max_capacity
+            dc[end] = dc[end] - available_space
+            work_to_move = work_to_move - available_space
+            start = start + 1
+    out = np.empty_like(dc)
+    out[order] = dc
+    return out
+
+# reference applied window by window, a shorter last window included
+def by_window(reference, key, dc_mw, flexible_workload_ratio, max_capacity, window):
+    return np.concatenate([reference(key[i:i + window], dc_mw[i:i + window],
+                                     flexible_workload_ratio, max_capacity)
+                           for i in range(0, len(dc_mw), window)])
+
+# Hourly frame in the layout cas expects: solar-like supply, noisy dc power
+# and a carbon intensity that is high when renewables are low
+def hourly(hours, seed):
+    rng = np.random.default_rng(seed)
+    t = np.arange(hours)
+    ren = np.clip(70 * np.sin(np.pi * ((t % 24) - 6) / 12), 0, None) * rng.uniform(0.5, 1, hours)
+    ren += rng.uniform(0, 30, hours)
+    dc = 40 + rng.normal(0, 4, hours)
+    return pd.DataFrame({
+        "index": t,
+        "tot_renewable": ren,
+        "avg_dc_power_mw": dc,
+        "carbon_intensity": 500 - 3 * ren + rng.normal(0, 10, hours),
+    })
+
+# (flexible_workload_ratio, max_capacity): max_capacity far above the load,
+# and close to the dc peaks, where many hours are filled up to it
+SETTINGS = [(30, 1000), (30, 60), (50, 45)]
+
+@pytest.mark.parametrize("flexible_workload_ratio, max_capacity", SETTINGS)
+@pytest.mark.parametrize("hours, window", [(24 * 20, 24), (24 * 20 + 7, 24), (24 * 7 + 5, 48)])
+def test_cas(engine, flexible_workload_ratio, max_capacity, hours, window):
+    df = hourly(hours, seed=1)
+    got = engine.cas(df, flexible_workload_ratio, max_capacity, window)
+    expected = by_window(reference_cas, df["tot_renewable"].to_numpy(), df["avg_dc_power_mw"].to_numpy(),
+                         flexible_workload_ratio, max_capacity, window)
+    np.testing.assert_allclose(got["avg_dc_power_mw"].to_numpy(), expected, rtol=1e-12, atol=1e-9)
+    assert got["tot_renewable"].equals(df["tot_renewable"])
+
+@pytest.mark.parametrize("flexible_workload_ratio, max_capacity", SETTINGS)
+@pytest.mark.parametrize("hours, window", [(24 * 20, 24), (24 * 20 + 7, 24), (24 * 7 + 5, 48)])
+def test_cas_grid_mix(engine, flexible_workload_ratio, max_capacity, hours, window):
+    df = hourly(hours, seed=2)
+    got = engine.cas_grid_mix(df, flexible_workload_ratio, max_capacity, window)
+    expected = by_window(reference_cas_grid_mix, df["carbon_intensity"].to_numpy(),
+                         df["avg_dc_power_mw"].to_numpy(), flexible_workload_ratio, max_capacity, window)
+    np.testing.assert_allclose(got["avg_dc_power_mw"].to_numpy(), expected, rtol=1e-12, atol=1e-9)
+
+# the settings above do reach max_capacity, and the load of every window is kept
+def test_max_capacity_binds():
+    df = hourly(24 * 20, seed=1)
+    for schedule in (cas(df, 50, 45), cas_grid_mix(df, 50, 45)):
+        dc_mw = schedule["avg_dc_power_mw"].to_numpy()
+        assert np.isclose(dc_mw, 45).sum() > 20
+        np.testing.assert_allclose(dc_mw.reshape(-1, 24).sum(axis=1),
+                                   df["avg_dc_power_mw"].to_numpy().reshape(-1, 24).sum(axis=1))
+
+# A rolling schedule fed hour by hour equals the batch schedule, whose last
+# window is as short as the open window
+@pytest.mark.parametrize("objective", ["renewable", "carbon"])
+@pytest.mark.parametrize("window", [24, 36])
+def test_rolling_cas(engine, objective, window):
+    df = hourly(24 * 5 + 11, seed=3)
+    rolling = engine.RollingCAS(30, 60, window, objective)
+    for i, row in enumerate(df.itertuples()):
+        open_schedule = rolling.add_hour(row.avg_dc_power_mw, row.tot_renewable, row.carbon_intensity)
+        assert len(open_schedule) == i % window + 1
+    batch = (cas if objective == "renewable" else cas_grid_mix)(df, 30, 60, window)
+    np.testing.assert_allclose(rolling.schedule(), batch["avg_dc_power_mw"].to_numpy(), rtol=1e-12)
+
+# Every row of a sweep equals the coverage and the average carbon intensity
+# of the cas or cas_grid_mix schedule at its grid point
+@pytest.mark.parametrize("objective", ["renewable", "carbon"])
+def test_cas_sweep(engine, objective):
+    df = hourly(24 * 10 + 7, seed=4)
+    ratios, capacities = [0, 30, 50], [45, 60, 1000]
+    sweep = engine.cas_sweep(df, ratios, capacities, objective)
+    assert sweep[["flexible_workload_ratio", "max_capacity"]].values.tolist() == \
+        [[r, c] for r in ratios for c in capacities]
+    scheduler = cas if objective == "renewable" else cas_grid_mix
+    for row in sweep.itertuples():
+        dc_mw = scheduler(df, row.flexible_workload_ratio, row.max_capacity)["avg_dc_power_mw"]
+        ci = df["carbon_intensity"]
+        assert np.isclose(row.coverage, calculate_coverage(df["tot_renewable"], dc_mw), rtol=1e-12)
+        assert np.isclose(row.avg_carbon_intensity, (ci * dc_mw).sum() / dc_mw.sum(), rtol=1e-12)
+
+def test_cas_sweep_processes():
+    df = hourly(24 * 10, seed=5)
+    serial = cas_sweep(df, [10, 30, 50], [45, 60], "carbon")
+    pd.testing.assert_frame_equal(cas_sweep(df, [10, 30, 50], [45, 60], "carbon", processes=2), serial)
+
+# nan where df_all has no carbon_intensity column
+def test_cas_sweep_missing_column():
+    df = hourly(24 * 3, seed=6).drop(columns="carbon_intensity")
+    sweep = cas_sweep(df, [30], [60])
+    assert sweep["avg_carbon_intensity"].isna().all() and sweep["coverage"].notna().all()
+
+# Per window sum of the hourly values, a shorter last window included
+def window_sums(values, window):
+    return np.add.reduceat(values, np.arange(0, len(values), window))
+
+# The closed form optimal schedules reach the minimum of the linear program
+# (scipy's HiGHS) in every window, keep the load of every window within the
+# move bounds, and are no worse than the greedy schedulers
+@pytest.mark.parametrize("flexible_workload_ratio, max_capacity", SETTINGS)
+@pytest.mark.parametrize("window", [24, 36])
+def test_cas_optimal(flexible_workload_ratio, max_capacity, window):
+    pytest.importorskip("scipy")
+    df = hourly(24 * 6 + 5, seed=7)
+    ren, dc = df["tot_renewable"].to_numpy(), df["avg_dc_power_mw"].to_numpy()
+    non_ren = lambda dc_mw: window_sums(np.fmax(dc_mw - ren, 0), window)
+    got = cas_optimal(df, flexible_workload_ratio, max_capacity, window)["avg_dc_power_mw"].to_numpy()
+    lp = cas_optimal(df, flexible_workload_ratio, max_capacity, window, solver="lp")["avg_dc_power_mw"].to_numpy()
+    np.testing.assert_allclose(non_ren(got), non_ren(lp), rtol=1e-9, atol=1e-6)
+    np.testing.assert_allclose(window_sums(got, window), window_sums(dc, window), rtol=1e-12)
+    assert (got >= dc * (1 - flexible_workload_ratio / 100) - 1e-9).all()
+    assert (got <= np.fmax(dc, max_capacity) + 1e-9).all()
+    greedy = cas(df, flexible_workload_ratio, max_capacity, window)["avg_dc_power_mw"].to_numpy()
+    assert (non_ren(got) <= non_ren(greedy) + 1e-9).all()
+
+@pytest.mark.parametrize("flexible_workload_ratio, max_capacity", SETTINGS)
+@pytest.mark.parametrize("window", [24, 36])
+def test_cas_grid_mix_optimal(flexible_workload_ratio, max_capacity, window):
+    pytest.importorskip("scipy")
+    df = hourly(24 * 6 + 5, seed=8)
+    ci, dc = df["carbon_intensity"].to_numpy(), df["avg_dc_power_mw"].to_numpy()
+    carbon = lambda dc_mw: window_sums(ci * dc_mw, window)
+    got = cas_grid_mix_optimal(df, flexible_workload_ratio, max_capacity, window)["avg_dc_power_mw"].to_numpy()
+    lp = cas_grid_mix_optimal(df, flexible_workload_ratio, max_capacity, window,
+                              solver="lp")["avg_dc_power_mw"].to_numpy()
+    np.testing.assert_allclose(carbon(got), carbon(lp), rtol=1e-9)
+    np.testing.assert_allclose(window_sums(got, window), window_sums(dc, window), rtol=1e-12)
+    assert (got >= dc * (1 - flexible_workload_ratio / 100) - 1e-9).all()
+    assert (got <= np.fmax(dc, max_capacity) + 1e-9).all()
+    greedy = cas_grid_mix(df, flexible_workload_ratio, max_capacity, window)["avg_dc_power_mw"].to_numpy()
+    assert (carbon(got) <= carbon(greedy) * (1 + 1e-12)).all()
@@ -0,0 +1,138 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Fast path of the EIA timestamp parser against pandas, the pyarrow and
+# line by line readers of EBA.txt against each other, and the incremental
+# refresh of the series cache against a fresh preparation.
+# Run from the repository root: python -m pytest tests
+
+import json
+import os
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.download_and_process import EIADataset
+from src.eia_store import parseEIATimestamps, readEBATable, readEBAFrame, buildSeriesStore
+from src.eia_store import CachedSeriesStore, readManifest
+
+def pandas_timestamps(stamps):
+    return np.asarray(pd.to_datetime(stamps, format="%Y%m%dT%HZ", utc=True).asi8, dtype=np.int64)
+
+# every hour around the end of each month of leap and common years,
+# including the century years 1900 (common) and 2000 (leap)
+@pytest.mark.parametrize("year", [1900, 2000, 2019, 2020, 2021, 2024])
+def test_month_ends(year):
+    hours = pd.date_range("{0}-01-01".format(year), "{0}-12-31 23:00".format(year), freq="H")
+    month_ends = hours[(hours + pd.Timedelta(days=2)).month != hours.month]
+    stamps = list(month_ends.strftime("%Y%m%dT%HZ"))
+    np.testing.assert_array_equal(parseEIATimestamps(stamps), pandas_timestamps(stamps))
+
+# unsorted stamps of months of different lengths mixed in one call
+def test_mixed_months():
+    rng = np.random.default_rng(0)
+    hours = pd.date_range("1999-12-01", "2021-03-31 23:00", freq="H")
+    stamps = list(hours[rng.choice(len(hours), 5000)].strftime("%Y%m%dT%HZ"))
+    stamps += ["20000229T23Z", "20200229T00Z", "20210228T23Z", "20210331T12Z", "20210430T05Z"]
+    np.testing.assert_array_equal(parseEIATimestamps(stamps), pandas_timestamps(stamps))
+
+# days past the end of their month are rejected like pandas does, not rolled
+# over into the next month
+@pytest.mark.parametrize("stamp", ["20210229T00Z", "19000229T00Z", "21000229T00Z", "20210431T00Z",
+                                   "20211131T10Z", "20210132T00Z"])
+def test_invalid_day(stamp):
+    stamps = ["20210101T00Z", stamp]
+    with pytest.raises(ValueError):
+        pandas_timestamps(stamps)
+    with pytest.raises(ValueError):
+        parseEIATimestamps(stamps)
+
+# EBA.txt lines of hourly series, values as strings or as numbers (as in
+# EIA's files), some null
+def write_eba(path, hours, as_strings, bas=("CISO", "BPAT")):
+    rng = np.random.default_rng(0)
+    stamps = list(pd.date_range("2020-02-27", periods=hours, freq="H").strftime("%Y%m%dT%HZ")[::-1])
+    with open(path, "w") as f:
+        f.write(json.dumps({"category_id": 0, "childseries": []}) + "\n")
+        for ba in bas:
+            for sid in ("EBA.{0}-ALL.NG.WND.H".format(ba), "EBA.{0}-ALL.NG.SUN.H".format(ba),
+                        "EBA.{0}-ALL.D.H".format(ba)):
+                values = rng.integers(-5, 5000, hours)
+                data = [[stamp, None if value % 50 == 0 else (str(value) if as_strings else int(value))]
+                        for stamp, value in zip(stamps, values.tolist())]
+                f.write(json.dumps({"series_id": sid, "start": stamps[-1], "end": stamps[0],
+                                    "data": data}) + "\n")
+
+def assert_same_store(a, b):
+    assert list(a.index) == list(b.index)
+    for sid in a.index:
+        for x, y in zip(a.get(sid), b.get(sid)):
+            np.testing.assert_array_equal(x, y)
+
+def test_numeric_values_fall_back(tmp_path):
+    write_eba(tmp_path / "strings.txt", 100, as_strings=True)
+    write_eba(tmp_path / "numbers.txt", 100, as_strings=False)
+    table = readEBATable(str(tmp_path / "strings.txt"))
+    assert readEBATable(str(tmp_path / "numbers.txt")) is None
+    eba_json, store = readEBAFrame(str(tmp_path / "numbers.txt"))
+    assert list(eba_json.series_id.dropna()) == list(table.to_pandas().series_id.dropna())
+    assert_same_store(store, buildSeriesStore(table))
+    # nulls are nan, the series are sorted by time
+    timestamps, values = store.get("EBA.CISO-ALL.NG.WND.H")
+    assert np.isnan(values).any() and (np.diff(timestamps) > 0).all()
+
+# series longer than the block size are read again with larger blocks
+def test_series_longer_than_block(tmp_path):
+    write_eba(tmp_path / "EBA.txt", 2000, as_strings=True)
+    table = readEBATable(str(tmp_path / "EBA.txt"), block_size=1 << 14)
+    assert_same_store(buildSeriesStore(table), buildSeriesStore(readEBATable(str(tmp_path / "EBA.txt"))))
+
+# EBA.txt of the first hours of a feed, each value only depends on its
+# series and hour so that a longer feed extends a shorter one
+def write_feed(path, hours, bas):
+    stamps = list(pd.date_range("2020-02-27", periods=hours, freq="H").strftime("%Y%m%dT%HZ")[::-1])
+    with open(path, "w") as f:
+        for k, ba in enumerate(bas):
+            for j, sid in enumerate(("EBA.{0}-ALL.NG.WND.H".format(ba), "EBA.{0}-ALL.NG.SUN.H".format(ba),
+                                     "EBA.{0}-ALL.D.H".format(ba))):
+                values = (np.arange(hours)[::-1] * 37 + k * 101 + j * 11) % 5000
+                data = [[stamp, None if value % 50 == 0 else str(value)]
+                        for stamp, value in zip(stamps, values.tolist())]
+                f.write(json.dumps({"series_id": sid, "start": stamps[-1], "end": stamps[0],
+                                    "data": data}) + "\n")
+
+# Refreshes appending a few hours at a time (and a new BA) give the series of
+# a fresh preparation of the last file, also once the partitions of the
+# series are merged (after max_parts appends)
+def test_incremental_refresh(tmp_path):
+    data_path = tmp_path / "data"
+    data_path.mkdir()
+    write_feed(data_path / "EBA.txt", 200, ("CISO", "BPAT"))
+    dataset = EIADataset(str(data_path), use_cache=True)
+    dataset.prepare()
+    for i in range(12):
+        hours = 200 + 7 * (i + 1)
+        write_feed(tmp_path / "EBA.txt", hours, ("CISO", "BPAT", "ERCO") if i >= 5 else ("CISO", "BPAT"))
+        eba_json, ba_list, ts_list = dataset.refresh(str(tmp_path))
+        # appended to the cache, not prepared again
+        assert eba_json is None and isinstance(dataset.store, CachedSeriesStore)
+        manifest = readManifest(str(data_path / "EBA_cache"))
+        assert max(len(partitions) for partitions in manifest["partitions"].values()) <= 8
+
+        fresh_path = tmp_path / "fresh"
+        fresh_path.mkdir(exist_ok=True)
+        write_feed(fresh_path / "EBA.txt", hours, ("CISO", "BPAT", "ERCO") if i >= 5 else ("CISO", "BPAT"))
+        fresh = EIADataset(str(fresh_path))
+        _, fresh_ba_list, fresh_ts_list = fresh.prepare()
+        assert (list(ba_list), list(ts_list)) == (list(fresh_ba_list), list(fresh_ts_list))
+        assert sorted(manifest["partitions"]) == sorted(fresh.store.index)
+        for sid in fresh.store.index:
+            for x, y in zip(dataset.store.get(sid), fresh.store.get(sid)):
+                np.testing.assert_array_equal(x, y)
+
+    # merged partitions are removed from the cache
+    files = [os.path.relpath(os.path.join(root, name), data_path / "EBA_cache")
+             for root, _, names in os.walk(data_path / "EBA_cache") for name in names]
+    partitions = [p for partitions in manifest["partitions"].values() for p in partitions]
+    assert sorted(files) == sorted(partitions + ["manifest.json"])
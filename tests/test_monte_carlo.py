@@ -0,0 +1,74 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# Monte Carlo battery sizing: the bootstrap of synthetic years, and results
+# that only depend on the seed, with and without a process pool.
+# Run from the repository root: python -m pytest tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.monte_carlo import bootstrap_candidates, monte_carlo_battery_capacity
+
+# Two years of hourly solar-like supply with days of varying strength, and
+# 30 days of dc power
+def history(seed=0):
+    rng = np.random.default_rng(seed)
+    t = np.arange(24 * 730)
+    ren = np.clip(90 * np.sin(np.pi * ((t % 24) - 6) / 12), 0, None)
+    ren *= np.repeat(rng.uniform(0.5, 1.5, 730), 24)
+    dc = pd.DataFrame({"avg_dc_power_mw": 30 + rng.normal(0, 2, 24 * 30)})
+    return ren, dc
+
+# candidates are history blocks near the same day of the year, padded with -1
+def test_bootstrap_candidates():
+    candidates, counts = bootstrap_candidates(730, 365, block_days=7, season_days=15)
+    assert candidates.shape[0] == 53
+    for p, (row, count) in enumerate(zip(candidates, counts)):
+        assert (row[count:] == -1).all()
+        starts = row[:count]
+        assert ((starts >= 0) & (starts <= 730 - 7)).all()
+        distance = np.abs(starts - 7 * p) % 365
+        assert (np.minimum(distance, 365 - distance) <= 15).all()
+
+def test_bootstrap_short_history():
+    with pytest.raises(ValueError):
+        bootstrap_candidates(5, 365, block_days=7)
+
+def test_seed_reproducible():
+    ren, dc = history()
+    capacities, summary = monte_carlo_battery_capacity(ren, dc, 1e5, num_samples=12, seed=1)
+    again, summary_again = monte_carlo_battery_capacity(ren, dc, 1e5, num_samples=12, seed=1)
+    np.testing.assert_array_equal(capacities, again)
+    pd.testing.assert_series_equal(summary, summary_again)
+    # samples differ from each other and between seeds
+    assert np.unique(capacities).shape[0] > 1
+    other, _ = monte_carlo_battery_capacity(ren, dc, 1e5, num_samples=12, seed=2)
+    assert not np.array_equal(capacities, other)
+    # percentiles are capacities of the samples
+    assert list(summary.index) == ["P50", "P90", "P99"]
+    assert np.isin(summary.to_numpy(), capacities).all()
+    assert summary.is_monotonic_increasing
+
+# the samples spread over a process pool give the same capacities
+def test_processes():
+    ren, dc = history()
+    capacities, summary = monte_carlo_battery_capacity(ren, dc, 1e5, num_samples=12, seed=3)
+    pooled, pooled_summary = monte_carlo_battery_capacity(ren, dc, 1e5, num_samples=12, seed=3,
+                                                          processes=2)
+    np.testing.assert_array_equal(capacities, pooled)
+    pd.testing.assert_series_equal(summary, pooled_summary)
+
+# samples needing more than max_bsize are nan, and the percentiles beyond
+# the share of samples that fit are inf
+def test_max_bsize_too_small():
+    ren, dc = history()
+    capacities, _ = monte_carlo_battery_capacity(ren, dc, 1e5, num_samples=12, seed=1)
+    max_bsize = np.sort(capacities)[5] + 1e-6
+    limited, summary = monte_carlo_battery_capacity(ren, dc, max_bsize, num_samples=12, seed=1)
+    np.testing.assert_array_equal(np.isnan(limited), capacities > max_bsize)
+    # half of the samples fit
+    assert np.isnan(limited).sum() == 6
+    assert summary["P50"] == np.nanmax(limited) and summary["P90"] == np.inf
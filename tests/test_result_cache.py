@@ -0,0 +1,109 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# The result cache: content keys, the in memory LRU bounded by bytes, the
+# disk tier and memoized functions.
+# Run from the repository root: python -m pytest tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src import result_cache
+from src.result_cache import ResultCache, content_key
+
+# memoized functions see no cache from CARBON_EXPLORER_CACHE
+@pytest.fixture(autouse=True)
+def no_active_cache(monkeypatch):
+    monkeypatch.setattr(result_cache, "_active", None)
+
+def array(kb, value=0):
+    return np.full(kb * 128, value, dtype=np.float64)
+
+def test_content_key():
+    df = pd.DataFrame({"a": [1.0, 2.0], "b": [3, 4]})
+    assert content_key("f", {"df": df}) == content_key("f", {"df": df.copy()})
+    assert content_key("f", {"df": df}) != content_key("g", {"df": df})
+    changed = df.copy()
+    changed.loc[1, "a"] = 2.5
+    assert content_key("f", {"df": df}) != content_key("f", {"df": changed})
+    assert content_key("f", {"x": np.arange(3)}) != content_key("f", {"x": np.arange(3.0)})
+    assert content_key("f", {"x": 1, "y": 2}) == content_key("f", {"y": 2, "x": 1})
+
+# least recently used results are evicted once max_bytes is exceeded
+def test_lru_eviction():
+    cache = ResultCache(max_bytes=3 * 1024)
+    for key in "abc":
+        cache.put(key, array(1))
+    assert cache.stats()["bytes"] == 3 * 1024
+    assert cache.get("a")[0] # a is now the most recently used
+    cache.put("d", array(1))
+    assert not cache.get("b")[0]
+    assert all(cache.get(key)[0] for key in "acd")
+    # a large result evicts several, one larger than max_bytes is not kept
+    cache.put("e", array(2))
+    assert [key for key in "acde" if cache.get(key)[0]] == ["d", "e"]
+    cache.put("f", array(4))
+    assert not cache.get("f")[0]
+    stats = cache.stats()
+    assert (stats["evictions"], stats["entries"], stats["bytes"]) == (3, 2, 3 * 1024)
+
+# results are handed out and stored as copies
+def test_copies():
+    cache = ResultCache()
+    value = array(1)
+    cache.put("a", value)
+    value[0] = 1
+    found, cached = cache.get("a")
+    assert found and cached[0] == 0
+    cached[0] = 2
+    assert cache.get("a")[1][0] == 0
+
+# the disk tier outlives the in memory one, and refills it
+def test_disk_tier(tmp_path):
+    cache = ResultCache(max_bytes=1500, disk_path=str(tmp_path))
+    cache.put("a" * 64, array(1, 1))
+    cache.put("b" * 64, (array(1, 2), {"x": 1}))
+    assert (cache.stats()["evictions"], cache.stats()["entries"]) == (1, 1)
+    # evicted from memory, still on disk
+    assert cache.get("a" * 64)[0] and cache.stats()["disk_hits"] == 1
+
+    fresh = ResultCache(max_bytes=1 << 20, disk_path=str(tmp_path))
+    found, value = fresh.get("a" * 64)
+    assert found and (value == 1).all()
+    found, value = fresh.get("b" * 64)
+    assert found and (value[0] == 2).all() and value[1] == {"x": 1}
+    assert not fresh.get("c" * 64)[0]
+    assert fresh.get("a" * 64)[0]
+    stats = fresh.stats()
+    assert (stats["disk_hits"], stats["hits"], stats["misses"], stats["entries"]) == (2, 1, 1, 2)
+    fresh.clear()
+    assert fresh.stats()["entries"] == 0 and fresh.get("a" * 64)[0]
+
+def test_memoize():
+    calls = []
+
+    @result_cache.memoize("test.scale", version=lambda arguments: arguments["version"])
+    def scale(x, factor=2, version=0):
+        calls.append(factor)
+        return x * factor
+
+    x = np.arange(4.0)
+    scale(x)
+    scale(x)
+    assert len(calls) == 2 # no cache active
+    with result_cache.caching() as cache:
+        np.testing.assert_array_equal(scale(x), x * 2)
+        np.testing.assert_array_equal(scale(x, 2), x * 2) # defaults are part of the key
+        scale(x.copy())
+        scale(x, factor=3)
+        scale(x, version=1)
+        # nested caching shares the outer cache
+        with result_cache.caching() as inner:
+            assert inner is cache
+            scale(x)
+        assert result_cache.active() is cache
+    assert result_cache.active() is None
+    assert len(calls) == 5
+    assert (cache.stats()["hits"], cache.stats()["misses"]) == (3, 3)
@@ -0,0 +1,90 @@
+# Copyright (c) Meta Platforms, Inc. and affiliates.
+# This source code is licensed under the CC-BY-NC license found in the
+# LICENSE file in the root directory of this source tree.
+
+# pareto_frontier and calculate_coverage against the loops they replace.
+# Run from the repository root: python -m pytest tests
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from src.utils import calculate_coverage, pareto_frontier
+
+# Sorting loop of pareto_frontier before the vectorized scan
+def reference_pareto_frontier(Xs, Ys, maxX=True, maxY=True):
+    tmp_list = sorted([[Xs[i], Ys[i]] for i in range(len(Xs))], reverse=maxX)
+    front_point = [tmp_list[0]]
+    for pair in tmp_list[1:]:
+        if maxY is True:
+            if pair[1] >= front_point[-1][1]:
+                front_point.append(pair)
+        else:
+            if pair[1] <= front_point[-1][1]:
+                front_point.append(pair)
+    return [pair[0] for pair in front_point], [pair[1] for pair in front_point]
+
+# Per-hour loop of calculate_coverage before the vectorized sums
+def reference_coverage(df_ren, df_dc):
+    non_ren_mw = 0
+    for i in range(df_ren.shape[0]):
+        if df_dc.iloc[i] > df_ren.iloc[i]:
+            non_ren_mw = non_ren_mw + df_dc.iloc[i] - df_ren.iloc[i]
+    sum_dc = df_dc.sum()
+    return (sum_dc - non_ren_mw) / sum_dc * 100
+
+# points on a coarse grid, so that Xs and Ys tie
+def points(n, seed):
+    rng = np.random.default_rng(seed)
+    return rng.integers(0, 20, n).astype(float), rng.integers(0, 20, n).astype(float)
+
+@pytest.mark.parametrize("maxX", [True, False])
+@pytest.mark.parametrize("maxY", [True, False])
+@pytest.mark.parametrize("n", [1, 2, 50, 500])
+def test_pareto_frontier(maxX, maxY, n):
+    Xs, Ys = points(n, seed=n)
+    frontX, frontY = pareto_frontier(Xs, Ys, maxX, maxY)
+    assert isinstance(frontX, list) and isinstance(frontY, list)
+    assert (frontX, frontY) == reference_pareto_frontier(Xs, Ys, maxX, maxY)
+
+# the indices point at the frontier points, also for list and series inputs
+@pytest.mark.parametrize("maxX", [True, False])
+@pytest.mark.parametrize("maxY", [True, False])
+def test_pareto_frontier_index(maxX, maxY):
+    Xs, Ys = points(200, seed=1)
+    for xs, ys in [(Xs, Ys), (list(Xs), list(Ys)), (pd.Series(Xs), pd.Series(Ys))]:
+        frontX, frontY, idx = pareto_frontier(xs, ys, maxX, maxY, return_index=True)
+        assert (frontX, frontY) == pareto_frontier(xs, ys, maxX, maxY)
+        assert isinstance(idx, np.ndarray) and np.unique(idx).shape == idx.shape
+        assert frontX == Xs[idx].tolist() and frontY == Ys[idx].tolist()
+
+def hourly(hours, seed):
+    rng = np.random.default_rng(seed)
+    return pd.Series(rng.uniform(0, 100, hours)), pd.Series(40 + rng.normal(0, 5, hours))
+
+def test_calculate_coverage():
+    ren, dc = hourly(24 * 30, seed=0)
+    assert np.isclose(calculate_coverage(ren, dc), reference_coverage(ren, dc), rtol=1e-12)
+    assert calculate_coverage(ren + 100, dc) == 100
+    assert calculate_coverage(ren * 0, dc) == 0
+
+# dc power longer than the renewable supply: its extra hours count in the
+# total but are not compared
+def test_calculate_coverage_longer_dc():
+    ren, dc = hourly(100, seed=1)
+    longer = pd.concat([dc, dc], ignore_index=True)
+    assert np.isclose(calculate_coverage(ren, longer), reference_coverage(ren, longer), rtol=1e-12)
+
+# many scenarios at once, columns sharing one dc power series or each with
+# its own, processed in blocks smaller than the number of scenarios
+@pytest.mark.parametrize("own_dc", [False, True])
+def test_calculate_coverage_scenarios(own_dc):
+    rng = np.random.default_rng(2)
+    ren = pd.DataFrame(rng.uniform(0, 100, (24 * 10, 7)), columns=list("abcdefg"))
+    dc = 40 + rng.normal(0, 5, (24 * 10, 7)) if own_dc else hourly(24 * 10, seed=3)[1]
+    coverage = calculate_coverage(ren, dc, block_size=3)
+    assert isinstance(coverage, pd.Series) and list(coverage.index) == list(ren.columns)
+    for k, column in enumerate(ren.columns):
+        dc_k = pd.Series(dc[:, k]) if own_dc else dc
+        assert np.isclose(coverage[column], reference_coverage(ren[column], dc_k), rtol=1e-12)
+    np.testing.assert_array_equal(calculate_coverage(ren.to_numpy(), dc, block_size=3), coverage.to_numpy())